@@ -1,13 +1,23 @@
 # Python file to train RL Plant Allocation model
+from __future__ import annotations
 import gc
 import os
+import json
+import time
 import logging
 import random
 import argparse
+from typing import TYPE_CHECKING
 
-from stable_baselines3 import PPO
+import numpy as np
 
 from src.utils.type_allocation_env import plantTypeAllocationEnv
+from src.utils.metrics import record_latency
+from src.utils.numpy_policy import numpyPolicy
+
+# torch and stable-baselines3 are only imported for PPO models, so an exported numpyPolicy runs without them
+if TYPE_CHECKING:
+    from stable_baselines3 import PPO
 
 def parse_arguments():
     """
@@ -16,39 +26,232 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description="Training script for the RL model.")
     
     # Define the arguments
-    parser.add_argument('--model_name', type=str, default='plantTypeAllocationModel.zip', help='Zip File model name, defaults to plantTypeAllocationModel.zip')
+    parser.add_argument('--model_name', type=str, default='plantTypeAllocationModel.zip', help='Zip File model name (or an actor exported by src.export_policy, eg. plantTypeAllocationPolicy_float16.npz), defaults to plantTypeAllocationModel.zip')
     parser.add_argument('--model_folder', type=str, default='./src/models/', help='Folder path to model, defaults to ./src/models')
     parser.add_argument('--environment_octave', type=float, default=None, help='Environment octave for perlin noise, float range within 1 to 2, defaults to None (randomly create environment).')
     parser.add_argument('--environment_seed', type=int, default=None, help='Environment seed for perlin noise, defaults to None (randomly create environment).')
     parser.add_argument('--environment_context', type=int, default=0, help='Environment context, 0 for Road and 1 for Walkway. Defaults to 0.')
+    parser.add_argument('--beam_width', type=int, default=0, help='Number of partial layouts kept by the beam search, defaults to 0 (sample the actions instead).')
+    parser.add_argument('--beam_candidates', type=int, default=8, help='Number of actions expanded for every kept layout of the beam search, defaults to 8.')
+    parser.add_argument('--num_episodes', type=int, default=0, help='Number of seeded episodes of every context evaluated on a process pool, defaults to 0 (evaluate a single environment).')
+    parser.add_argument('--contexts', type=int, nargs='+', default=[0, 1], help='Contexts evaluated by --num_episodes, defaults to 0 1 (Road and Walkway).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the --num_episodes environments, defaults to 0.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes of --num_episodes, defaults to None (number of CPUs).')
+    parser.add_argument('--palette', type=str, default=None, help='JSON request (eg. tests/mock_input.json) used to hatch every --num_episodes layout for the valid composition rate, defaults to None (only check the number of planting coordinates).')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the --num_episodes report to, defaults to None (print only).')
+    parser.add_argument('--time_budget', type=float, default=None, help='Seconds before the beam search finishes its best layout greedily, defaults to None (no budget).')
 
 
     return parser.parse_args()
 
 
-def eval_model(model:PPO, eval_env:plantTypeAllocationEnv, show_results:bool=True, return_results:bool=True):
+def sample_action(model:PPO, obs, rng:np.random.Generator):
     """
-    Function to evaluate model onto a defined environment
+    Function to sample an action from the policy with a numpy generator instead of the global torch random state
+    Equivalent to model.predict(obs), but the same generator state always gives the same action and it is safe to call from multiple threads
 
     Args:
         model (PPO): trained PPO model
-        eval_env: environment to evaluate model on
-        show_results (bool, optional): Render final grid. Defaults to True.
+        obs (np.ndarray): environment observation
+        rng (np.random.Generator): generator used to sample the action
+
+    Returns:
+        action (np.ndarray): sampled action
+    """
+    return sample_actions(model, np.expand_dims(obs, 0), [rng])[0]
+
+
+def sample_actions(model:PPO, observations:np.ndarray, rngs:list):
+    """
+    Function to sample actions for a batch of observations with one policy forward pass
+    Every observation draws from its own generator, so each action is the same as sample_action on that observation alone
+
+    Args:
+        model (PPO): trained PPO model
+        observations (np.ndarray): (batch, *observation shape) environment observations
+        rngs (list): np.random.Generator of every observation
+
+    Returns:
+        actions (np.ndarray): (batch, action dimensions) sampled actions
+    """
+    # MultiDiscrete action space, sample every dimension from its categorical distribution with inverse transform sampling
+    cumulative_probabilities = [np.cumsum(probabilities, axis=1, dtype=np.float64) for probabilities in policy_probabilities(model, observations)]
+    actions = []
+    for index, rng in enumerate(rngs):
+        action = []
+        for dimension_probabilities in cumulative_probabilities:
+            cumulative = dimension_probabilities[index]
+            action_index = np.searchsorted(cumulative, rng.random() * cumulative[-1], side="right")
+            action.append(min(action_index, len(cumulative) - 1))
+        actions.append(action)
+    return np.array(actions)
+
+
+def action_probabilities(model:PPO, observations:np.ndarray):
+    """
+    Function to compute the joint probability of every (planting spot, class) action for a batch of observations
+
+    Args:
+        model (PPO): trained PPO model
+        observations (np.ndarray): (batch, maximum planting spots, 3) environment observations
+
+    Returns:
+        probabilities (np.ndarray): (batch, maximum planting spots, 3) joint action probabilities
+    """
+    spot_probabilities, class_probabilities = policy_probabilities(model, observations)
+    return spot_probabilities[:, :, None] * class_probabilities[:, None, :]
+
+
+def policy_probabilities(model:PPO | numpyPolicy, observations:np.ndarray):
+    """
+    Function to compute the categorical probabilities of every action dimension for a batch of observations with one policy forward pass
+
+    Args:
+        model (PPO | numpyPolicy): trained PPO model or its exported actor
+        observations (np.ndarray): (batch, *observation shape) environment observations
+
+    Returns:
+        probabilities (list): (batch, dimension size) probabilities of every action dimension
+    """
+    if isinstance(model, numpyPolicy):
+        return model.probabilities(observations)
+
+    import torch
+    obs_tensor, _ = model.policy.obs_to_tensor(observations)
+    with torch.no_grad():
+        distribution = model.policy.get_distribution(obs_tensor)
+    return [categorical.probs.cpu().numpy() for categorical in distribution.distribution]
+
+
+@record_latency("beam_search")
+def beam_search(model:PPO, eval_env:plantTypeAllocationEnv, beam_width:int=4, candidates:int=8, time_budget:float=None, show_results:bool=False, return_results:bool=True):
+    """
+    Function to evaluate the model with beam search instead of sampling one action per step
+    At every step the policy is run once for all beams, the candidates most likely actions of every beam are scored
+    with their reward (the observation value of the action, invalid actions are -1) and the beam_width best are stepped from snapshots of their beam
+    Once time_budget is exceeded, the best beam is finished with the most likely valid action of every step
+
+    Args:
+        model (PPO): trained PPO model
+        eval_env (plantTypeAllocationEnv): environment to evaluate model on
+        beam_width (int, optional): number of beams kept at every step. Defaults to 4.
+        candidates (int, optional): number of actions scored for every beam at every step. Defaults to 8.
+        time_budget (float, optional): seconds before the search falls back to the most likely actions. Defaults to None (no budget).
+        show_results (bool, optional): Render final grid. Defaults to False.
         return_results (bool, optional): Return the results (call environment.retrieve_results()). Defaults to True.
     """
+    total_reward = run_beam_search(model, eval_env, beam_width, candidates, time_budget)
+
+    logging.debug(f"Beam search completed in {eval_env.current_step} steps, total reward {total_reward}")
+    if show_results:
+        eval_env.render(True)
+    if return_results:
+        return eval_env.retrieve_results()
+
+
+def run_beam_search(model:PPO, eval_env:plantTypeAllocationEnv, beam_width:int=4, candidates:int=8, time_budget:float=None):
+    """
+    Function to run the beam search of beam_search, the environment is left in the state of the best beam
+
+    Returns:
+        total_reward (float): sum of the rewards of the best beam
+    """
+    start = time.perf_counter()
+    eval_env.reset()
+    # Beams are (total reward, state, done)
+    beams = [(0.0, eval_env.snapshot(), False)]
+
+    for _ in range(eval_env.max_step):
+        active = [beam for beam in beams if not beam[2]]
+        if not active or (time_budget is not None and time.perf_counter() - start > time_budget):
+            break
+
+        observations = np.stack([state.result_grid for _, state, _ in active])
+        probabilities = action_probabilities(model, observations)
+        probabilities[observations < 0] = 0
+        flat_probabilities = probabilities.reshape(len(active), -1)
+        top_actions = np.argsort(-flat_probabilities, axis=1, kind="stable")[:, :candidates]
+
+        # Finished beams compete with the expansions of the active beams
+        expansions = [(beam[0], None, beam) for beam in beams if beam[2]]
+        for beam_index, (total_reward, state, _) in enumerate(active):
+            for action_index in top_actions[beam_index]:
+                if flat_probabilities[beam_index, action_index] > 0:
+                    action = np.unravel_index(action_index, probabilities.shape[1:])
+                    expansions.append((total_reward + float(observations[beam_index][action]), action, active[beam_index]))
+        if not expansions:
+            break
+        expansions.sort(key=lambda expansion: expansion[0], reverse=True)
+
+        beams = []
+        for total_reward, action, parent in expansions[:beam_width]:
+            if action is None:
+                beams.append(parent)
+                continue
+            eval_env.restore(parent[1])
+            _, _, done, _, _ = eval_env.step(np.array(action))
+            beams.append((total_reward, eval_env.snapshot(), done))
+
+    total_reward, state, done = max(beams, key=lambda beam: beam[0])
+    eval_env.restore(state)
+    # Out of time, finish the best beam with the most likely valid actions
+    while not done:
+        observation = eval_env.result_grid
+        probabilities = action_probabilities(model, observation[None])[0]
+        probabilities[observation < 0] = 0
+        action = np.unravel_index(np.argmax(probabilities), probabilities.shape)
+        _, reward, done, _, _ = eval_env.step(np.array(action))
+        total_reward += reward
+
+    return total_reward
+
+
+def run_episode(model:PPO, eval_env:plantTypeAllocationEnv, rng:np.random.Generator=None):
+    """
+    Function to run one episode of the model on an environment
+
+    Args:
+        model (PPO): trained PPO model
+        eval_env (plantTypeAllocationEnv): environment to evaluate model on
+        rng (np.random.Generator, optional): generator used to sample the actions. Defaults to None (model.predict with the global torch random state).
+
+    Returns:
+        total_reward (float): sum of the rewards of the episode
+        steps (int): number of steps taken before the episode was done
+    """
     obs, info = eval_env.reset()
     total_reward = 0
 
     for i in range(eval_env.max_step):
         # Get action from the model
-        action, _ = model.predict(obs)  # Get the predicted action
+        if rng is None:
+            action, _ = model.predict(obs)  # Get the predicted action
+        else:
+            action = sample_action(model, obs, rng)
         obs, reward, done, trunacted, info = eval_env.step(action)  # Step the environment
         total_reward += reward  # Accumulate rewards
 
         if done:
             break
 
-    print(f"Model completed in {i} steps, total reward {total_reward}")
+    return total_reward, i + 1
+
+
+@record_latency("eval_model")
+def eval_model(model:PPO, eval_env:plantTypeAllocationEnv, show_results:bool=True, return_results:bool=True, rng:np.random.Generator=None):
+    """
+    Function to evaluate model onto a defined environment
+
+    Args:
+        model (PPO): trained PPO model
+        eval_env: environment to evaluate model on
+        show_results (bool, optional): Render final grid. Defaults to True.
+        return_results (bool, optional): Return the results (call environment.retrieve_results()). Defaults to True.
+        rng (np.random.Generator, optional): generator used to sample the actions. Defaults to None (model.predict with the global torch random state).
+    """
+    total_reward, steps = run_episode(model, eval_env, rng)
+
+    print(f"Model completed in {steps - 1} steps, total reward {total_reward}")
     if show_results:
         eval_env.render(True)
     if return_results:
@@ -56,6 +259,225 @@ def eval_model(model:PPO, eval_env:plantTypeAllocationEnv, show_results:bool=Tru
 
 
 
+@record_latency("eval_model_batched")
+def eval_model_batched(model:PPO, eval_envs:list, rngs:list=None):
+    """
+    Function to evaluate the model on several environments in lockstep, batching the policy forward pass across the environments
+    Used for the tiles of a large site, environments that are done stop stepping while the rest continue
+
+    Args:
+        model (PPO): trained PPO model
+        eval_envs (list): environments to evaluate the model on, all with the same observation space
+        rngs (list, optional): generator of every environment used to sample its actions. Defaults to None (model.predict with the global torch random state).
+
+    Returns:
+        results (list): eval_env.retrieve_results() of every environment
+    """
+    run_episodes_batched(model, eval_envs, rngs)
+    return [eval_env.retrieve_results() for eval_env in eval_envs]
+
+
+def run_episodes_batched(model:PPO, eval_envs:list, rngs:list=None, deterministic:bool=False):
+    """
+    Function to run one episode on every environment in lockstep, batching the policy forward pass across the environments
+
+    Args:
+        model (PPO): trained PPO model
+        eval_envs (list): environments to evaluate the model on, all with the same observation space
+        rngs (list, optional): generator of every environment used to sample its actions. Defaults to None (model.predict with the global torch random state).
+        deterministic (bool, optional): take the most likely action of the policy, only used without rngs. Defaults to False.
+
+    Returns:
+        total_rewards (list): sum of the rewards of every environment
+        steps (list): number of steps taken by every environment before it was done
+    """
+    observations = [eval_env.reset()[0] for eval_env in eval_envs]
+    total_rewards, steps = [0.0] * len(eval_envs), [0] * len(eval_envs)
+    active = list(range(len(eval_envs)))
+
+    for _ in range(max(eval_env.max_step for eval_env in eval_envs)):
+        batch = np.stack([observations[index] for index in active])
+        if rngs is None:
+            actions, _ = model.predict(batch, deterministic=deterministic)
+        else:
+            actions = sample_actions(model, batch, [rngs[index] for index in active])
+
+        still_active = []
+        for index, action in zip(active, actions):
+            observations[index], reward, done, _, _ = eval_envs[index].step(action)
+            total_rewards[index] += reward
+            steps[index] += 1
+            if not done:
+                still_active.append(index)
+        active = still_active
+        if not active:
+            break
+
+    return total_rewards, steps
+
+
+def load_policy(model_path:str, torch_threads:int=1):
+    """
+    Function to load a policy for inference, .npz files exported by src.export_policy are loaded without torch
+
+    Args:
+        model_path (str): path to the PPO zip file or the exported actor npz file
+        torch_threads (int, optional): number of torch threads of a PPO model. Defaults to 1.
+
+    Returns:
+        model (PPO | numpyPolicy): loaded policy
+    """
+    if model_path.endswith(".npz"):
+        return numpyPolicy.load(model_path)
+
+    import torch
+    from stable_baselines3 import PPO
+    torch.set_num_threads(torch_threads)
+    return PPO.load(model_path)
+
+
+# Per process instances of the evaluation pool, populated once by initialise_evaluation_worker
+evaluation_instances = {}
+
+def initialise_evaluation_worker(model_path:str, palette:dict=None, beam_search:tuple=(0, 8, None)):
+    """
+    Process pool initializer, loads the RL model once per evaluation worker process
+
+    Args:
+        model_path (str): path to the PPO zip file
+        palette (dict, optional): {"plant_palette", "style"} request used to hatch every layout, None to only check the number of planting coordinates. Defaults to None.
+        beam_search (tuple, optional): (beam width, candidates, time budget) of the evaluation, beam width 0 samples the actions instead. Defaults to (0, 8, None).
+    """
+    evaluation_instances["model"] = load_policy(model_path)
+    evaluation_instances["palette"] = palette
+    evaluation_instances["beam_search"] = beam_search
+
+
+def evaluation_worker_ready():
+    """
+    Function submitted once per evaluation worker so every worker is spawned and has loaded the model before the timing starts
+
+    Returns:
+        ready (bool): True if the worker has loaded its model
+    """
+    return "model" in evaluation_instances
+
+
+def evaluate_episode(context:int, episode_seed:int):
+    """
+    Function to evaluate the model on one seeded environment, environments and actions are drawn like generate_layout of the composition workers
+
+    Args:
+        context (int): 0 for road while 1 for walkway
+        episode_seed (int): seed of the environment octave, perlin seed and actions
+
+    Returns:
+        episode (dict): environment parameters, total reward, steps, planting coordinates, validity and seconds taken of the episode
+    """
+    start = time.perf_counter()
+    model, palette = evaluation_instances["model"], evaluation_instances["palette"]
+    beam_width, candidates, time_budget = evaluation_instances["beam_search"]
+
+    rng = np.random.default_rng(episode_seed)
+    octave, perlin_seed = rng.uniform(1, 2), rng.uniform(0, 50)
+    eval_env = plantTypeAllocationEnv(octave, context, perlin_seed, rng=rng)
+    if beam_width > 0:
+        total_reward = run_beam_search(model, eval_env, beam_width, candidates, time_budget)
+        steps = eval_env.current_step
+    else:
+        total_reward, steps = run_episode(model, eval_env, rng)
+    _, planting_grid, coordinates = eval_env.retrieve_results()
+
+    # Same threshold as hatch_layout, hatching is only run when a palette is given as it takes most of a composition
+    if palette is None:
+        valid = len(coordinates["Tree"]) + len(coordinates["Shrubs"]) > 10
+    else:
+        from src.utils.composition_worker import hatch_layout
+        surrounding = "Road" if context == 0 else "Walkway"
+        valid = hatch_layout((planting_grid, coordinates), palette["plant_palette"], palette.get("style") or "Naturalistic", surrounding, None, rng) is not None
+
+    return {
+        "context": context, "episode_seed": episode_seed, "octave": octave, "perlin_seed": perlin_seed,
+        "total_reward": float(total_reward), "steps": int(steps),
+        "trees": len(coordinates["Tree"]), "shrubs": len(coordinates["Shrubs"]),
+        "valid": valid, "seconds": time.perf_counter() - start,
+    }
+
+
+def summarise_episodes(episodes:list):
+    """
+    Function to summarise the evaluated episodes into reward and steps distributions
+
+    Args:
+        episodes (list): episodes from evaluate_episode
+
+    Returns:
+        summary (dict): number of episodes, reward and steps distributions, valid composition rate and mean planting coordinates
+    """
+    def distribution(values):
+        values = np.asarray(values, dtype=float)
+        percentiles = np.percentile(values, [5, 25, 50, 75, 95])
+        return {
+            "mean": float(values.mean()), "std": float(values.std()), "min": float(values.min()), "max": float(values.max()),
+            **{f"p{percentile}": float(value) for percentile, value in zip((5, 25, 50, 75, 95), percentiles)},
+        }
+
+    return {
+        "episodes": len(episodes),
+        "reward": distribution([episode["total_reward"] for episode in episodes]),
+        "steps_to_done": distribution([episode["steps"] for episode in episodes]),
+        "valid_composition_rate": float(np.mean([episode["valid"] for episode in episodes])),
+        "mean_trees": float(np.mean([episode["trees"] for episode in episodes])),
+        "mean_shrubs": float(np.mean([episode["shrubs"] for episode in episodes])),
+        "mean_episode_seconds": float(np.mean([episode["seconds"] for episode in episodes])),
+    }
+
+
+def evaluate_seeds(model_path:str, num_episodes:int, contexts:tuple=(0, 1), seed:int=0, workers:int=None, palette:dict=None, beam_search:tuple=(0, 8, None)):
+    """
+    Function to evaluate the model over many seeded environments of every context on a process pool
+
+    Args:
+        model_path (str): path to the PPO zip file
+        num_episodes (int): number of episodes of every context
+        contexts (tuple, optional): contexts to evaluate, 0 for road while 1 for walkway. Defaults to (0, 1).
+        seed (int, optional): seed of the episode seeds, the same seed evaluates the same environments. Defaults to 0.
+        workers (int, optional): number of worker processes. Defaults to None (number of CPUs).
+        palette (dict, optional): {"plant_palette", "style"} request used to check the valid composition rate by hatching. Defaults to None.
+        beam_search (tuple, optional): (beam width, candidates, time budget), beam width 0 samples the actions instead. Defaults to (0, 8, None).
+
+    Returns:
+        report (dict): evaluation settings, overall and per context summaries, episodes per second and every episode
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    episode_seeds = np.random.default_rng(seed).integers(0, 2**32, size=num_episodes).tolist()
+    jobs = [(context, episode_seed) for context in contexts for episode_seed in episode_seeds]
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=initialise_evaluation_worker,
+        initargs=(model_path, palette, beam_search),
+    ) as executor:
+        # Model loading is not counted in the throughput
+        if not all(future.result() for future in [executor.submit(evaluation_worker_ready) for _ in range(workers)]):
+            raise RuntimeError("An evaluation worker did not load the model.")
+        start = time.perf_counter()
+        episodes = list(executor.map(evaluate_episode, *zip(*jobs), chunksize=max(1, len(jobs) // (workers * 4))))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "model_path": model_path, "seed": seed, "workers": workers, "beam_search": list(beam_search), "hatching_checked": palette is not None,
+        "seconds": elapsed, "episodes_per_second": len(episodes) / elapsed,
+        "overall": summarise_episodes(episodes),
+        "contexts": {("Road" if context == 0 else "Walkway"): summarise_episodes([episode for episode in episodes if episode["context"] == context]) for context in contexts},
+        "episodes": episodes,
+    }
+
+
 def main():
     args = parse_arguments()
 
@@ -68,6 +490,22 @@ def main():
 
     model_path = os.path.join(model_folder, model_name)
 
+    if args.num_episodes > 0:
+        palette = None
+        if args.palette is not None:
+            with open(args.palette, 'r') as file:
+                palette = json.load(file)
+        report = evaluate_seeds(
+            model_path, args.num_episodes, tuple(args.contexts), args.seed, args.workers, palette,
+            (args.beam_width, args.beam_candidates, args.time_budget),
+        )
+        summary = {key: value for key, value in report.items() if key != "episodes"}
+        print(json.dumps(summary, indent=4))
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=4)
+        return
+
     # Setup Logger
     logging.basicConfig(
         filename= os.path.join('src/logs', 'eval.log'),
@@ -83,10 +521,13 @@ def main():
     logging.info(f"Successfully created environment, loading model from {model_path}")
     # Create Model
     gc.collect()
-    model = PPO.load(model_path)
+    model = load_policy(model_path)
     # Train model
     logging.info("Successfully loaded model, starting evaluation")
-    theme, grid, coordinates = eval_model(model, eval_env)
+    if args.beam_width > 0:
+        theme, grid, coordinates = beam_search(model, eval_env, args.beam_width, args.beam_candidates, args.time_budget, True)
+    else:
+        theme, grid, coordinates = eval_model(model, eval_env)
     logging.info(f"Evaluation completed.")
     logging.info(coordinates)
 
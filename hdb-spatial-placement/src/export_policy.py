@@ -0,0 +1,175 @@
+# Python file to export the actor of the RL Plant Allocation model with float16 or int8 weights for serving
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.torch_layers import FlattenExtractor
+
+from src.eval import sample_actions, action_probabilities, run_episode
+from src.utils.numpy_policy import numpyPolicy, quantize_weight
+from src.utils.eval_callback import layout_bank
+
+def parse_arguments():
+    """
+    Function defining all arguments for the data
+    """
+    parser = argparse.ArgumentParser(description="Export the actor of the RL model with compact weights.")
+
+    # Define the arguments
+    parser.add_argument('--model_path', type=str, default='src/models/plantTypeAllocationModel.zip', help='Path to the RL model zip file, defaults to src/models/plantTypeAllocationModel.zip')
+    parser.add_argument('--dtype', type=str, default='float16', choices=['float32', 'float16', 'int8'], help='Storage dtype of the exported weights, int8 weights have one scale per layer. Defaults to float16')
+    parser.add_argument('--output', type=str, default=None, help='npz file of the exported actor, defaults to src/models/plantTypeAllocationPolicy_<dtype>.npz')
+    parser.add_argument('--bank_episodes', type=int, default=32, help='Number of layouts of the bank used for the accuracy report, defaults to 32')
+    parser.add_argument('--report', type=str, default=None, help='JSON file to save the accuracy report to, defaults to None (print only)')
+
+    return parser.parse_args()
+
+
+def export_actor(model:PPO, path:str, dtype:str="int8"):
+    """
+    Function to save the actor network of a PPO MlpPolicy, the value network and optimizer state are dropped
+
+    Args:
+        model (PPO): trained PPO model
+        path (str): npz file to save the actor to
+        dtype (str, optional): float32, float16 or int8 storage of the weights. Defaults to "int8".
+    """
+    policy = model.policy
+    if not isinstance(policy.features_extractor, FlattenExtractor):
+        raise ValueError("Only MlpPolicy with a flatten features extractor can be exported")
+    if policy.activation_fn is not torch.nn.Tanh:
+        raise ValueError("Only tanh activations can be exported")
+
+    layers = [module for module in policy.mlp_extractor.policy_net if isinstance(module, torch.nn.Linear)] + [policy.action_net]
+    exported = {
+        "layers": np.array(len(layers)),
+        "action_dimensions": np.array(model.action_space.nvec),
+        "observation_shape": np.array(model.observation_space.shape),
+        "dtype": np.array(dtype),
+    }
+    for index, layer in enumerate(layers):
+        weight, scale = quantize_weight(layer.weight.detach().cpu().numpy(), dtype)
+        exported[f"weight_{index}"] = weight
+        exported[f"scale_{index}"] = np.array(scale, dtype=np.float32)
+        exported[f"bias_{index}"] = layer.bias.detach().cpu().numpy().astype(np.float32)
+    np.savez(path, **exported)
+
+
+def bank_observations(model:PPO, num_episodes:int):
+    """
+    Function to collect the observations of seeded episodes of the original model on the layout bank
+
+    Returns:
+        observations (np.ndarray): (steps, *observation shape) observations
+    """
+    eval_envs = layout_bank(num_episodes)
+    rngs = [np.random.default_rng(index) for index in range(len(eval_envs))]
+    observations = [eval_env.reset()[0] for eval_env in eval_envs]
+    collected = []
+    active = list(range(len(eval_envs)))
+    while active:
+        batch = np.stack([observations[index] for index in active])
+        collected.append(batch)
+        still_active = []
+        for index, action in zip(active, sample_actions(model, batch, [rngs[index] for index in active])):
+            observations[index], _, done, _, _ = eval_envs[index].step(action)
+            if not done:
+                still_active.append(index)
+        active = still_active
+    return np.concatenate(collected)
+
+
+def episode_outcomes(model, num_episodes:int):
+    """
+    Function to run seeded episodes of a policy on the layout bank
+
+    Returns:
+        outcomes (list): (total reward, grid) of every episode
+    """
+    outcomes = []
+    for index, eval_env in enumerate(layout_bank(num_episodes)):
+        total_reward, _ = run_episode(model, eval_env, np.random.default_rng(index))
+        outcomes.append((total_reward, eval_env.retrieve_results()[1]))
+    return outcomes
+
+
+def measure_load(model_path:str):
+    """
+    Function to measure the time and peak resident memory of loading a policy for serving in a new python process
+
+    Returns:
+        load (dict): seconds to import the inference modules and load the policy, peak resident memory in MB
+    """
+    # VmHWM is the peak resident memory of the new process, ru_maxrss would include the memory of this process before exec
+    code = (
+        "import json, re, time\n"
+        "start = time.perf_counter()\n"
+        "from src.eval import load_policy\n"
+        f"policy = load_policy({model_path!r})\n"
+        "seconds = time.perf_counter() - start\n"
+        "peak = int(re.search(r'VmHWM:\\s+(\\d+)', open('/proc/self/status').read()).group(1))\n"
+        "print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak / 1024}))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def accuracy_report(model:PPO, model_path:str, policy:numpyPolicy, policy_path:str, num_episodes:int=32):
+    """
+    Function to compare the exported actor with the original model on a fixed layout bank
+
+    Args:
+        model (PPO): original model
+        model_path (str): path to the original model zip file
+        policy (numpyPolicy): exported actor
+        policy_path (str): path to the exported actor npz file
+        num_episodes (int, optional): number of layouts in the bank. Defaults to 32.
+
+    Returns:
+        report (dict): action agreement and probability error on the bank observations, episode agreement and rewards, file size and serving load of both policies
+    """
+    observations = bank_observations(model, num_episodes)
+    original, exported = action_probabilities(model, observations), action_probabilities(policy, observations)
+    original_actions = original.reshape(len(observations), -1).argmax(axis=1)
+    exported_actions = exported.reshape(len(observations), -1).argmax(axis=1)
+
+    original_outcomes, exported_outcomes = episode_outcomes(model, num_episodes), episode_outcomes(policy, num_episodes)
+    return {
+        "observations": len(observations),
+        "action_agreement": float(np.mean(original_actions == exported_actions)),
+        "max_probability_error": float(np.abs(original - exported).max()),
+        "mean_total_variation": float(0.5 * np.abs(original - exported).reshape(len(observations), -1).sum(axis=1).mean()),
+        "identical_episodes": float(np.mean([np.array_equal(original_grid, exported_grid) for (_, original_grid), (_, exported_grid) in zip(original_outcomes, exported_outcomes)])),
+        "original_mean_reward": float(np.mean([reward for reward, _ in original_outcomes])),
+        "exported_mean_reward": float(np.mean([reward for reward, _ in exported_outcomes])),
+        "original_file_bytes": os.path.getsize(model_path),
+        "exported_file_bytes": os.path.getsize(policy_path),
+        "original_load": measure_load(model_path),
+        "exported_load": measure_load(policy_path),
+    }
+
+
+def main():
+    args = parse_arguments()
+    output = args.output or os.path.join(os.path.dirname(args.model_path), f"plantTypeAllocationPolicy_{args.dtype}.npz")
+
+    torch.set_num_threads(1)
+    model = PPO.load(args.model_path)
+    export_actor(model, output, args.dtype)
+    print(f"Exported {args.dtype} actor to {output}")
+
+    report = {"model_path": args.model_path, "policy_path": output, "dtype": args.dtype}
+    report.update(accuracy_report(model, args.model_path, numpyPolicy.load(output), output, args.bank_episodes))
+    print(json.dumps(report, indent=4))
+    if args.report is not None:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
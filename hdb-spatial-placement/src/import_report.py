@@ -0,0 +1,94 @@
+# Python file to report import times of the spatial placement service
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules imported by the API process and by the composition workers
+SERVICE_MODULES = [
+    "src.main",
+    "src.utils.composition_worker",
+    "src.eval",
+    "src.utils.type_allocation_env",
+    "src.utils.procedural_generation_env",
+    "src.utils.plant_hatching_assignment",
+]
+
+# Heavy modules that should only be imported by the workers (or not at all for matplotlib)
+WORKER_ONLY_MODULES = ["torch", "stable_baselines3", "gymnasium", "cv2", "scipy", "matplotlib"]
+
+def parse_arguments():
+    """
+    Function defining all arguments for the data
+    """
+    parser = argparse.ArgumentParser(description="Import time report for the spatial placement service.")
+
+    # Define the arguments
+    parser.add_argument('--modules', type=str, nargs='+', default=SERVICE_MODULES, help='Modules to report, defaults to the service modules.')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list for each module, defaults to 10.')
+    parser.add_argument('--max_main_import', type=float, default=None, help='Maximum import time of src.main in seconds, exits with status 1 if exceeded. Defaults to None (no check).')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the report to, defaults to None (print only).')
+
+    return parser.parse_args()
+
+
+def measure_import(module:str, top:int=10):
+    """
+    Function to measure the import time of a module in a fresh interpreter using python -X importtime
+
+    Args:
+        module (str): module to import
+        top (int, optional): number of slowest imports to return. Defaults to 10.
+
+    Returns:
+        report (dict): total import time (s), slowest imports (cumulative s) and worker only modules that were imported
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.getcwd()
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}: {process.stderr.strip().splitlines()[-1]}")
+
+    # Lines are formatted as: import time: self [us] | cumulative | imported package
+    imports = {}
+    for line in process.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)", line)
+        if match:
+            imports[match.group(4)] = int(match.group(2)) / 1e6
+
+    top_level_imports = {name: cumulative for name, cumulative in imports.items() if "." not in name}
+    slowest = sorted(top_level_imports.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "import_time": imports.get(module, 0.0),
+        "slowest_imports": dict(slowest),
+        "worker_only_modules_imported": [name for name in WORKER_ONLY_MODULES if name in imports]
+    }
+
+
+def main():
+    args = parse_arguments()
+
+    reports = [measure_import(module, args.top) for module in args.modules]
+    for report in reports:
+        print(f"{report['module']}: {report['import_time']:.3f}s")
+        for name, cumulative in report["slowest_imports"].items():
+            print(f"    {name}: {cumulative:.3f}s")
+        if report["worker_only_modules_imported"]:
+            print(f"    worker only modules imported: {', '.join(report['worker_only_modules_imported'])}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(reports, file, indent=4)
+
+    main_report = next((report for report in reports if report["module"] == "src.main"), None)
+    if args.max_main_import is not None and main_report is not None and main_report["import_time"] > args.max_main_import:
+        print(f"src.main import time {main_report['import_time']:.3f}s exceeds {args.max_main_import}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
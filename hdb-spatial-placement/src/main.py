@@ -2,34 +2,134 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import HTTPException
-from pydantic import BaseModel
-from typing import Literal
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
 from contextlib import asynccontextmanager
-import random
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import asyncio
+import pickle
+import uuid
+import json
+import time
+import os
+import numpy as np
 
-from stable_baselines3 import PPO
-
-from src.utils.plant_hatching_assignment import plantHatchingAndAssignment
-from src.utils.type_allocation_env import plantTypeAllocationEnv
-from src.eval import eval_model
+from src.utils.composition_worker import initialise_worker, worker_ready, generate_composition, recompose_composition, allocate_site_tiles, hatch_site_tile
+from src.utils.layout_pool import layoutPool
+from src.utils.composition_cache import compositionCache, composition_key
+from src.utils.single_flight import singleFlight
+from src.utils.admission import admissionController, admissionRejectedError
+from src.utils.composition_render import render_composition, render_key, validate_composition
+from src.utils.job_store import compositionJobStore, jobCancelledError
+from src.utils.metrics import metrics_registry, run_with_metrics
+from src.utils.recomposition import hatching_category, relabel_composition
+from src.utils.site_tiling import SITE_TILE_SIZE, site_tiles, reconcile_site_layouts, tile_layouts, stitch_site_composition
 
 # Input Class
 class user_input(BaseModel):
     plant_palette: list[dict] = []
     surrounding: Literal['Road', 'Walkway', None]
     style: Literal["Naturalistic", "Manicured",  "Meadow", "Ornamental", "Minimalist", "Formal", "Picturesque", "Rustic", "Plantation", None]
+    seed: Optional[int] = None
+    recomposable: bool = False
+
+class composition_job(user_input):
+    job_id: Optional[str] = None
+    count: int = Field(default=3, ge=1, le=10)
+
+class batch_input(BaseModel):
+    jobs: list[composition_job]
+
+class site_input(user_input):
+    site_size: tuple[int, int]
+
+class recompose_input(BaseModel):
+    composition: Optional[dict] = None
+    cache_key: Optional[str] = None
+    data_value: int = 0
+    plant_palette: list[dict]
+    previous_species_id: int
+    new_plant: dict
+
+class render_input(BaseModel):
+    composition: Optional[dict] = None
+    cache_key: Optional[str] = None
+    data_value: int = 0
+    plant_palette: list[dict] = []
+    layer: Literal["tree", "shrub"] = "shrub"
+    scale: int = Field(default=5, ge=1, le=20)
+
+# Configuration
+# An exported actor (src.export_policy) is served instead of the PPO model when set
+MODEL_PATH = os.getenv("SPATIAL_POLICY_PATH") or os.getenv("SPATIAL_MODEL_PATH", "src/models/plantTypeAllocationModel.zip")
+COMPOSITION_WORKERS = int(os.getenv("SPATIAL_COMPOSITION_WORKERS", min(3, os.cpu_count() or 1)))
+WORKER_TORCH_THREADS = int(os.getenv("SPATIAL_WORKER_TORCH_THREADS", 1))
+WORKER_WARM_UP = os.getenv("SPATIAL_WORKER_WARM_UP", "1") == "1"
+LAYOUT_POOL_SIZE = int(os.getenv("SPATIAL_LAYOUT_POOL_SIZE", 6))
+LAYOUT_REFILL_RATE = float(os.getenv("SPATIAL_LAYOUT_REFILL_RATE", 2.0))
+CACHE_ENTRIES = int(os.getenv("SPATIAL_CACHE_ENTRIES", 256))
+CACHE_TTL = float(os.getenv("SPATIAL_CACHE_TTL", 3600))
+CACHE_MAX_BYTES = int(os.getenv("SPATIAL_CACHE_MAX_BYTES", 64*1024*1024))
+MAX_BATCH_JOBS = int(os.getenv("SPATIAL_MAX_BATCH_JOBS", 100))
+JOB_DB_PATH = os.getenv("SPATIAL_JOB_DB_PATH", "src/jobs/composition_jobs.db")
+RECOMPOSE_STATE_ENTRIES = int(os.getenv("SPATIAL_RECOMPOSE_STATE_ENTRIES", 256))
+RECOMPOSE_STATE_MAX_BYTES = int(os.getenv("SPATIAL_RECOMPOSE_STATE_MAX_BYTES", 128*1024*1024))
+BEAM_WIDTH = int(os.getenv("SPATIAL_BEAM_WIDTH", 0))
+BEAM_CANDIDATES = int(os.getenv("SPATIAL_BEAM_CANDIDATES", 8))
+BEAM_BUDGET = float(os.getenv("SPATIAL_BEAM_BUDGET", 0.5))
+SITE_TILE_OVERLAP = int(os.getenv("SPATIAL_SITE_TILE_OVERLAP", 20))
+MAX_SITE_CELLS = int(os.getenv("SPATIAL_MAX_SITE_CELLS", 250000))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("SPATIAL_MAX_CONCURRENT_REQUESTS", COMPOSITION_WORKERS))
+MAX_QUEUED_REQUESTS = int(os.getenv("SPATIAL_MAX_QUEUED_REQUESTS", 4*COMPOSITION_WORKERS))
+QUEUE_TIMEOUT = float(os.getenv("SPATIAL_QUEUE_TIMEOUT", 10))
+RENDER_CACHE_ENTRIES = int(os.getenv("SPATIAL_RENDER_CACHE_ENTRIES", 256))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("SPATIAL_RENDER_CACHE_MAX_BYTES", 32*1024*1024))
+MAX_RENDER_PIXELS = int(os.getenv("SPATIAL_MAX_RENDER_PIXELS", 10000000))
 
 # Global Variables
-model_instances = {}
+service_instances = {}
 
-# Preload RL model
+# Start composition worker pool, each worker preloads the RL model
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Load the classes
-    model_instances["plantType_allocation"] = PPO.load('src/models/plantTypeAllocationModel.zip')
+    # Spawn (not fork) so every worker has its own random state and a clean torch runtime
+    service_instances["composition"] = ProcessPoolExecutor(
+        max_workers=COMPOSITION_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initialise_worker,
+        initargs=(MODEL_PATH, WORKER_TORCH_THREADS, WORKER_WARM_UP, (BEAM_WIDTH, BEAM_CANDIDATES, BEAM_BUDGET if BEAM_BUDGET > 0 else None))
+    )
+    # Submit one task per worker so all workers are spawned, have loaded the model and are warmed up before the first request
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(service_instances["composition"], worker_ready) for _ in range(COMPOSITION_WORKERS)])
+    # Start background producer of RL layouts
+    service_instances["layout_pool"] = layoutPool(service_instances["composition"], LAYOUT_POOL_SIZE, LAYOUT_REFILL_RATE)
+    layout_producer = asyncio.create_task(service_instances["layout_pool"].run_producer())
+    # Cache for seeded (deterministic) composition responses
+    service_instances["composition_cache"] = compositionCache(CACHE_ENTRIES, CACHE_TTL, CACHE_MAX_BYTES)
+    # Hatching states of recent compositions, used to recompose them when a palette species is replaced
+    service_instances["recomposition_states"] = compositionCache(RECOMPOSE_STATE_ENTRIES, CACHE_TTL, RECOMPOSE_STATE_MAX_BYTES)
+    # Rendered PNG images of compositions
+    service_instances["render_cache"] = compositionCache(RENDER_CACHE_ENTRIES, CACHE_TTL, RENDER_CACHE_MAX_BYTES)
+    # Identical concurrent seeded composition requests wait on one computation
+    service_instances["single_flight"] = singleFlight()
+    # Bounded queue in front of the worker pool, requests that cannot start in time are rejected with Retry-After
+    service_instances["admission"] = admissionController(MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, QUEUE_TIMEOUT)
+    # Job store for asynchronous composition jobs, jobs interrupted by the last shutdown can no longer finish
+    service_instances["job_store"] = compositionJobStore(JOB_DB_PATH)
+    service_instances["job_store"].fail_unfinished_jobs()
+    service_instances["job_tasks"] = {}
     yield
-    # Clean up the classes and release the resources
-    model_instances.clear()
+    # Clean up the producer, running jobs and worker pool and release the resources
+    layout_producer.cancel()
+    for job_task in list(service_instances["job_tasks"].values()):
+        job_task.cancel()
+    service_instances["job_store"].fail_unfinished_jobs()
+    service_instances["composition"].shutdown(wait=False, cancel_futures=True)
+    service_instances.clear()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -53,8 +153,50 @@ async def test():
     return {"message": "plant placement backend is active!"}
 
 
-@app.post("/generate_composition")
-async def create_item(request_body: user_input):
+@app.get("/composition_cache")
+async def cache_stats():
+    return service_instances["composition_cache"].stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics, stage latencies are recorded by the workers and merged after every task
+    """
+    gauges = {}
+    for stat, value in service_instances["composition_cache"].stats().items():
+        gauges[(f"spatial_composition_cache_{stat}", ())] = value
+    for stat, value in service_instances["recomposition_states"].stats().items():
+        gauges[(f"spatial_recomposition_states_{stat}", ())] = value
+    for stat, value in service_instances["render_cache"].stats().items():
+        gauges[(f"spatial_render_cache_{stat}", ())] = value
+    layout_pool = service_instances["layout_pool"]
+    for context, size in layout_pool.sizes().items():
+        gauges[("spatial_layout_pool_size", (("context", context),))] = size
+    gauges[("spatial_layout_pool_hits", ())] = layout_pool.hits
+    gauges[("spatial_layout_pool_misses", ())] = layout_pool.misses
+    gauges[("spatial_in_flight_compositions", ())] = service_instances["single_flight"].stats()["in_flight"]
+    admission = service_instances["admission"].stats()
+    gauges[("spatial_admission_running", ())] = admission["running"]
+    gauges[("spatial_admission_queue_depth", ())] = admission["queued"]
+    gauges[("spatial_admission_max_concurrent", ())] = service_instances["admission"].max_concurrent
+    gauges[("spatial_admission_max_queued", ())] = service_instances["admission"].max_queued
+    return metrics_registry.render(gauges)
+
+
+def parse_request(request_body: user_input):
+    """
+    Function to validate a composition request and fill in the defaults
+
+    Args:
+        request_body (user_input): composition request
+
+    Returns:
+        selected_plants (list): plant palette
+        theme (str): composition style, defaults to Naturalistic
+        surrounding (str): surrounding context, defaults to Walkway
+        context (int): 0 for road while 1 for walkway
+    """
     theme = request_body.style
     surrounding = request_body.surrounding
     context = 0 if surrounding == "Road" else 1 # Defaults to Walkway if anytting else
@@ -69,32 +211,531 @@ async def create_item(request_body: user_input):
     if len(selected_plants) < 3:
         raise HTTPException(status_code=422, detail="Invalid Plant Palette provided.")
 
+    return selected_plants, theme, surrounding, context
+
+
+async def run_in_worker(function, *args):
+    """
+    Function to run a worker function on the composition worker pool and merge the metrics it recorded
+
+    Args:
+        function (callable): worker function
+        *args: function arguments
+
+    Returns:
+        result: return value of the function
+    """
+    loop = asyncio.get_running_loop()
+    result, worker_metrics = await loop.run_in_executor(service_instances["composition"], run_with_metrics, function, *args)
+    metrics_registry.merge(worker_metrics)
+    return result
+
+
+def admission_error(error:admissionRejectedError):
+    """
+    Function to convert an admission rejection into a HTTP error with a Retry-After header
+
+    Args:
+        error (admissionRejectedError): rejection from the admission controller
+
+    Returns:
+        exception (HTTPException): 429 or 503 error
+    """
+    return HTTPException(status_code=error.status_code, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+async def run_admitted(endpoint:str, function, *args):
+    """
+    Function to run a request once the admission controller gives it a running slot
+
+    Args:
+        endpoint (str): endpoint label of the admission metrics
+        function (callable): coroutine function running the request
+        *args: function arguments
+
+    Returns:
+        result: return value of the function
+    """
+    try:
+        async with service_instances["admission"].admit(endpoint):
+            return await function(*args)
+    except admissionRejectedError as e:
+        raise admission_error(e)
+
+
+def store_recomposition_state(formatted_response:dict, composition_id:str=None, state:bytes=None, replacements:list=None):
+    """
+    Function to move the recomposition state of a composition into the recomposition state cache, the composition refers to it by composition_id
+
+    Args:
+        formatted_response (dict): composition from a worker, its recomposition_state is removed
+        composition_id (str, optional): id to store the state under. Defaults to None (new random id).
+        state (bytes, optional): state to store if the composition has no recomposition_state. Defaults to None.
+        replacements (list, optional): [(previous Species ID, new plant)] relabels made since the state was created. Defaults to None.
+    """
+    state = formatted_response.pop("recomposition_state", state)
+    recomposition_states = service_instances["recomposition_states"]
+    if state is None or recomposition_states.max_entries <= 0:
+        return
+    composition_id = composition_id if composition_id is not None else uuid.uuid4().hex
+    recomposition_states.set(composition_id, pickle.dumps((state, replacements or [])))
+    formatted_response["composition_id"] = composition_id
+
+
+def submit_compositions(selected_plants:list, theme:str, surrounding:str, context:int, seed:int=None, count:int=3, job_id:str=None, recomposable:bool=False):
+    """
+    Function to submit compositions to the worker pool so the event loop stays responsive
+    Pre-generated layouts are used when available so only hatching is run, seeded requests always generate their own layouts
+
+    Args:
+        selected_plants (list): plant palette
+        theme (str): composition style
+        surrounding (str): surrounding context
+        context (int): 0 for road while 1 for walkway
+        seed (int, optional): request seed, composition i uses seed*count + i. Defaults to None.
+        count (int, optional): number of compositions. Defaults to 3.
+        job_id (str, optional): asynchronous job the compositions belong to, workers report their progress to the job store. Defaults to None.
+        recomposable (bool, optional): workers return the recomposition state of each composition, it is only pickled when requested. Defaults to False.
+
+    Returns:
+        futures (list): asyncio futures resolving to each composition, in data_value order
+    """
+    return [
+        asyncio.ensure_future(run_in_worker(
+            generate_composition, selected_plants, theme, context, surrounding,
+            service_instances["layout_pool"].pop(context) if seed is None else None,
+            None if seed is None else seed*count + counter,
+            None if job_id is None else (JOB_DB_PATH, job_id, counter),
+            recomposable
+        ))
+        for counter in range(count)
+    ]
+
+
+async def run_compositions(selected_plants:list, theme:str, surrounding:str, context:int, seed:int=None, count:int=3, job_id:str=None, recomposable:bool=False):
+    """
+    Function to run compositions on the worker pool and format the response, seeded responses are cached
+
+    Args:
+        selected_plants (list): plant palette
+        theme (str): composition style
+        surrounding (str): surrounding context
+        context (int): 0 for road while 1 for walkway
+        seed (int, optional): request seed. Defaults to None.
+        count (int, optional): number of compositions. Defaults to 3.
+        job_id (str, optional): asynchronous job the compositions belong to. Defaults to None.
+        recomposable (bool, optional): keep the recomposition states of the compositions. Defaults to False.
+
+    Returns:
+        response (dict): {"data": [compositions]}
+    """
     response = {"data": []}
+    cache_key = None if seed is None else composition_key(selected_plants, theme, surrounding, seed, count, recomposable)
 
-    # Run 3 iterations to get 3 random composition
-    counter = 0
-    while True:
-        planting_environment = plantTypeAllocationEnv(random.uniform(1,2), context, random.uniform(0,50))
-        _, planting_grid, coordinates = eval_model(model_instances["plantType_allocation"], planting_environment, False, True)
-        hatching_environment = plantHatchingAndAssignment(planting_grid, selected_plants, coordinates, theme)
-        formatted_response = hatching_environment.hatch_allocate_plants(visualise=False)
-        # Valid planting composition
-        if len(formatted_response['coordinates'].keys()) > 10:
-            formatted_response['data_value'] = counter
-            formatted_response['surrounding_context'] = surrounding
-            response['data'].append(formatted_response)
-            counter += 1
-        
-        if counter >= 3:
-            break
+    compositions = await asyncio.gather(*submit_compositions(selected_plants, theme, surrounding, context, seed, count, job_id, recomposable))
+    for counter, formatted_response in enumerate(compositions):
+        # Seeded compositions keep the same composition_id so their responses stay identical
+        store_recomposition_state(formatted_response, None if seed is None else f"{cache_key}-{counter}")
+        formatted_response['data_value'] = counter
+        response['data'].append(formatted_response)
+
+    if seed is not None:
+        service_instances["composition_cache"].set(cache_key, json.dumps(response).encode())
+
+    return response
+
+
+@app.post("/generate_composition")
+async def create_item(request_body: user_input, response: Response):
+    selected_plants, theme, surrounding, context = parse_request(request_body)
+
+    # Seeded requests are deterministic, return the cached response if the same request was made before
+    # The cache key is returned in a header so the compositions can be recomposed later by cache key
+    seed, recomposable = request_body.seed, request_body.recomposable
+    cache_key = composition_key(selected_plants, theme, surrounding, seed, recomposable=recomposable)
+    if seed is not None:
+        cached_response = service_instances["composition_cache"].get(cache_key)
+        if cached_response is not None:
+            return Response(content=cached_response, media_type="application/json", headers={"X-Composition-Cache-Key": cache_key})
+        response.headers["X-Composition-Cache-Key"] = cache_key
+
+    # Run 3 compositions on the worker pool once admitted, unseeded requests are random so each gets its own compositions
+    if seed is None:
+        return await run_admitted("generate_composition", run_compositions, selected_plants, theme, surrounding, context, seed, 3, None, recomposable)
+    # Identical seeded requests already running share their result
+    return await service_instances["single_flight"].run(
+        cache_key, run_admitted, "generate_composition", run_compositions, selected_plants, theme, surrounding, context, seed, 3, None, recomposable,
+        endpoint="generate_composition"
+    )
+
+
+@app.post("/generate_composition_batch")
+async def create_items_batch(request_body: batch_input):
+    """
+    Batch variant of /generate_composition for many sites in one call
+    The batch is admitted once, its jobs run on the worker pool at most COMPOSITION_WORKERS at a time, results and errors are keyed by job_id (defaults to the job index)
+    A failing job is reported in errors without failing the other jobs
+    """
+    jobs = request_body.jobs
+    if len(jobs) > MAX_BATCH_JOBS:
+        raise HTTPException(status_code=422, detail=f"Batch has {len(jobs)} jobs, maximum is {MAX_BATCH_JOBS}.")
+
+    job_ids = [job.job_id if job.job_id is not None else str(index) for index, job in enumerate(jobs)]
+    if len(set(job_ids)) != len(job_ids):
+        raise HTTPException(status_code=422, detail="Duplicated job_id provided.")
+
+    # Jobs of the batch share its running slot, so a large batch fills the worker pool without flooding it
+    job_slots = asyncio.Semaphore(COMPOSITION_WORKERS)
+
+    async def run_job(job: composition_job):
+        selected_plants, theme, surrounding, context = parse_request(job)
+        cache_key = composition_key(selected_plants, theme, surrounding, job.seed, job.count, job.recomposable)
+        if job.seed is not None:
+            cached_response = service_instances["composition_cache"].get(cache_key)
+            if cached_response is not None:
+                return json.loads(cached_response)
+        async with job_slots:
+            # Unseeded jobs (eg. separate sites with the same palette) each get their own random compositions
+            if job.seed is None:
+                return await run_compositions(selected_plants, theme, surrounding, context, job.seed, job.count, None, job.recomposable)
+            return await service_instances["single_flight"].run(
+                cache_key, run_compositions, selected_plants, theme, surrounding, context, job.seed, job.count, None, job.recomposable,
+                endpoint="generate_composition_batch"
+            )
+
+    async def run_jobs():
+        return await asyncio.gather(*[run_job(job) for job in jobs], return_exceptions=True)
+
+    job_results = await run_admitted("generate_composition_batch", run_jobs)
+
+    response = {"results": {}, "errors": {}}
+    for job_id, job_result in zip(job_ids, job_results):
+        if isinstance(job_result, HTTPException):
+            response["errors"][job_id] = job_result.detail
+        elif isinstance(job_result, Exception):
+            response["errors"][job_id] = f"{type(job_result).__name__}: {job_result}"
+        else:
+            response["results"][job_id] = job_result
 
-    
     return response
 
-        
 
+@app.post("/generate_composition_stream")
+async def create_item_stream(request_body: user_input):
+    """
+    Streaming variant of /generate_composition
+    Returns newline delimited JSON, one composition per line (with its data_value) as soon as it is generated
+    """
+    selected_plants, theme, surrounding, context = parse_request(request_body)
+
+    seed, recomposable = request_body.seed, request_body.recomposable
+    cached_response = None
+    if seed is not None:
+        cache_key = composition_key(selected_plants, theme, surrounding, seed, recomposable=recomposable)
+        cached_response = service_instances["composition_cache"].get(cache_key)
+
+    if cached_response is not None:
+        async def stream_cached():
+            for formatted_response in json.loads(cached_response)['data']:
+                yield json.dumps(formatted_response) + "\n"
+        return StreamingResponse(stream_cached(), media_type="application/x-ndjson")
+
+    # Admitted before the response starts so a rejection can still be returned as 429/503
+    admission = service_instances["admission"]
+    try:
+        await admission.acquire("generate_composition_stream")
+    except admissionRejectedError as e:
+        raise admission_error(e)
+    admitted = time.perf_counter()
+    released = False
+
+    def release():
+        # Called when the stream ends and again after the response, whichever comes first releases the slot
+        nonlocal released
+        if not released:
+            released = True
+            admission.release(time.perf_counter() - admitted)
+
+    async def stream_compositions():
+        futures = submit_compositions(selected_plants, theme, surrounding, context, seed, recomposable=recomposable)
+
+        async def indexed(counter, future):
+            return counter, await future
+
+        compositions = [None] * len(futures)
+        try:
+            for completed in asyncio.as_completed([indexed(counter, future) for counter, future in enumerate(futures)]):
+                counter, formatted_response = await completed
+                store_recomposition_state(formatted_response, None if seed is None else f"{cache_key}-{counter}")
+                formatted_response['data_value'] = counter
+                compositions[counter] = formatted_response
+                yield json.dumps(formatted_response) + "\n"
+        finally:
+            # Client disconnected, cancel compositions that have not started
+            for future in futures:
+                future.cancel()
+            release()
+
+        if seed is not None:
+            service_instances["composition_cache"].set(cache_key, json.dumps({"data": compositions}).encode())
+
+    # The background task also releases the slot if the client disconnected before the stream started
+    return StreamingResponse(stream_compositions(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+
+async def run_site_composition(selected_plants:list, theme:str, surrounding:str, context:int, site_size:tuple, seed:int=None):
+    """
+    Function to generate a composition for a large site by splitting it into overlapping tiles the size of the RL environment
+    1. RL type allocation, the tiles are split across the workers and every worker batches the policy across its tiles
+    2. Tree and planting spacing are reconciled across the tile seams in the API process
+    3. Every tile is hatched on its own worker, with the reconciled coordinates of its neighbours in its overlap
+    4. The core of every tile is stitched into the site composition
+
+    Args:
+        selected_plants (list): plant palette
+        theme (str): composition style
+        surrounding (str): surrounding context
+        context (int): 0 for road while 1 for walkway
+        site_size (tuple): (w,h) of the site
+        seed (int, optional): site seed, the same seed gives the same site composition. Defaults to None.
+
+    Returns:
+        site_composition (dict): composition with grid, coordinates, surrounding_context, site_size, tiles and seam_adjustments
+    """
+    tiles = site_tiles(site_size, SITE_TILE_SIZE, SITE_TILE_OVERLAP)
+    rng = np.random.default_rng(seed)
+    octave, perlin_seed = rng.uniform(1, 2), rng.uniform(0, 50)
+    allocation_seeds, hatching_seeds = rng.integers(0, 2**32, size=(2, len(tiles))).tolist()
+
+    # One batch of tiles per worker
+    chunks = [list(range(worker, len(tiles), COMPOSITION_WORKERS)) for worker in range(min(COMPOSITION_WORKERS, len(tiles)))]
+    chunk_layouts = await asyncio.gather(*[
+        run_in_worker(
+            allocate_site_tiles, site_size, [tiles[index] for index in chunk], context, octave, perlin_seed,
+            [allocation_seeds[index] for index in chunk], SITE_TILE_SIZE
+        )
+        for chunk in chunks
+    ])
+    layouts = [None] * len(tiles)
+    for chunk, chunk_layout in zip(chunks, chunk_layouts):
+        for index, layout in zip(chunk, chunk_layout):
+            layouts[index] = layout
+
+    site_coordinates, seam_adjustments = reconcile_site_layouts(tiles, layouts)
+    layouts = tile_layouts(tiles, layouts, site_coordinates, SITE_TILE_SIZE)
+    compositions = await asyncio.gather(*[
+        run_in_worker(hatch_site_tile, layout, selected_plants, theme, hatching_seed)
+        for layout, hatching_seed in zip(layouts, hatching_seeds)
+    ])
+
+    site_composition = stitch_site_composition(site_size, tiles, layouts, compositions)
+    site_composition['surrounding_context'] = surrounding
+    site_composition['site_size'] = list(site_size)
+    site_composition['tiles'] = len(tiles)
+    site_composition['seam_adjustments'] = seam_adjustments
+    return site_composition
+
+
+@app.post("/generate_site_composition")
+async def create_site_composition(request_body: site_input):
+    """
+    Generate one composition for a site larger than the 100x100 RL environment, site_size is (w,h)
+    """
+    selected_plants, theme, surrounding, context = parse_request(request_body)
+    width, height = request_body.site_size
+    if min(width, height) < SITE_TILE_SIZE or width * height > MAX_SITE_CELLS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"site_size must be at least {SITE_TILE_SIZE}x{SITE_TILE_SIZE} with at most {MAX_SITE_CELLS} cells, use /generate_composition for a single 100x100 composition."
+        )
+
+    site_composition = await run_admitted(
+        "generate_site_composition", run_site_composition, selected_plants, theme, surrounding, context, (width, height), request_body.seed
+    )
+    # Site grids are large, serialise directly instead of through the FastAPI encoder
+    return Response(content=json.dumps(site_composition), media_type="application/json")
+
+
+def resolve_composition(composition:dict=None, cache_key:str=None, data_value:int=0):
+    """
+    Function to retrieve the composition of a request, given directly or by the cache key and data_value of a seeded response
+
+    Args:
+        composition (dict, optional): composition from a previous response. Defaults to None.
+        cache_key (str, optional): X-Composition-Cache-Key of a seeded response. Defaults to None.
+        data_value (int, optional): data_value of the composition in the cached response. Defaults to 0.
+
+    Returns:
+        composition (dict): composition with grid and coordinates
+    """
+    if composition is not None:
+        return composition
+    if cache_key is None:
+        raise HTTPException(status_code=422, detail="Either composition or cache_key must be provided.")
+    cached_response = service_instances["composition_cache"].get(cache_key)
+    if cached_response is None:
+        raise HTTPException(status_code=404, detail="Cached composition not found.")
+    compositions = json.loads(cached_response)["data"]
+    if not 0 <= data_value < len(compositions):
+        raise HTTPException(status_code=422, detail=f"data_value must be between 0 and {len(compositions) - 1}.")
+    return compositions[data_value]
+
+
+@app.post("/recompose_composition")
+async def recompose(request_body: recompose_input):
+    """
+    Recompose a composition after one species of its palette is replaced
+    The composition is given directly or by the cache key (X-Composition-Cache-Key) and data_value of a seeded response
+    Replacements with the same hatching category (tree canopy radius, shrub border/shade preference) only relabel the coordinates,
+    otherwise a worker recomputes the heatmaps and hatching assignment from the stored state of the composition
+    """
+    composition = resolve_composition(request_body.composition, request_body.cache_key, request_body.data_value)
+
+    previous_species_id = request_body.previous_species_id
+    new_plant = request_body.new_plant
+    previous_plant = next((plant for plant in request_body.plant_palette if plant.get("Species ID") == previous_species_id), None)
+    if previous_plant is None:
+        raise HTTPException(status_code=422, detail=f"Species {previous_species_id} is not in the plant palette.")
+    previous_category, new_category = hatching_category(previous_plant), hatching_category(new_plant)
+    if previous_category is None or new_category is None or previous_category[0] != new_category[0]:
+        raise HTTPException(status_code=422, detail="The new plant must be the same plant type (tree or shrub) as the replaced plant.")
+
+    state_entry = None
+    if composition.get("composition_id") is not None:
+        state_entry = service_instances["recomposition_states"].get(composition["composition_id"])
+
+    # Same hatching category, the composition does not change apart from the species
+    if previous_category == new_category:
+        recomposed_response = relabel_composition(composition, previous_species_id, new_plant.get("Species ID"))
+        recomposed_response.pop("composition_id", None)
+        if state_entry is not None:
+            state, replacements = pickle.loads(state_entry)
+            store_recomposition_state(recomposed_response, state=state, replacements=replacements + [(previous_species_id, new_plant)])
+        return recomposed_response
+
+    if state_entry is None:
+        raise HTTPException(status_code=404, detail="Recomposition state not found or expired, generate the composition again with recomposable set to true.")
+    state, replacements = pickle.loads(state_entry)
+    try:
+        recomposed_response = await run_admitted(
+            "recompose_composition", run_in_worker, recompose_composition, state, replacements + [(previous_species_id, new_plant)], composition.get("surrounding_context", "Walkway")
+        )
+    except ValueError as e:
+        # The previous species is not in the palette of the composition (eg. already replaced)
+        raise HTTPException(status_code=422, detail=str(e))
+    store_recomposition_state(recomposed_response)
+    if "data_value" in composition:
+        recomposed_response["data_value"] = composition["data_value"]
+    return recomposed_response
+
+
+@app.post("/render_composition")
+async def render(request_body: render_input):
+    """
+    Render the tree or shrub planting plan of a composition as a PNG, like the 2D downloads of the UI
+    The composition is given directly or by the cache key (X-Composition-Cache-Key) and data_value of a seeded response,
+    images are cached by the hash of the composition, palette, layer and scale
+    """
+    composition = resolve_composition(request_body.composition, request_body.cache_key, request_body.data_value)
+    # Compositions given directly are checked before they are hashed or sent to a worker
+    try:
+        validate_composition(composition, request_body.scale, MAX_SITE_CELLS, MAX_RENDER_PIXELS)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    key = render_key(composition, request_body.plant_palette, request_body.layer, request_body.scale)
+    image = service_instances["render_cache"].get(key)
+    cache_status = "hit"
+    if image is None:
+        cache_status = "miss"
+        # OpenCV is only loaded in the workers
+        image = await run_admitted(
+            "render_composition", run_in_worker, render_composition, composition, request_body.plant_palette, request_body.layer, request_body.scale
+        )
+        service_instances["render_cache"].set(key, image)
+    return Response(content=image, media_type="image/png", headers={"ETag": f'"{key}"', "X-Render-Cache": cache_status})
+
+
+async def run_job(job_id:str, selected_plants:list, theme:str, surrounding:str, context:int, seed:int=None, count:int=3, recomposable:bool=False):
+    """
+    Background task running an asynchronous composition job and storing its result in the job store
+
+    Args:
+        job_id (str): job id
+        selected_plants (list): plant palette
+        theme (str): composition style
+        surrounding (str): surrounding context
+        context (int): 0 for road while 1 for walkway
+        seed (int, optional): request seed. Defaults to None.
+        count (int, optional): number of compositions. Defaults to 3.
+        recomposable (bool, optional): keep the recomposition states of the compositions. Defaults to False.
+    """
+    # SQLite calls run in a thread, a locked database must not block the event loop
+    job_store = service_instances["job_store"]
+    await asyncio.to_thread(job_store.set_status, job_id, "running")
+    try:
+        cached_response = None
+        if seed is not None:
+            cached_response = service_instances["composition_cache"].get(composition_key(selected_plants, theme, surrounding, seed, count, recomposable))
+        if cached_response is not None:
+            await asyncio.to_thread(job_store.set_result, job_id, json.loads(cached_response))
+        else:
+            # Jobs were accepted by check_queue on submission, they wait for a running slot as long as it takes
+            async with service_instances["admission"].admit("composition_jobs", bounded=False):
+                result = await run_compositions(selected_plants, theme, surrounding, context, seed, count, job_id, recomposable)
+            await asyncio.to_thread(job_store.set_result, job_id, result)
+    except jobCancelledError:
+        pass
+    except Exception as e:
+        await asyncio.to_thread(job_store.set_status, job_id, "failed", f"{type(e).__name__}: {e}")
+    finally:
+        service_instances["job_tasks"].pop(job_id, None)
+
+
+@app.post("/composition_jobs")
+async def submit_job(request_body: composition_job):
+    """
+    Submit an asynchronous composition job, poll /composition_jobs/{job_id} for its progress and fetch /composition_jobs/{job_id}/result once completed
+    Jobs are only refused (429) when the admission queue is full, an accepted job waits for its running slot without the queue timeout
+    """
+    selected_plants, theme, surrounding, context = parse_request(request_body)
+    try:
+        service_instances["admission"].check_queue("composition_jobs")
+    except admissionRejectedError as e:
+        raise admission_error(e)
+    job_id = await asyncio.to_thread(service_instances["job_store"].create_job, request_body.model_dump(), request_body.count)
+    service_instances["job_tasks"][job_id] = asyncio.create_task(
+        run_job(job_id, selected_plants, theme, surrounding, context, request_body.seed, request_body.count, request_body.recomposable)
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/composition_jobs/{job_id}")
+async def poll_job(job_id: str):
+    job = await asyncio.to_thread(service_instances["job_store"].get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
 
-        
+@app.get("/composition_jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job_status = await asyncio.to_thread(service_instances["job_store"].get_status, job_id)
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job_status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job_status}.")
+    return await asyncio.to_thread(service_instances["job_store"].get_result, job_id)
 
 
+@app.delete("/composition_jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job_store = service_instances["job_store"]
+    if await asyncio.to_thread(job_store.get_status, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    # Running workers see the cancelled status at their next stage and stop, queued compositions are cancelled with the task
+    await asyncio.to_thread(job_store.set_status, job_id, "cancelled")
+    job_task = service_instances["job_tasks"].get(job_id)
+    if job_task is not None:
+        job_task.cancel()
+    return await asyncio.to_thread(job_store.get_job, job_id)
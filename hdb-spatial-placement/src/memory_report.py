@@ -0,0 +1,99 @@
+# Python file to report the peak memory of every stage of the composition pipeline
+import json
+import time
+import pickle
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from src.utils.composition_worker import initialise_worker, generate_layout, hatch_layout, generate_composition, allocate_site_tiles, hatch_site_tile
+from src.utils.procedural_generation_env import proceduralGeneratedEnv
+from src.utils.site_tiling import SITE_TILE_SIZE, site_tiles, reconcile_site_layouts, tile_layouts, stitch_site_composition
+
+def parse_arguments():
+    """
+    Function defining all arguments for the data
+    """
+    parser = argparse.ArgumentParser(description="Peak memory report for the composition pipeline.")
+
+    # Define the arguments
+    parser.add_argument('--model_path', type=str, default='src/models/plantTypeAllocationModel.zip', help='Path to the RL model zip file, defaults to src/models/plantTypeAllocationModel.zip')
+    parser.add_argument('--palette', type=str, default='tests/mock_input.json', help='JSON file with the plant_palette, style and surrounding of the request, defaults to tests/mock_input.json')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the measured compositions, defaults to 0.')
+    parser.add_argument('--site_size', type=int, nargs=2, default=[260, 180], help='(w,h) of the measured tiled site, defaults to 260 180.')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the report to, defaults to None (print only).')
+
+    return parser.parse_args()
+
+
+def measure(function, *args):
+    """
+    Function to measure the peak memory allocated while running a function with tracemalloc (numpy arrays are included)
+
+    Args:
+        function (callable): function to measure
+        *args: function arguments
+
+    Returns:
+        result: return value of the function
+        report (dict): peak memory (bytes), seconds taken and size of the pickled result (bytes sent back by a worker)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"peak_bytes": peak, "seconds": elapsed, "result_bytes": len(pickle.dumps(result))}
+
+
+def run_site(site_size:tuple, selected_plants:list, theme:str, context:int, seed:int):
+    """
+    Function to run a tiled site composition in process, all tiles are allocated as one batch (one worker)
+
+    Returns:
+        site_composition (dict): stitched site composition
+    """
+    tiles = site_tiles(site_size)
+    rng = np.random.default_rng(seed)
+    octave, perlin_seed = rng.uniform(1, 2), rng.uniform(0, 50)
+    allocation_seeds, hatching_seeds = rng.integers(0, 2**32, size=(2, len(tiles))).tolist()
+    layouts = allocate_site_tiles(site_size, tiles, context, octave, perlin_seed, allocation_seeds, SITE_TILE_SIZE)
+    site_coordinates, _ = reconcile_site_layouts(tiles, layouts)
+    layouts = tile_layouts(tiles, layouts, site_coordinates)
+    compositions = [hatch_site_tile(layout, selected_plants, theme, hatching_seed) for layout, hatching_seed in zip(layouts, hatching_seeds)]
+    return stitch_site_composition(site_size, tiles, layouts, compositions)
+
+
+def main():
+    args = parse_arguments()
+
+    with open(args.palette, 'r') as file:
+        request = json.load(file)
+    selected_plants, theme = request["plant_palette"], request.get("style") or "Naturalistic"
+    surrounding = request.get("surrounding") or "Walkway"
+    context = 0 if surrounding == "Road" else 1
+
+    # Load the model and run one composition first so lazy imports and first call allocations are not measured
+    initialise_worker(args.model_path, 1, True)
+
+    stages = {}
+    _, stages["procedural_environment"] = measure(
+        proceduralGeneratedEnv(1.5, args.seed, (100, 100), 10, 5).create_environment
+    )
+    layout, stages["rl_allocation"] = measure(generate_layout, context, None, np.random.default_rng(args.seed))
+    _, stages["hatching"] = measure(hatch_layout, layout, selected_plants, theme, surrounding, None, np.random.default_rng(args.seed))
+    _, stages["composition"] = measure(generate_composition, selected_plants, theme, context, surrounding, None, args.seed)
+    _, stages["site_composition"] = measure(run_site, tuple(args.site_size), selected_plants, theme, context, args.seed)
+
+    for stage, report in stages.items():
+        print(f"{stage}: peak {report['peak_bytes']/1024**2:.2f}MB, result {report['result_bytes']/1024:.1f}KB, {report['seconds']:.2f}s")
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(stages, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# Python file to record rollouts of the RL Plant Allocation model and evaluate new policies on them offline
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+from stable_baselines3 import PPO
+
+from src.eval import sample_actions, action_probabilities
+from src.utils.type_allocation_env import plantTypeAllocationEnv
+from src.utils.rollout_dataset import rolloutDatasetWriter, rolloutDataset
+
+def parse_arguments():
+    """
+    Function defining all arguments for the data
+    """
+    parser = argparse.ArgumentParser(description="Record rollouts of the RL model and evaluate policies on them without stepping environments.")
+
+    # Define the arguments
+    parser.add_argument('mode', type=str, choices=['record', 'evaluate'], help='record rollouts of --model_path, or evaluate --model_path on recorded rollouts')
+    parser.add_argument('--model_path', type=str, default='src/models/plantTypeAllocationModel.zip', help='Path to the RL model zip file, defaults to src/models/plantTypeAllocationModel.zip')
+    parser.add_argument('--dataset', type=str, default='src/logs/rollouts/', help='Folder of the rollout dataset, defaults to src/logs/rollouts/')
+    parser.add_argument('--num_episodes', type=int, default=200, help='Number of recorded episodes of every context, defaults to 200.')
+    parser.add_argument('--contexts', type=int, nargs='+', default=[0, 1], help='Recorded contexts, defaults to 0 1 (Road and Walkway).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the recorded episodes, defaults to 0.')
+    parser.add_argument('--batch_size', type=int, default=1024, help='Number of observations of every policy forward pass, defaults to 1024.')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the evaluation report to, defaults to None (print only).')
+
+    return parser.parse_args()
+
+
+def record_rollouts(model:PPO, path:str, num_episodes:int, contexts:tuple=(0, 1), seed:int=0, batch_size:int=64):
+    """
+    Function to record the steps of seeded episodes of a policy into a rollout dataset
+    Episodes draw their environment and actions from their episode seed like generate_layout of the composition workers,
+    batch_size episodes are played in lockstep with one batched forward pass per step
+
+    Args:
+        model (PPO): recording (behaviour) policy
+        path (str): dataset folder
+        num_episodes (int): number of episodes of every context
+        contexts (tuple, optional): recorded contexts, 0 for road while 1 for walkway. Defaults to (0, 1).
+        seed (int, optional): seed of the episode seeds. Defaults to 0.
+        batch_size (int, optional): number of episodes played in lockstep. Defaults to 64.
+
+    Returns:
+        dataset (rolloutDataset): recorded dataset
+    """
+    episode_seeds = np.random.default_rng(seed).integers(0, 2**32, size=num_episodes).tolist()
+    episodes = [(context, episode_seed) for context in contexts for episode_seed in episode_seeds]
+    writer = None
+
+    for batch_start in range(0, len(episodes), batch_size):
+        eval_envs, rngs = [], []
+        for context, episode_seed in episodes[batch_start:batch_start + batch_size]:
+            rng = np.random.default_rng(episode_seed)
+            eval_envs.append(plantTypeAllocationEnv(rng.uniform(1, 2), context, rng.uniform(0, 50), rng=rng))
+            rngs.append(rng)
+        if writer is None:
+            writer = rolloutDatasetWriter(path, eval_envs[0].observation_space.shape, metadata={
+                "behaviour_policy": getattr(model, "source_path", None), "episodes": len(episodes), "contexts": list(contexts), "seed": seed,
+            })
+
+        observations = [eval_env.reset()[0] for eval_env in eval_envs]
+        active = list(range(len(eval_envs)))
+        while active:
+            batch = np.stack([observations[index] for index in active])
+            actions = sample_actions(model, batch, [rngs[index] for index in active])
+            probabilities = action_probabilities(model, batch)
+
+            still_active = []
+            for row, (index, action) in enumerate(zip(active, actions)):
+                # The environment updates its observation in place, so it is copied before stepping
+                observation = observations[index].copy()
+                observations[index], reward, done, _, _ = eval_envs[index].step(action)
+                writer.append(observation, action, reward, done, batch_start + index, probabilities[row, action[0], action[1]])
+                if not done:
+                    still_active.append(index)
+            active = still_active
+
+    writer.close()
+    return rolloutDataset(path)
+
+
+def replay_evaluate(model:PPO, dataset:rolloutDataset, batch_size:int=1024):
+    """
+    Function to score a policy on recorded observations without stepping any environment
+    The reward of an action is its value in the observation (-1 for invalid actions), so the immediate reward of any action on a recorded state is exact.
+    Returns along the recorded trajectories are estimated with per-decision weighted importance sampling
+
+    Args:
+        model (PPO): evaluated (target) policy
+        dataset (rolloutDataset): recorded rollouts
+        batch_size (int, optional): number of observations of every policy forward pass. Defaults to 1024.
+
+    Returns:
+        report (dict): action agreement, expected immediate reward, recorded and importance sampled returns and effective sample size
+    """
+    start = time.perf_counter()
+    steps, action_agreement, spot_agreement = 0, 0, 0
+    expected_reward, greedy_reward = 0.0, 0.0
+    # Rewards and log importance ratios of every recorded episode
+    episode_rewards, episode_log_ratios = {}, {}
+
+    for chunk in dataset.chunks():
+        for batch_start in range(0, len(chunk["rewards"]), batch_size):
+            observations = np.asarray(chunk["observations"][batch_start:batch_start + batch_size])
+            actions = np.asarray(chunk["actions"][batch_start:batch_start + batch_size]).astype(np.int64)
+            probabilities = action_probabilities(model, observations)
+            rows = np.arange(len(actions))
+
+            flat_probabilities = probabilities.reshape(len(actions), -1)
+            greedy_actions = np.stack(np.unravel_index(np.argmax(flat_probabilities, axis=1), probabilities.shape[1:]), axis=1)
+            action_agreement += int(np.sum(np.all(greedy_actions == actions, axis=1)))
+            spot_agreement += int(np.sum(greedy_actions[:, 0] == actions[:, 0]))
+            expected_reward += float(np.sum(probabilities * observations))
+            greedy_reward += float(np.sum(observations[rows, greedy_actions[:, 0], greedy_actions[:, 1]]))
+            steps += len(actions)
+
+            target_probabilities = probabilities[rows, actions[:, 0], actions[:, 1]]
+            log_ratios = np.log(np.maximum(target_probabilities, 1e-12)) - np.log(np.maximum(chunk["behaviour_probabilities"][batch_start:batch_start + batch_size], 1e-12))
+            for episode, reward, log_ratio in zip(chunk["episodes"][batch_start:batch_start + batch_size], chunk["rewards"][batch_start:batch_start + batch_size], log_ratios):
+                episode_rewards.setdefault(int(episode), []).append(float(reward))
+                episode_log_ratios.setdefault(int(episode), []).append(float(log_ratio))
+
+    # Per-decision weighted importance sampling, episodes that ended keep their last weight with no reward
+    episodes = sorted(episode_rewards)
+    horizon = max(len(episode_rewards[episode]) for episode in episodes)
+    rewards = np.zeros((len(episodes), horizon))
+    log_weights = np.zeros((len(episodes), horizon))
+    for row, episode in enumerate(episodes):
+        length = len(episode_rewards[episode])
+        rewards[row, :length] = episode_rewards[episode]
+        cumulative = np.cumsum(episode_log_ratios[episode])
+        log_weights[row, :length] = cumulative
+        log_weights[row, length:] = cumulative[-1]
+    # Normalised per step, the largest weight is 1 so the products do not overflow
+    weights = np.exp(log_weights - log_weights.max(axis=0, keepdims=True))
+    importance_sampled_return = float(np.sum(np.sum(weights * rewards, axis=0) / np.sum(weights, axis=0)))
+    final_weights = weights[:, -1]
+
+    return {
+        "steps": steps,
+        "episodes": len(episodes),
+        "action_agreement": action_agreement / steps,
+        "spot_agreement": spot_agreement / steps,
+        "expected_step_reward": expected_reward / steps,
+        "greedy_step_reward": greedy_reward / steps,
+        "recorded_step_reward": float(rewards.sum() / steps),
+        "recorded_return": float(rewards.sum(axis=1).mean()),
+        "importance_sampled_return": importance_sampled_return,
+        "effective_sample_size": float(final_weights.sum() ** 2 / np.sum(final_weights ** 2)),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main():
+    args = parse_arguments()
+    model = PPO.load(args.model_path)
+    model.source_path = args.model_path
+
+    if args.mode == 'record':
+        start = time.perf_counter()
+        dataset = record_rollouts(model, args.dataset, args.num_episodes, tuple(args.contexts), args.seed)
+        print(f"Recorded {len(dataset)} steps of {dataset.metadata['episodes']} episodes to {args.dataset} in {time.perf_counter() - start:.2f}s")
+        return
+
+    report = replay_evaluate(model, rolloutDataset(args.dataset), args.batch_size)
+    report = {"model_path": args.model_path, "dataset": args.dataset, **report}
+    print(json.dumps(report, indent=4))
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
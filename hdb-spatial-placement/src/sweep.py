@@ -0,0 +1,256 @@
+# Python file to run hyperparameter sweeps of the RL Plant Allocation model
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+import torch
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from src.train import make_env, build_model
+from src.utils.type_allocation_env import plantTypeAllocationEnv
+from src.utils.eval_callback import layoutBankEvalCallback
+from src.utils.sweep_store import sweepStore
+
+# Per process instances of the trial workers, populated once by initialise_trial_worker
+trial_instances = {}
+
+def parse_arguments():
+    """
+    Function defining all arguments for the data
+    """
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep for the RL model.")
+
+    # Define the arguments
+    parser.add_argument('--spec', type=str, required=True, help='JSON sweep spec with the method (grid or random), num_trials (random) and parameters')
+    parser.add_argument('--sweep_name', type=str, default=None, help='Name of the sweep in the results table, running a sweep again only runs its unfinished trials. Defaults to the spec file name')
+    parser.add_argument('--db', type=str, default='src/logs/sweep.db', help='SQLite results table. Defaults to src/logs/sweep.db')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the sweep results to. Defaults to None (print only)')
+    parser.add_argument('--model_dir', type=str, default='./src/models/sweeps/', help='Folder to save the model of every trial to. Defaults to ./src/models/sweeps/')
+    parser.add_argument('--workers', type=int, default=None, help='Number of trials run concurrently, every trial is pinned to its own CPU. Defaults to the number of available CPUs')
+    parser.add_argument('--total_timesteps', type=int, default=20000, help='Training timesteps of every trial. Defaults to 20000')
+    parser.add_argument('--eval_timesteps', type=int, default=2000, help='Training timesteps between the evaluations of a trial. Defaults to 2000')
+    parser.add_argument('--eval_episodes', type=int, default=16, help='Number of layouts in the evaluation bank. Defaults to 16')
+    parser.add_argument('--n_steps', type=int, default=10, help='n_steps of the trials that do not sweep it. Defaults to 10')
+    parser.add_argument('--n_env', type=int, default=8, help='Number of training environments of the trials that do not sweep it. Defaults to 8')
+    parser.add_argument('--min_trials', type=int, default=3, help='Minimum number of other trials that reached an evaluation before a trial can be stopped early. Defaults to 3')
+    parser.add_argument('--warmup_evaluations', type=int, default=2, help='Number of evaluations before a trial can be stopped early. Defaults to 2')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random search and of the trials. Defaults to 0')
+
+    return parser.parse_args()
+
+
+def sample_parameter(value, rng:np.random.Generator):
+    """
+    Function to sample a hyperparameter of a random search
+
+    Args:
+        value (list | dict | float): list of choices, {"distribution": uniform / log_uniform / int_uniform, "min", "max"} or a fixed value
+        rng (np.random.Generator): generator of the random search
+
+    Returns:
+        value: sampled hyperparameter
+    """
+    if isinstance(value, list):
+        return value[int(rng.integers(len(value)))]
+    if not isinstance(value, dict):
+        return value
+    if value["distribution"] == "uniform":
+        return float(rng.uniform(value["min"], value["max"]))
+    if value["distribution"] == "log_uniform":
+        return float(np.exp(rng.uniform(np.log(value["min"]), np.log(value["max"]))))
+    if value["distribution"] == "int_uniform":
+        return int(rng.integers(value["min"], value["max"] + 1))
+    raise ValueError(f"Unknown distribution {value['distribution']}")
+
+
+def expand_spec(spec:dict, seed:int=0):
+    """
+    Function to list the trials of a sweep spec
+
+    Args:
+        spec (dict): {"method": "grid" or "random", "num_trials": int (random only), "parameters": {name: values}}
+            grid parameters are lists of values, random parameters are lists of choices, distributions or fixed values
+        seed (int, optional): seed of the random search. Defaults to 0.
+
+    Returns:
+        trials (list): hyperparameters of every trial
+    """
+    parameters = spec["parameters"]
+    names = sorted(parameters)
+    if spec.get("method", "grid") == "grid":
+        values = [parameters[name] if isinstance(parameters[name], list) else [parameters[name]] for name in names]
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    if spec["method"] == "random":
+        rng = np.random.default_rng(seed)
+        return [{name: sample_parameter(parameters[name], rng) for name in names} for _ in range(spec["num_trials"])]
+    raise ValueError(f"Unknown sweep method {spec['method']}")
+
+
+def initialise_trial_worker(cpu_queue):
+    """
+    Process pool initializer, pins the worker to its own CPU so concurrent trials do not compete for cores
+
+    Args:
+        cpu_queue (multiprocessing.Queue): CPU ids, every worker takes one
+    """
+    cpu = cpu_queue.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    torch.set_num_threads(1)
+    trial_instances["cpu"] = cpu
+
+
+class sweepPruningCallback(BaseCallback):
+    def __init__(self, store:sweepStore, sweep:str, trial_id:int, eval_callback:layoutBankEvalCallback, min_trials:int=3, warmup_evaluations:int=2):
+        """
+        Callback recording every evaluation of a trial in the results table and stopping the trial with the median stopping rule
+
+        Args:
+            store (sweepStore): results table
+            sweep (str): sweep name
+            trial_id (int): trial being trained
+            eval_callback (layoutBankEvalCallback): evaluation callback of the trial, listed before this callback
+            min_trials (int, optional): minimum number of other trials that reached an evaluation before the trial can be stopped. Defaults to 3.
+            warmup_evaluations (int, optional): number of evaluations before the trial can be stopped. Defaults to 2.
+        """
+        super().__init__()
+        self.store = store
+        self.sweep = sweep
+        self.trial_id = trial_id
+        self.eval_callback = eval_callback
+        self.min_trials = min_trials
+        self.warmup_evaluations = warmup_evaluations
+        self.recorded = 0
+        self.pruned = False
+
+    def _on_step(self):
+        evaluations = len(self.eval_callback.evaluations_timesteps)
+        if evaluations == self.recorded:
+            return True
+        for evaluation in range(self.recorded, evaluations):
+            self.store.record_evaluation(
+                self.sweep, self.trial_id, evaluation, int(self.eval_callback.evaluations_timesteps[evaluation]),
+                float(np.mean(self.eval_callback.evaluations_results[evaluation]))
+            )
+        self.recorded = evaluations
+        self.pruned = self.store.should_prune(self.sweep, self.trial_id, evaluations - 1, self.min_trials, self.warmup_evaluations)
+        return not self.pruned
+
+
+def run_trial(db_path:str, sweep:str, trial_id:int, params:dict, settings:dict):
+    """
+    Function to train and evaluate the model with the hyperparameters of a trial
+    Evaluations run in the trial process on the layout bank, as the trial already has its own CPU
+
+    Args:
+        db_path (str): SQLite results table
+        sweep (str): sweep name
+        trial_id (int): trial id
+        params (dict): PPO hyperparameters of the trial, n_steps and n_env included
+        settings (dict): total_timesteps, eval_timesteps, eval_episodes, n_steps, n_env, min_trials, warmup_evaluations, seed and model_dir of the sweep
+
+    Returns:
+        trial (dict): trial id, status, best and final mean reward, timesteps and seconds taken
+    """
+    store = sweepStore(db_path)
+    cpu = trial_instances.get("cpu")
+    store.start_trial(sweep, trial_id, cpu)
+    start = time.perf_counter()
+    try:
+        hyperparameters = dict(params)
+        n_steps = hyperparameters.pop("n_steps", settings["n_steps"])
+        n_env = hyperparameters.pop("n_env", settings["n_env"])
+
+        # Every trial draws its training environments from its own seed
+        seed = settings["seed"] + trial_id
+        random.seed(seed)
+        env_seeds = np.random.default_rng(seed).integers(0, 2**32, size=n_env)
+        envs = DummyVecEnv([make_env(plantTypeAllocationEnv(random.uniform(1,2), 0, rng=np.random.default_rng(env_seed))) for env_seed in env_seeds])
+        model = build_model(envs, n_steps, n_env, None, seed=seed, **hyperparameters)
+
+        # Every trial evaluates on the same layout bank, about every eval_timesteps timesteps whatever its number of environments
+        eval_callback = layoutBankEvalCallback(eval_freq=max(settings["eval_timesteps"] // n_env, 1), num_episodes=settings["eval_episodes"], seed=settings["seed"], background=False)
+        pruning_callback = sweepPruningCallback(store, sweep, trial_id, eval_callback, settings["min_trials"], settings["warmup_evaluations"])
+        model.learn(total_timesteps=settings["total_timesteps"], callback=CallbackList([eval_callback, pruning_callback]))
+
+        os.makedirs(os.path.join(settings["model_dir"], sweep), exist_ok=True)
+        model_path = os.path.join(settings["model_dir"], sweep, f"trial_{trial_id}.zip")
+        model.save(model_path)
+
+        rewards = [float(np.mean(results)) for results in eval_callback.evaluations_results]
+        trial = {
+            "trial_id": trial_id, "status": "pruned" if pruning_callback.pruned else "completed",
+            "timesteps": model.num_timesteps, "best_mean_reward": max(rewards, default=None), "final_mean_reward": rewards[-1] if rewards else None,
+            "seconds": time.perf_counter() - start,
+        }
+        store.finish_trial(sweep, trial_id, trial["status"], trial["timesteps"], trial["best_mean_reward"], trial["final_mean_reward"], trial["seconds"], model_path)
+        return trial
+    except Exception as error:
+        store.finish_trial(sweep, trial_id, "failed", seconds=time.perf_counter() - start, error=repr(error))
+        return {"trial_id": trial_id, "status": "failed", "error": repr(error)}
+
+
+def run_sweep(spec:dict, sweep:str, db_path:str, settings:dict, workers:int=None):
+    """
+    Function to run the unfinished trials of a sweep concurrently on a process pool, one CPU per worker
+
+    Args:
+        spec (dict): sweep spec, see expand_spec
+        sweep (str): sweep name
+        db_path (str): SQLite results table
+        settings (dict): trial settings, see run_trial
+        workers (int, optional): number of concurrent trials. Defaults to None (number of available CPUs).
+
+    Returns:
+        results (list): every trial of the sweep from the results table, the best trials first
+    """
+    store = sweepStore(db_path)
+    store.create_trials(sweep, expand_spec(spec, settings["seed"]))
+    pending = store.pending_trials(sweep)
+
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    workers = min(workers or len(cpus), max(len(pending), 1))
+    context = get_context("spawn")
+    cpu_queue = context.Queue()
+    for worker in range(workers):
+        cpu_queue.put(cpus[worker % len(cpus)])
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initialise_trial_worker, initargs=(cpu_queue,)) as executor:
+        futures = [executor.submit(run_trial, db_path, sweep, trial_id, params, settings) for trial_id, params in pending]
+        for future in as_completed(futures):
+            trial = future.result()
+            print(f"Trial {trial['trial_id']} {trial['status']}" + (f", best mean reward {trial['best_mean_reward']}" if trial.get("best_mean_reward") is not None else ""))
+
+    return store.results(sweep)
+
+
+def main():
+    args = parse_arguments()
+
+    with open(args.spec, 'r') as file:
+        spec = json.load(file)
+    sweep = args.sweep_name or os.path.splitext(os.path.basename(args.spec))[0]
+    settings = {
+        "total_timesteps": args.total_timesteps, "eval_timesteps": args.eval_timesteps, "eval_episodes": args.eval_episodes,
+        "n_steps": args.n_steps, "n_env": args.n_env, "min_trials": args.min_trials, "warmup_evaluations": args.warmup_evaluations,
+        "seed": args.seed, "model_dir": args.model_dir,
+    }
+
+    results = run_sweep(spec, sweep, args.db, settings, args.workers)
+    for trial in results[:5]:
+        print(f"Trial {trial['trial_id']} ({trial['status']}): best mean reward {trial['best_mean_reward']}, params {trial['params']}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,12 @@ import argparse
 from stable_baselines3.common.vec_env import DummyVecEnv
 from stable_baselines3.common.env_checker import check_env
 from stable_baselines3 import PPO
-from stable_baselines3.common.callbacks import EvalCallback
+from stable_baselines3.common.callbacks import CallbackList
 
 from src.utils.type_allocation_env import plantTypeAllocationEnv
+from src.utils.eval_callback import layoutBankEvalCallback
+from src.utils.training_profiler import trainingProfilerCallback
+from src.utils.checkpointing import trainingCheckpointCallback, list_checkpoints, load_checkpoint
 
 def parse_arguments():
     """
@@ -23,6 +26,13 @@ def parse_arguments():
     parser.add_argument('--num_env', type=int, default=50, help='Number of environments to use in training')
     parser.add_argument('--num_run', type=int, default=10000, help='Number of policy updates to run in training')
     parser.add_argument('--model_name', type=str, default='plantTypeAllocationModel.zip', help='Name to save zip file as. Defaults to plantTypeAllocationModel.zip' )
+    parser.add_argument('--eval_freq', type=int, default=10000, help='Number of environment steps (per environment) between evaluations, 0 disables evaluation. Defaults to 10000')
+    parser.add_argument('--eval_episodes', type=int, default=32, help='Number of layouts in the evaluation bank, split between Road and Walkway. Defaults to 32')
+    parser.add_argument('--checkpoint_freq', type=int, default=100, help='Number of policy updates between checkpoints, 0 disables checkpoints. Defaults to 100')
+    parser.add_argument('--checkpoint_dir', type=str, default='./src/models/checkpoints/', help='Folder of the training checkpoints. Defaults to ./src/models/checkpoints/')
+    parser.add_argument('--resume', action='store_true', help='Resume training from the most recent checkpoint in --checkpoint_dir')
+    parser.add_argument('--profile', type=int, default=0, help='1 to log the rollout, env step, env reset and policy optimization time of every update. Defaults to 0')
+    parser.add_argument('--eval_background', type=int, default=1, help='1 to evaluate in a background process, 0 to evaluate in the training loop. Defaults to 1')
 
     return parser.parse_args()
 
@@ -39,9 +49,32 @@ def make_env(env):
     return _init
 
 
-def train_model(model:PPO, max_run:int, n_steps:int, model_path:str, call_back=None, progress_bar:bool=True):
+def build_model(envs, n_steps:int, n_env:int, tensorboard_log:str="./src/logs/tensorboard/", **hyperparameters):
     """
-    Function to train model
+    Function to create the PPO model
+
+    Args:
+        envs (DummyVecEnv): training environments
+        n_steps (int): n_steps for each policy update
+        n_env (int): number of training environments
+        tensorboard_log (str, optional): tensorboard log folder. Defaults to "./src/logs/tensorboard/".
+        **hyperparameters: PPO arguments overriding the defaults (n_epochs=10, batch_size=n_steps*n_env)
+
+    Returns:
+        model (PPO): PPO model
+    """
+    arguments = {"n_epochs": 10, "batch_size": n_steps * n_env, **hyperparameters}
+    return PPO("MlpPolicy",
+                envs,
+                n_steps= n_steps,
+                verbose=0,
+                tensorboard_log=tensorboard_log,
+                **arguments)
+
+
+def train_model(model:PPO, max_run:int, n_steps:int, model_path:str, call_back=None, progress_bar:bool=True, reset_num_timesteps:bool=True, checkpoint_callback:trainingCheckpointCallback=None):
+    """
+    Function to train model, the model is only saved to model_path if training was not stopped by SIGTERM
 
     Args:
         model (PPO): PPO model
@@ -50,14 +83,27 @@ def train_model(model:PPO, max_run:int, n_steps:int, model_path:str, call_back=N
         model_path (str): model path to save model after training
         call_back (optional): callback for model. Defaults to None.
         progress_bar (bool, optional): Show training progress bar. Defaults to True.
+        reset_num_timesteps (bool, optional): Start counting timesteps from 0, False to continue a resumed model. Defaults to True.
+        checkpoint_callback (trainingCheckpointCallback, optional): checkpoint callback of the run (also listed in call_back), a preempted run is only kept in its checkpoint. Defaults to None.
+
+    Returns:
+        saved (bool): True if the model was saved to model_path
     """
     # Calculate total timesteps
     total_timesteps = max_run*n_steps
+    if not reset_num_timesteps:
+        # learn adds the timesteps the model has already taken
+        total_timesteps = max(total_timesteps - model.num_timesteps, 0)
     # Train model
-    model.learn(total_timesteps=total_timesteps, progress_bar=progress_bar, callback=call_back)
+    model.learn(total_timesteps=total_timesteps, progress_bar=progress_bar, callback=call_back, reset_num_timesteps=reset_num_timesteps)
+    # A preempted run is partly trained, it must not replace the served model
+    if checkpoint_callback is not None and checkpoint_callback.preempted:
+        print(f"Training stopped by SIGTERM, {model_path} not overwritten.")
+        return False
     # Save model
     model.save(model_path)
     print(f"Model saved to {model_path}.")
+    return True
 
 
 def main():
@@ -68,41 +114,52 @@ def main():
     n_env = args.num_env
     max_run = args.num_run
     model_name = args.model_name
+    checkpoints = list_checkpoints(args.checkpoint_dir) if args.resume else []
 
     # Setup Logger
     logging.basicConfig(
         filename= os.path.join('src/logs', 'training.log'),
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s',
-        filemode='w'
+        filemode='a' if checkpoints else 'w'
     )
 
-    # Create environment
-    logging.info("Training Plant Type Allocation Model")
-    logging.info("Checking environment")
-    test = plantTypeAllocationEnv(random.uniform(1,2), 0)
-    check_env(test)
-    envs = DummyVecEnv([make_env(plantTypeAllocationEnv(random.uniform(1,2), 0)) for env in range(n_env)])
-    eval_env = plantTypeAllocationEnv(random.uniform(1,2), random.randint(0,1), random.randint(0,50))
-
-    logging.info("Successfully created environment, creating model")
-    # Create Model
-    gc.collect()
-    model = PPO("MlpPolicy", 
-                envs, 
-                n_steps= n_steps,
-                n_epochs= 10,
-                batch_size= n_steps * n_env,
-                verbose=0,
-                tensorboard_log="./src/logs/tensorboard/")
-    
-    eval_callback = EvalCallback(eval_env, best_model_save_path="./src/models/",
-                            log_path="./src/logs/", eval_freq=10000,
-                            deterministic=True, render=False)
+    # Evaluates snapshots of the policy on a fixed bank of seeded layouts, in a background process so training does not stall
+    eval_callback = layoutBankEvalCallback(eval_freq=args.eval_freq, num_episodes=args.eval_episodes,
+                            best_model_save_path="./src/models/", log_path="./src/logs/",
+                            background=bool(args.eval_background))
+
+    if checkpoints:
+        # Resume with the model, optimizer, step counter, training environments and random states of the checkpoint
+        logging.info(f"Resuming training from {checkpoints[-1]}")
+        model = load_checkpoint(checkpoints[-1], eval_callback, tensorboard_log="./src/logs/tensorboard/")
+        logging.info(f"Successfully resumed model at {model.num_timesteps} timesteps")
+    else:
+        if args.resume:
+            logging.info(f"No checkpoint found in {args.checkpoint_dir}, starting a new training run")
+        # Create environment
+        logging.info("Training Plant Type Allocation Model")
+        logging.info("Checking environment")
+        test = plantTypeAllocationEnv(random.uniform(1,2), 0)
+        check_env(test)
+        envs = DummyVecEnv([make_env(plantTypeAllocationEnv(random.uniform(1,2), 0)) for env in range(n_env)])
+
+        logging.info("Successfully created environment, creating model")
+        # Create Model
+        gc.collect()
+        model = build_model(envs, n_steps, n_env)
+
+    checkpoint_callback = trainingCheckpointCallback(args.checkpoint_dir, args.checkpoint_freq, eval_callback=eval_callback)
+    callbacks = [eval_callback, checkpoint_callback]
+    if args.profile:
+        callbacks.append(trainingProfilerCallback(verbose=1))
     # Train model
     logging.info("Successfully created model, starting training")
-    train_model(model, max_run, n_steps, f'./src/models/{model_name}', eval_callback)
-    logging.info(f"Training Completed, Model saved in ./src/models/{model_name}")
+    saved = train_model(model, max_run, n_steps, f'./src/models/{model_name}', CallbackList(callbacks), reset_num_timesteps=not checkpoints, checkpoint_callback=checkpoint_callback)
+    if not saved:
+        logging.info(f"Training stopped by SIGTERM at {model.num_timesteps} timesteps, only the checkpoint was saved, run again with --resume to continue")
+    else:
+        logging.info(f"Training Completed, Model saved in ./src/models/{model_name}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+# Admission control of composition requests, bounded queue with a queue time limit in front of the worker pool
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from src.utils.metrics import metrics_registry
+
+class admissionRejectedError(Exception):
+    def __init__(self, status_code:int, retry_after:int, reason:str):
+        """
+        Raised when a request is not admitted
+
+        Args:
+            status_code (int): 429 when the queue is full, 503 when the request waited longer than the queue timeout
+            retry_after (int): seconds the client should wait before retrying
+            reason (str): queue_full or queue_timeout
+        """
+        super().__init__(f"Composition service is overloaded ({reason.replace('_', ' ')}), retry after {retry_after}s.")
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class admissionController():
+    def __init__(self, max_concurrent:int, max_queued:int=16, queue_timeout:float=10.0):
+        """
+        At most max_concurrent requests run at once, the next max_queued wait in arrival order and the others are rejected straight away
+        A queued request that has not started after queue_timeout seconds is rejected, so admitted requests keep a bounded latency under a burst
+
+        Args:
+            max_concurrent (int): maximum number of running requests, 0 disables admission control
+            max_queued (int, optional): maximum number of waiting requests. Defaults to 16.
+            queue_timeout (float, optional): seconds a request may wait before it is rejected. Defaults to 10.0.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+        self.running = 0
+        # Futures of the waiting requests, resolved when a running request hands over its slot
+        self.waiters = deque()
+        # Exponential moving average of the seconds a request runs, used for Retry-After
+        self.service_time = None
+
+        # Statistics
+        self.admitted = 0
+        self.rejected = 0
+
+    def retry_after(self):
+        """
+        Function to estimate when a rejected request could be admitted, from the queue length and the average request time
+
+        Returns:
+            seconds (int): Retry-After seconds, at least 1
+        """
+        service_time = self.service_time if self.service_time is not None else self.queue_timeout
+        return max(1, math.ceil((len(self.waiters) + 1) * service_time / max(self.max_concurrent, 1)))
+
+    def _reject(self, status_code:int, reason:str, endpoint:str):
+        """
+        Function to count a rejection and build its error
+        """
+        self.rejected += 1
+        metrics_registry.increment("spatial_admission_rejected_total", reason=reason, endpoint=endpoint)
+        return admissionRejectedError(status_code, self.retry_after(), reason)
+
+    def check_queue(self, endpoint:str="composition"):
+        """
+        Function to reject a request straight away when the queue is full, for requests accepted now that wait for their slot later
+
+        Args:
+            endpoint (str, optional): endpoint label of the metrics. Defaults to "composition".
+
+        Raises:
+            admissionRejectedError: the queue is full (429)
+        """
+        if self.max_concurrent > 0 and self.running >= self.max_concurrent and len(self.waiters) >= self.max_queued:
+            raise self._reject(429, "queue_full", endpoint)
+
+    async def acquire(self, endpoint:str="composition", bounded:bool=True):
+        """
+        Function to wait for a running slot
+
+        Args:
+            endpoint (str, optional): endpoint label of the metrics. Defaults to "composition".
+            bounded (bool, optional): apply the queue limit and the queue timeout, False for requests already accepted by check_queue. Defaults to True.
+
+        Raises:
+            admissionRejectedError: the queue is full (429) or the request waited longer than the queue timeout (503)
+        """
+        start = time.perf_counter()
+        if self.max_concurrent <= 0 or (self.running < self.max_concurrent and not self.waiters):
+            self.running += 1
+        elif bounded and len(self.waiters) >= self.max_queued:
+            raise self._reject(429, "queue_full", endpoint)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                # The slot is handed over by release, running is not changed
+                await asyncio.wait_for(waiter, self.queue_timeout if bounded else None)
+            except asyncio.TimeoutError:
+                # Timed out as the slot was handed over, pass it on
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                raise self._reject(503, "queue_timeout", endpoint)
+            except asyncio.CancelledError:
+                # Cancelled after the slot was handed over, pass it on
+                if waiter.done() and not waiter.cancelled():
+                    self.release()
+                raise
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+
+        self.admitted += 1
+        metrics_registry.observe("spatial_admission_wait_seconds", time.perf_counter() - start, endpoint=endpoint)
+
+    def release(self, service_time:float=None):
+        """
+        Function to hand the slot of a finished request to the oldest waiting request
+
+        Args:
+            service_time (float, optional): seconds the finished request ran, updates the Retry-After estimate. Defaults to None.
+        """
+        if service_time is not None:
+            self.service_time = service_time if self.service_time is None else 0.8 * self.service_time + 0.2 * service_time
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            # Waiters that timed out or were cancelled are skipped
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def admit(self, endpoint:str="composition", bounded:bool=True):
+        """
+        Context manager holding a running slot for the duration of the block
+
+        Args:
+            endpoint (str, optional): endpoint label of the metrics. Defaults to "composition".
+            bounded (bool, optional): apply the queue limit and the queue timeout. Defaults to True.
+        """
+        await self.acquire(endpoint, bounded)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): running and queued requests, admitted and rejected counters
+        """
+        return {
+            "running": self.running,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+
+if __name__ == "__main__":
+    pass
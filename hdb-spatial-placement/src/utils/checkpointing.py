@@ -0,0 +1,190 @@
+# Periodic training checkpoints, so long training runs can be resumed where they left off
+import os
+import re
+import copy
+import pickle
+import random
+import shutil
+import signal
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint_(\d+)$")
+
+def env_state(env):
+    """
+    Function to copy a training environment for pickling, methods set on the instance (eg. the timers of trainingProfilerCallback) are left out
+
+    Args:
+        env (plantTypeAllocationEnv): training environment
+
+    Returns:
+        env_copy (plantTypeAllocationEnv): shallow copy of the environment with its state and generators, using the methods of its class
+    """
+    env_copy = copy.copy(env)
+    for name in [name for name, value in vars(env_copy).items() if callable(value) and callable(getattr(type(env), name, None))]:
+        del vars(env_copy)[name]
+    return env_copy
+
+
+def save_checkpoint(model:PPO, checkpoint_dir:str, eval_callback=None, keep:int=2):
+    """
+    Function to save a checkpoint of the model between two policy updates
+    Checkpoints are written to a temporary folder and renamed once complete, so a crash while saving never leaves a partial checkpoint
+
+    Args:
+        model (PPO): model being trained on a DummyVecEnv
+        checkpoint_dir (str): folder of the checkpoints
+        eval_callback (layoutBankEvalCallback, optional): evaluation callback whose history is saved with the checkpoint. Defaults to None.
+        keep (int, optional): number of most recent checkpoints kept. Defaults to 2.
+
+    Returns:
+        checkpoint_path (str): folder of the saved checkpoint
+    """
+    checkpoint_path = os.path.join(checkpoint_dir, f"checkpoint_{model.num_timesteps}")
+    temporary_path = checkpoint_path + ".tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    # Policy, optimizer state and step counters
+    model.save(os.path.join(temporary_path, "model"))
+    training_state = {
+        "random_state": random.getstate(),
+        "numpy_random_state": np.random.get_state(),
+        "torch_random_state": torch.get_rng_state(),
+        # Training environments mid episode, including the generators of their procedural generation
+        "envs": [env_state(env) for env in model.get_env().envs],
+        "last_obs": model._last_obs,
+        "last_episode_starts": model._last_episode_starts,
+        "eval_callback": None if eval_callback is None else {
+            "best_mean_reward": eval_callback.best_mean_reward,
+            "evaluations_timesteps": eval_callback.evaluations_timesteps,
+            "evaluations_results": eval_callback.evaluations_results,
+            "evaluations_length": eval_callback.evaluations_length,
+        },
+    }
+    with open(os.path.join(temporary_path, "training_state.pkl"), 'wb') as file:
+        pickle.dump(training_state, file)
+
+    shutil.rmtree(checkpoint_path, ignore_errors=True)
+    os.rename(temporary_path, checkpoint_path)
+
+    for old_checkpoint in list_checkpoints(checkpoint_dir)[:-keep]:
+        shutil.rmtree(old_checkpoint, ignore_errors=True)
+    return checkpoint_path
+
+
+def list_checkpoints(checkpoint_dir:str):
+    """
+    Function to list the complete checkpoints of a folder
+
+    Args:
+        checkpoint_dir (str): folder of the checkpoints
+
+    Returns:
+        checkpoint_paths (list): checkpoint folders from the oldest to the most recent
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    checkpoints = [
+        (int(match.group(1)), os.path.join(checkpoint_dir, name))
+        for name in os.listdir(checkpoint_dir)
+        if (match := CHECKPOINT_PATTERN.match(name)) is not None
+    ]
+    return [path for _, path in sorted(checkpoints)]
+
+
+def load_checkpoint(checkpoint_path:str, eval_callback=None, **kwargs):
+    """
+    Function to load a checkpoint so training continues exactly where it stopped
+
+    Args:
+        checkpoint_path (str): checkpoint folder from save_checkpoint
+        eval_callback (layoutBankEvalCallback, optional): evaluation callback to restore the history of. Defaults to None.
+        **kwargs: PPO.load arguments (eg. tensorboard_log)
+
+    Returns:
+        model (PPO): model with its optimizer state, step counters, training environments and random states restored
+    """
+    with open(os.path.join(checkpoint_path, "training_state.pkl"), 'rb') as file:
+        training_state = pickle.load(file)
+
+    envs = DummyVecEnv([lambda env=env: env for env in training_state["envs"]])
+    model = PPO.load(os.path.join(checkpoint_path, "model"), env=envs, **kwargs)
+    # Training continues the interrupted episodes instead of resetting the environments
+    model._last_obs = training_state["last_obs"]
+    model._last_episode_starts = training_state["last_episode_starts"]
+
+    if eval_callback is not None and training_state["eval_callback"] is not None:
+        for name, value in training_state["eval_callback"].items():
+            setattr(eval_callback, name, value)
+
+    # Restored last as loading the model draws from the generators
+    random.setstate(training_state["random_state"])
+    np.random.set_state(training_state["numpy_random_state"])
+    torch.set_rng_state(training_state["torch_random_state"])
+    return model
+
+
+class trainingCheckpointCallback(BaseCallback):
+    def __init__(self, checkpoint_dir:str, save_freq:int=100, keep:int=2, eval_callback=None, verbose:int=0):
+        """
+        Callback saving a checkpoint every save_freq policy updates, between the optimization of an update and the next rollout
+        On SIGTERM (eg. a preempted node) a last checkpoint is saved at the next update and training stops
+
+        Args:
+            checkpoint_dir (str): folder of the checkpoints
+            save_freq (int, optional): number of policy updates between checkpoints. Defaults to 100.
+            keep (int, optional): number of most recent checkpoints kept. Defaults to 2.
+            eval_callback (layoutBankEvalCallback, optional): evaluation callback whose history is saved with the checkpoints. Defaults to None.
+            verbose (int, optional): 1 to print every checkpoint. Defaults to 0.
+        """
+        super().__init__(verbose)
+        self.checkpoint_dir = checkpoint_dir
+        self.save_freq = save_freq
+        self.keep = keep
+        self.eval_callback = eval_callback
+        self.last_checkpoint_timesteps = None
+        self.preempted = False
+        self.stop_training = False
+        self.previous_handler = None
+
+    def _handle_sigterm(self, signum, frame):
+        self.preempted = True
+
+    def _init_callback(self):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        # A resumed run does not save the checkpoint it was resumed from again
+        self.last_checkpoint_timesteps = self.model.num_timesteps
+
+    def _on_training_start(self):
+        self.previous_handler = signal.signal(signal.SIGTERM, self._handle_sigterm)
+
+    def _save(self):
+        checkpoint_path = save_checkpoint(self.model, self.checkpoint_dir, self.eval_callback, self.keep)
+        self.last_checkpoint_timesteps = self.model.num_timesteps
+        if self.verbose >= 1:
+            print(f"Checkpoint saved to {checkpoint_path}")
+
+    def _on_rollout_start(self):
+        # The previous update is fully optimized and the next rollout has not started, the only point training can resume from
+        update = self.model.num_timesteps // (self.model.n_steps * self.training_env.num_envs)
+        due = self.save_freq > 0 and update % self.save_freq == 0
+        if (due or self.preempted) and self.model.num_timesteps != self.last_checkpoint_timesteps:
+            self._save()
+        self.stop_training = self.preempted
+
+    def _on_step(self):
+        return not self.stop_training
+
+    def _on_training_end(self):
+        if self.previous_handler is not None:
+            signal.signal(signal.SIGTERM, self.previous_handler)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,134 @@
+# LRU cache with TTL and memory cap for serialized composition responses
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+def composition_key(plant_palette:list, style:str, surrounding:str, seed:int=None, count:int=3, recomposable:bool=False):
+    """
+    Function to create a canonical hash of a composition request
+    The palette order does not matter, only the species IDs are used
+
+    Args:
+        plant_palette (list): plant palette from the UI
+        style (str): composition style
+        surrounding (str): surrounding context
+        seed (int, optional): composition seed. Defaults to None.
+        count (int, optional): number of compositions in the response. Defaults to 3.
+        recomposable (bool, optional): the compositions keep their recomposition state. Defaults to False.
+
+    Returns:
+        key (str): sha256 hex digest of the request
+    """
+    species_ids = sorted(str(plant.get("Species ID", plant.get("Scientific Name"))) for plant in plant_palette)
+    request = {
+        "species": species_ids,
+        "style": style,
+        "surrounding": surrounding,
+        "seed": seed,
+        "count": count
+    }
+    # Only added when set so the keys of other requests do not change
+    if recomposable:
+        request["recomposable"] = True
+    canonical_request = json.dumps(request, sort_keys=True)
+    return hashlib.sha256(canonical_request.encode()).hexdigest()
+
+
+class compositionCache():
+    def __init__(self, max_entries:int=256, ttl:float=3600, max_bytes:int=64*1024*1024):
+        """
+        Least recently used cache for serialized composition responses
+        Entries expire after ttl seconds and the least recently used entries are evicted once max_entries or max_bytes is exceeded
+
+        Args:
+            max_entries (int, optional): maximum number of cached responses, 0 disables the cache. Defaults to 256.
+            ttl (float, optional): seconds before an entry expires. Defaults to 3600.
+            max_bytes (int, optional): maximum total size of the cached responses in bytes. Defaults to 64MB.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # key: (expiry time, response bytes)
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key:str):
+        """
+        Function to retrieve a cached response
+
+        Args:
+            key (str): key from composition_key
+
+        Returns:
+            response (bytes | None): cached response, None if missing or expired
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expiry, response = entry
+        if expiry < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def set(self, key:str, response:bytes):
+        """
+        Function to cache a response, evicting the least recently used entries if required
+
+        Args:
+            key (str): key from composition_key
+            response (bytes): serialized response
+        """
+        if self.max_entries <= 0 or len(response) > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.current_bytes += len(response)
+
+        while len(self.entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): cache size and hit/miss counters
+        """
+        return {
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def _remove(self, key:str):
+        """
+        Function to remove an entry and update the cached size
+
+        Args:
+            key (str): key from composition_key
+        """
+        _, response = self.entries.pop(key)
+        self.current_bytes -= len(response)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,232 @@
+# Headless rasterisation of compositions to PNG with a numpy colour lookup table and OpenCV
+# cv2 is imported inside render_composition, so the API process can import render_key without it
+import re
+import json
+import hashlib
+
+import numpy as np
+
+from src.utils.metrics import record_latency
+
+# RGB colours of the 2D downloads of the UI (hdb-ui/src/functions/download2DImage.js)
+BACKGROUND_COLOUR = (255, 255, 255)
+PLANTING_AREA_COLOUR = (210, 216, 179)
+PLANTING_AREA_OUTLINE = (156, 162, 158)
+SHRUB_OUTLINE = (112, 145, 136)
+TREE_OUTLINE = (110, 134, 50)
+TREE_COLOURS = [(228, 236, 138), (224, 212, 170), (207, 212, 132), (163, 147, 112)]
+SHRUB_COLOURS = [
+    (184, 209, 210), (157, 204, 212), (121, 152, 168), (74, 126, 137), (131, 162, 172),
+    (139, 174, 196), (66, 97, 173), (42, 146, 142), (109, 101, 150), (161, 170, 169)
+]
+# Tree canopies are drawn with the radius (in cells) and opacity used by the UI
+TREE_CANOPY_RADIUS = 10
+TREE_OPACITY = 0.75
+CANOPY_OUTLINE_OPACITY = 0.25
+# Shrub regions smaller than this many cells are not labelled
+MIN_LABEL_CELLS = 20
+# "(y, x)" coordinate keys of a composition
+POSITION_PATTERN = re.compile(r"\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)")
+
+def render_key(composition:dict, plant_palette:list, layer:str, scale:int):
+    """
+    Function to create a canonical hash of a render request, the same composition drawn the same way has the same key
+
+    Args:
+        composition (dict): composition with grid and coordinates
+        plant_palette (list): plant palette used for the labels
+        layer (str): tree or shrub
+        scale (int): pixels per grid cell
+
+    Returns:
+        key (str): sha256 hex digest of the render request
+    """
+    species_names = sorted((str(plant.get("Species ID")), str(plant.get("Scientific Name"))) for plant in plant_palette)
+    canonical_request = json.dumps({
+        "grid": composition["grid"],
+        "coordinates": sorted((str(position), str(species_id)) for position, species_id in composition["coordinates"].items()),
+        "species": species_names,
+        "layer": layer,
+        "scale": scale
+    }, sort_keys=True)
+    return hashlib.sha256(canonical_request.encode()).hexdigest()
+
+
+def parse_position(position:str):
+    """
+    Function to parse a "(y, x)" coordinate key of a composition
+
+    Returns:
+        position (tuple): (y, x) grid position
+
+    Raises:
+        ValueError: the key is not a "(y, x)" pair of integers
+    """
+    match = POSITION_PATTERN.fullmatch(str(position).strip())
+    if match is None:
+        raise ValueError(f"Coordinate {position!r} is not a \"(y, x)\" grid position.")
+    return int(match.group(1)), int(match.group(2))
+
+
+def validate_composition(composition:dict, scale:int, max_cells:int, max_pixels:int):
+    """
+    Function to check a composition given to the renderer, so malformed or oversized compositions are rejected before they reach a worker
+
+    Args:
+        composition (dict): composition with grid and coordinates
+        scale (int): pixels per grid cell
+        max_cells (int): maximum number of grid cells
+        max_pixels (int): maximum number of pixels of the image
+
+    Raises:
+        ValueError: the grid is not a non-empty rectangular integer grid within the limits, or a coordinate key is not a "(y, x)" position
+    """
+    grid, coordinates = composition.get("grid"), composition.get("coordinates")
+    if not isinstance(grid, list) or not grid or not all(isinstance(row, list) for row in grid) or not isinstance(coordinates, dict):
+        raise ValueError("The composition must have a grid (list of rows) and coordinates (\"(y, x)\": Species ID).")
+    height, width = len(grid), len(grid[0])
+    if width == 0 or any(len(row) != width for row in grid):
+        raise ValueError("The composition grid must be rectangular and not empty.")
+    if height * width > max_cells or height * width * scale * scale > max_pixels:
+        raise ValueError(f"The {height}x{width} composition grid is too large to render at scale {scale}, the limits are {max_cells} cells and {max_pixels} pixels.")
+    if not all(isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 3 for row in grid for value in row):
+        raise ValueError("The composition grid values must be 0 (unplantable), 1 (planting area), 2 (tree) or 3 (shrub).")
+    for position in coordinates:
+        parse_position(position)
+
+
+def plant_label(plant:dict, prefix:str):
+    """
+    Function to abbreviate a plant like the UI, the prefix followed by the initials of the first two words of its scientific name
+
+    Args:
+        plant (dict): palette plant
+        prefix (str): T for trees while S for shrubs
+
+    Returns:
+        label (str): abbreviated plant name (eg. TEc)
+    """
+    initials = "".join(word[0] for word in str(plant.get("Scientific Name", "")).split(" ")[:2] if word)
+    return prefix + initials[:1].upper() + initials[1:]
+
+
+def _blend_circle(image:np.ndarray, centre:tuple, radius:int, colour:tuple, thickness:int, opacity:float):
+    """
+    Function to draw a translucent circle, only the bounding box of the circle is copied and blended
+    """
+    import cv2
+
+    height, width = image.shape[:2]
+    top, bottom = max(centre[1] - radius - 2, 0), min(centre[1] + radius + 3, height)
+    left, right = max(centre[0] - radius - 2, 0), min(centre[0] + radius + 3, width)
+    if top < bottom and left < right:
+        region = image[top:bottom, left:right]
+        overlay = region.copy()
+        cv2.circle(overlay, (centre[0] - left, centre[1] - top), radius, colour, thickness, cv2.LINE_AA)
+        region[:] = cv2.addWeighted(overlay, opacity, region, 1 - opacity, 0)
+
+
+def _put_centred_text(image:np.ndarray, text:str, centre:tuple):
+    """
+    Function to draw a black label centred on a pixel
+    """
+    import cv2
+
+    (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.35, 1)
+    cv2.putText(image, text, (centre[0] - text_width // 2, centre[1] + text_height // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1, cv2.LINE_AA)
+
+
+@record_latency("render_composition")
+def render_composition(composition:dict, plant_palette:list=None, layer:str="shrub", scale:int=5):
+    """
+    Function to draw the tree or shrub planting plan of a composition as a PNG, like the 2D downloads of the UI
+    Cells are coloured with a lookup table indexed by their region, shrub regions are the planting cells closest to each shrub
+    coordinate (one distance transform), and outlines, canopies and labels are drawn with OpenCV into the same uint8 image
+
+    Args:
+        composition (dict): composition with grid (0 unplantable, 1 planting area, 2 tree, 3 shrub) and "(y, x)": Species ID coordinates
+        plant_palette (list, optional): plant palette of the composition, plants are labelled when given. Defaults to None.
+        layer (str, optional): tree for the tree canopies or shrub for the shrub regions. Defaults to "shrub".
+        scale (int, optional): pixels per grid cell. Defaults to 5.
+
+    Returns:
+        png (bytes): PNG image of (h*scale, w*scale) pixels
+    """
+    import cv2
+
+    grid = np.asarray(composition["grid"], dtype=np.int16)
+    height, width = grid.shape
+    planting = grid >= 1
+    palette = {str(plant.get("Species ID")): plant for plant in plant_palette or []}
+
+    # Coordinates in row major order, the order the UI assigns the colours in
+    trees, shrubs = [], []
+    for position, species_id in sorted(((parse_position(position), str(species_id)) for position, species_id in composition["coordinates"].items())):
+        y, x = position
+        if 0 <= y < height and 0 <= x < width:
+            if grid[y, x] == 2:
+                trees.append((y, x, species_id))
+            elif grid[y, x] == 3:
+                shrubs.append((y, x, species_id))
+
+    # Region of every cell, 0 unplantable, 1 planting area and 2 + the species index for the cells of a shrub region
+    regions = planting.astype(np.uint8)
+    colour_table = [BACKGROUND_COLOUR, PLANTING_AREA_COLOUR]
+    shrub_species = list(dict.fromkeys(species_id for _, _, species_id in shrubs))
+    if layer == "shrub" and shrubs:
+        colour_table += [SHRUB_COLOURS[index % len(SHRUB_COLOURS)] for index in range(len(shrub_species))]
+        # Every shrub coordinate is a zero pixel with its own label, the label of a cell is its closest shrub coordinate
+        seeds = np.ones((height, width), dtype=np.uint8)
+        seed_rows, seed_columns = np.array([(y, x) for y, x, _ in shrubs]).T
+        seeds[seed_rows, seed_columns] = 0
+        _, labels = cv2.distanceTransformWithLabels(seeds, cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_PIXEL)
+        label_regions = np.zeros(labels.max() + 1, dtype=np.uint8)
+        label_regions[labels[seed_rows, seed_columns]] = [2 + shrub_species.index(species_id) for _, _, species_id in shrubs]
+        regions[planting] = label_regions[labels[planting]]
+
+    # Colour lookup of the cells and nearest neighbour upscaling
+    image = cv2.resize(np.array(colour_table, dtype=np.uint8)[regions], (width * scale, height * scale), interpolation=cv2.INTER_NEAREST)
+    cell_regions = cv2.resize(regions, (width * scale, height * scale), interpolation=cv2.INTER_NEAREST)
+
+    # Outline of the planting areas, then the borders between shrub regions
+    planting_mask = (cell_regions >= 1).astype(np.uint8)
+    contours, _ = cv2.findContours(planting_mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    cv2.drawContours(image, contours, -1, PLANTING_AREA_OUTLINE if layer == "tree" else SHRUB_OUTLINE, 2)
+    if layer == "shrub":
+        borders = np.zeros(cell_regions.shape, dtype=bool)
+        borders[:, 1:] |= (cell_regions[:, 1:] != cell_regions[:, :-1]) & (cell_regions[:, :-1] >= 2) & (cell_regions[:, 1:] >= 2)
+        borders[1:, :] |= (cell_regions[1:, :] != cell_regions[:-1, :]) & (cell_regions[:-1, :] >= 2) & (cell_regions[1:, :] >= 2)
+        image[borders] = SHRUB_OUTLINE
+
+    # Tree canopies, filled on the tree layer while only outlined on the shrub layer
+    tree_species = list(dict.fromkeys(species_id for _, _, species_id in trees))
+    radius = TREE_CANOPY_RADIUS * scale
+    for y, x, species_id in trees:
+        centre = (x * scale, y * scale)
+        if layer == "tree":
+            _blend_circle(image, centre, radius, TREE_COLOURS[tree_species.index(species_id) % len(TREE_COLOURS)], -1, TREE_OPACITY)
+            cv2.circle(image, centre, radius, TREE_OUTLINE, 2, cv2.LINE_AA)
+        else:
+            _blend_circle(image, centre, radius, (0, 0, 0), 2, CANOPY_OUTLINE_OPACITY)
+
+    # Labels at the tree centres or the centroid of every connected shrub region
+    if palette:
+        if layer == "tree":
+            for y, x, species_id in trees:
+                if species_id in palette:
+                    _put_centred_text(image, plant_label(palette[species_id], "T"), (x * scale, y * scale))
+        else:
+            for index, species_id in enumerate(shrub_species):
+                if species_id not in palette:
+                    continue
+                count, _, stats, centroids = cv2.connectedComponentsWithStats((regions == 2 + index).astype(np.uint8), connectivity=4)
+                for (centroid_x, centroid_y), area in zip(centroids[1:count], stats[1:count, cv2.CC_STAT_AREA]):
+                    if area >= MIN_LABEL_CELLS:
+                        _put_centred_text(image, plant_label(palette[species_id], "S"), (int(round(centroid_x)) * scale, int(round(centroid_y)) * scale))
+
+    # OpenCV encodes BGR images, its default PNG settings encode about twice as fast as an explicit compression level
+    return cv2.imencode(".png", cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes()
+
+
+if __name__ == "__main__":
+    pass
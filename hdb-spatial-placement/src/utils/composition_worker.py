@@ -0,0 +1,275 @@
+# Worker functions for running the composition pipeline inside a process pool
+# The pipeline modules (torch, stable-baselines3, gymnasium, cv2, scipy) are imported inside the functions,
+# so the API process can import this module without paying for them, workers import them in initialise_worker
+import time
+import pickle
+import logging
+import numpy as np
+from functools import partial
+
+from src.utils.job_store import compositionJobStore
+from src.utils.metrics import metrics_registry
+
+# Per process instances, populated once by initialise_worker when the worker process starts
+worker_instances = {}
+
+# Minimal palette used to warm up the worker
+WARM_UP_PALETTE = [
+    {"Scientific Name": "Warm Up Tree", "Species ID": 0, "Plant Type": ["Tree"], "Light Preference": ["Full Sun"], "Hazard": "-", "Canopy Radius": 3.0},
+    {"Scientific Name": "Warm Up Border Shrub", "Species ID": 1, "Plant Type": ["Shrub"], "Light Preference": ["Full Sun"], "Hazard": "-", "Canopy Radius": "N/A"},
+    {"Scientific Name": "Warm Up Shade Shrub", "Species ID": 2, "Plant Type": ["Shrub"], "Light Preference": ["Semi Shade"], "Hazard": "Thorny", "Canopy Radius": "N/A"},
+]
+
+
+def initialise_worker(model_path:str, torch_threads:int=1, warm_up:bool=True, beam_search:tuple=(0, 8, None)):
+    """
+    Process pool initializer, preloads the RL model and the pipeline modules once per worker process
+
+    Args:
+        model_path (str): path to the PPO zip file, or an actor exported by src.export_policy (.npz, served without torch)
+        torch_threads (int, optional): number of torch threads per worker, keep at 1 so workers do not fight over cores. Defaults to 1.
+        warm_up (bool, optional): run one composition so the first request does not pay for cold code paths. Defaults to True.
+        beam_search (tuple, optional): (beam width, candidates, time budget) of the RL type allocation, beam width 0 samples the actions instead. Defaults to (0, 8, None).
+    """
+    from src.eval import load_policy
+
+    worker_instances["plantType_allocation"] = load_policy(model_path, torch_threads)
+    worker_instances["beam_search"] = beam_search
+
+    if warm_up:
+        logging.info(f"Worker warmed up in {warm_up_worker():.2f}s")
+
+
+def warm_up_worker():
+    """
+    Function to run one composition with WARM_UP_PALETTE
+    The first composition pays for lazy imports, the first torch inference and cv2/scipy initialisation
+    The composition is also rendered once, as the first PNG encoding and text drawing are several times slower
+
+    Returns:
+        elapsed (float): seconds taken by the warm up composition
+    """
+    from src.utils.composition_render import render_composition
+
+    start = time.perf_counter()
+    layout = generate_layout(0)
+    composition = hatch_layout(layout, WARM_UP_PALETTE, "Manicured", "Road")
+    if composition is not None:
+        render_composition(composition, WARM_UP_PALETTE)
+    # Warm up timings are not representative of requests
+    metrics_registry.drain()
+    return time.perf_counter() - start
+
+
+def worker_ready():
+    """
+    Function submitted at startup to spawn the worker processes (and load their models) before the first request
+
+    Returns:
+        ready (bool): True if the worker has loaded its model
+    """
+    return "plantType_allocation" in worker_instances
+
+
+def report_progress(job_reference:tuple, stage:str):
+    """
+    Function to record the stage of a composition belonging to an asynchronous job
+    Raises jobCancelledError if the job has been cancelled so the worker stops early
+
+    Args:
+        job_reference (tuple | None): (job store path, job id, composition index), nothing is recorded if None
+        stage (str): current stage
+    """
+    if job_reference is None:
+        return
+    db_path, job_id, composition = job_reference
+    if db_path not in worker_instances:
+        worker_instances[db_path] = compositionJobStore(db_path)
+    worker_instances[db_path].update_stage(job_id, composition, stage)
+
+
+def generate_layout(context:int, job_reference:tuple=None, rng:np.random.Generator=None):
+    """
+    Function to generate one RL layout, runs procedural generation and RL type allocation
+    The layout only depends on the context so it can be generated ahead of time
+
+    Args:
+        context (int): 0 for road while 1 for walkway
+        job_reference (tuple, optional): (job store path, job id, composition index) to report progress to. Defaults to None.
+        rng (np.random.Generator, optional): generator used for the environment and the RL actions. Defaults to None (new unseeded generator).
+
+    Returns:
+        layout (tuple): (planting_grid, coordinates) where coordinates is the {Tree: [], Shrubs: []} dictionary
+    """
+    from src.eval import eval_model, beam_search
+    from src.utils.type_allocation_env import plantTypeAllocationEnv
+
+    rng = rng if rng is not None else np.random.default_rng()
+    report_progress(job_reference, "rl_allocation")
+    planting_environment = plantTypeAllocationEnv(rng.uniform(1,2), context, rng.uniform(0,50), rng=rng)
+    beam_width, candidates, time_budget = worker_instances.get("beam_search", (0, 8, None))
+    if beam_width > 0:
+        _, planting_grid, coordinates = beam_search(worker_instances["plantType_allocation"], planting_environment, beam_width, candidates, time_budget)
+    else:
+        _, planting_grid, coordinates = eval_model(worker_instances["plantType_allocation"], planting_environment, False, True, rng)
+    return planting_grid, coordinates
+
+
+def hatch_layout(layout:tuple, selected_plants:list, theme:str, surrounding:str, job_reference:tuple=None, rng:np.random.Generator=None, keep_state:bool=False):
+    """
+    Function to run the palette dependent hatching on a RL layout
+
+    Args:
+        layout (tuple): (planting_grid, coordinates) from generate_layout
+        selected_plants (list): plant palette from the UI
+        theme (str): composition style
+        surrounding (str): surrounding context returned to the UI
+        job_reference (tuple, optional): (job store path, job id, composition index) to report progress to. Defaults to None.
+        rng (np.random.Generator, optional): generator used for the hatching. Defaults to None (new unseeded generator).
+        keep_state (bool, optional): return the recomposition_state of the hatching environment, needed to recompose a category later. Defaults to False.
+
+    Returns:
+        formatted_response (dict | None): composition with grid, coordinates, surrounding_context and recomposition_state if kept, None if the composition is invalid
+    """
+    from src.utils.plant_hatching_assignment import plantHatchingAndAssignment
+
+    planting_grid, coordinates = layout
+    hatching_environment = plantHatchingAndAssignment(planting_grid, selected_plants, coordinates, theme, rng=rng)
+    progress_callback = None if job_reference is None else partial(report_progress, job_reference)
+    formatted_response = hatching_environment.hatch_allocate_plants(visualise=False, progress_callback=progress_callback)
+    # Valid planting composition
+    if len(formatted_response['coordinates'].keys()) > 10:
+        formatted_response['surrounding_context'] = surrounding
+        if keep_state:
+            formatted_response['recomposition_state'] = recomposition_state(hatching_environment)
+        return formatted_response
+    return None
+
+
+def recomposition_state(hatching_environment):
+    """
+    Function to serialise a hatching environment so the composition can be recomposed after a palette species is replaced
+    The cached layers are dropped as they are cheap to compute again
+
+    Args:
+        hatching_environment (plantHatchingAndAssignment): environment after hatch_allocate_plants or recompose
+
+    Returns:
+        state (bytes): pickled environment, only loaded again by recompose_composition in the workers
+    """
+    hatching_environment.layer_cache = {}
+    return pickle.dumps(hatching_environment)
+
+
+def recompose_composition(state:bytes, replacements:list, surrounding:str):
+    """
+    Function to recompose a composition after palette species are replaced, reusing its noise grids and tree coordinates
+
+    Args:
+        state (bytes): recomposition_state of the previous composition
+        replacements (list): [(previous Species ID, new plant)] replacements in the order they were made
+        surrounding (str): surrounding context returned to the UI
+
+    Returns:
+        formatted_response (dict): composition with grid, coordinates, surrounding_context and recomposition_state
+    """
+    hatching_environment = pickle.loads(state)
+    for previous_species_id, new_plant in replacements:
+        hatching_environment.replace_species(previous_species_id, new_plant)
+    formatted_response = hatching_environment.recompose()
+    formatted_response['surrounding_context'] = surrounding
+    formatted_response['recomposition_state'] = recomposition_state(hatching_environment)
+    return formatted_response
+
+
+def allocate_site_tiles(site_size:tuple, tiles:list, context:int, octave:float, perlin_seed:float, tile_seeds:list, tile_size:int=100):
+    """
+    Function to run procedural generation and RL type allocation on tiles of a large site
+    The policy forward pass is batched across the tiles, every tile samples its actions from its own generator
+    so a tile gives the same layout regardless of which tiles it is batched with
+
+    Args:
+        site_size (tuple): (w,h) of the site
+        tiles (list): tiles from site_tiles to allocate
+        context (int): 0 for road while 1 for walkway
+        octave (float): perlin octave of the site
+        perlin_seed (float): perlin seed of the site, shared by all tiles so the tiles agree on their overlaps
+        tile_seeds (list): seed of every tile, used for the RL actions
+        tile_size (int, optional): (w,h) of a tile. Defaults to 100.
+
+    Returns:
+        layouts (list): (planting_grid, coordinates) layout of every tile in tile coordinates
+    """
+    from src.eval import eval_model_batched
+    from src.utils.type_allocation_env import plantTypeAllocationEnv
+
+    rngs = [np.random.default_rng(tile_seed) for tile_seed in tile_seeds]
+    environments = [
+        plantTypeAllocationEnv(octave, context, perlin_seed, (tile_size, tile_size), rng, tile["origin"], site_size)
+        for tile, rng in zip(tiles, rngs)
+    ]
+    results = eval_model_batched(worker_instances["plantType_allocation"], environments, rngs)
+    return [(planting_grid, coordinates) for _, planting_grid, coordinates in results]
+
+
+def hatch_site_tile(layout:tuple, selected_plants:list, theme:str, seed:int):
+    """
+    Function to run the hatching on one tile of a large site, tiles are not mirrored and are kept even if they have few coordinates
+
+    Args:
+        layout (tuple): (planting_grid, coordinates) layout of the tile from tile_layouts
+        selected_plants (list): plant palette from the UI
+        theme (str): composition style
+        seed (int): seed of the tile hatching
+
+    Returns:
+        formatted_response (dict | None): tile composition with grid and coordinates, None if the tile has no planting coordinates
+    """
+    from src.utils.plant_hatching_assignment import plantHatchingAndAssignment
+
+    planting_grid, coordinates = layout
+    if not coordinates["Tree"] and not coordinates["Shrubs"]:
+        return None
+    hatching_environment = plantHatchingAndAssignment(planting_grid, selected_plants, coordinates, theme, rng=np.random.default_rng(seed), mirror=False)
+    return hatching_environment.hatch_allocate_plants()
+
+
+def generate_composition(selected_plants:list, theme:str, context:int, surrounding:str, layout:tuple=None, seed:int=None, job_reference:tuple=None, keep_state:bool=False):
+    """
+    Function to generate one valid composition, runs RL type allocation and hatching until the composition has more than 10 coordinates
+
+    Args:
+        selected_plants (list): plant palette from the UI
+        theme (str): composition style
+        context (int): 0 for road while 1 for walkway
+        surrounding (str): surrounding context returned to the UI
+        layout (tuple, optional): pre-generated (planting_grid, coordinates) layout to try first. Defaults to None.
+        seed (int, optional): composition seed, the same seed gives the same composition. Pre-generated layouts are ignored if set. Defaults to None.
+        job_reference (tuple, optional): (job store path, job id, composition index) to report progress to. Defaults to None.
+        keep_state (bool, optional): return the recomposition_state with the composition. Defaults to False.
+
+    Returns:
+        formatted_response (dict): composition with grid, coordinates and surrounding_context
+    """
+    # Every stage draws from this generator, the same seed always gives the same composition regardless of other requests
+    rng = np.random.default_rng(seed)
+    if seed is not None:
+        layout = None
+
+    attempts = 0
+    while True:
+        if layout is None:
+            layout = generate_layout(context, job_reference, rng)
+        formatted_response = hatch_layout(layout, selected_plants, theme, surrounding, job_reference, rng, keep_state)
+        attempts += 1
+        if formatted_response is not None:
+            metrics_registry.observe("spatial_composition_attempts", attempts, buckets=(1, 2, 3, 5, 10))
+            report_progress(job_reference, "completed")
+            return formatted_response
+        # Invalid composition, retry with a new layout (every rejection is retried, spatial_composition_attempts counts the retries)
+        metrics_registry.increment("spatial_composition_rejected_candidates_total")
+        layout = None
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,15 @@
+# Dtypes of the arrays passed between the stages of the spatial pipeline
+# Grids only hold a few small labels and heatmaps do not need double precision, so every stage allocates the compact dtypes below
+import numpy as np
+
+# Label grids: 0 surrounding, 1 plantable, 2 tree, 3 shrub (and the 128 plantable mask of the hatching)
+LABEL_DTYPE = np.uint8
+# Hatching region grids, labelled with the hatching index of every shrub species
+REGION_DTYPE = np.int16
+# Heatmaps and influence grids of the hatching
+HEATMAP_DTYPE = np.float32
+# Planting coordinate embeddings of the RL environment (coordinates, rounded distances and scores)
+EMBEDDING_DTYPE = np.int16
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,207 @@
+# Training callback evaluating snapshots of the policy on a fixed bank of evaluation layouts
+# Evaluations run batched in a background process, so training only pays for copying the policy weights
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+from stable_baselines3.common.callbacks import BaseCallback
+
+from src.eval import run_episodes_batched
+from src.utils.type_allocation_env import plantTypeAllocationEnv
+
+# Per process instances of the evaluation process, populated once by initialise_bank_worker
+bank_instances = {}
+
+def layout_bank(num_episodes:int, seed:int=0, contexts:tuple=(0, 1)):
+    """
+    Function to generate the evaluation layouts, environments are drawn from their episode seed like generate_layout of the composition workers
+
+    Args:
+        num_episodes (int): number of evaluation layouts, split evenly between the contexts
+        seed (int, optional): seed of the episode seeds, the same seed always gives the same bank. Defaults to 0.
+        contexts (tuple, optional): contexts of the layouts, 0 for road while 1 for walkway. Defaults to (0, 1).
+
+    Returns:
+        eval_envs (list): seeded plantTypeAllocationEnv of every layout, resetting them restores the same layout
+    """
+    episode_seeds = np.random.default_rng(seed).integers(0, 2**32, size=num_episodes).tolist()
+    eval_envs = []
+    for index, episode_seed in enumerate(episode_seeds):
+        rng = np.random.default_rng(episode_seed)
+        eval_envs.append(plantTypeAllocationEnv(rng.uniform(1, 2), contexts[index % len(contexts)], rng.uniform(0, 50), rng=rng))
+    return eval_envs
+
+
+def initialise_bank_worker(model_path:str, num_episodes:int, seed:int, best_model_path:str=None, best_mean_reward:float=-np.inf):
+    """
+    Process pool initializer, loads the model architecture and generates the layout bank once
+
+    Args:
+        model_path (str): path to a PPO zip file of the trained model, only its architecture is used
+        num_episodes (int): number of evaluation layouts
+        seed (int): seed of the layout bank
+        best_model_path (str, optional): path to save the best evaluated policy to. Defaults to None (not saved).
+        best_mean_reward (float, optional): mean reward to beat before saving the best policy, set when training is resumed. Defaults to -np.inf.
+    """
+    torch.set_num_threads(1)
+    bank_instances["model"] = PPO.load(model_path, device="cpu")
+    bank_instances["eval_envs"] = layout_bank(num_episodes, seed)
+    bank_instances["best_model_path"] = best_model_path
+    bank_instances["best_mean_reward"] = best_mean_reward
+
+
+def evaluate_policy_snapshot(policy_state:dict):
+    """
+    Function to evaluate a snapshot of the policy on every layout of the bank with the most likely actions
+
+    Args:
+        policy_state (dict): policy state dict with numpy arrays
+
+    Returns:
+        evaluation (dict): total reward and steps of every layout, and if the snapshot was saved as the best model
+    """
+    model = bank_instances["model"]
+    model.policy.load_state_dict({key: torch.as_tensor(value) for key, value in policy_state.items()})
+    total_rewards, steps = run_episodes_batched(model, bank_instances["eval_envs"], deterministic=True)
+
+    saved_best = False
+    if float(np.mean(total_rewards)) > bank_instances["best_mean_reward"]:
+        bank_instances["best_mean_reward"] = float(np.mean(total_rewards))
+        if bank_instances["best_model_path"] is not None:
+            model.save(bank_instances["best_model_path"])
+            saved_best = True
+    return {"total_rewards": total_rewards, "steps": steps, "saved_best": saved_best}
+
+
+class layoutBankEvalCallback(BaseCallback):
+    def __init__(self, eval_freq:int=10000, num_episodes:int=32, seed:int=0, best_model_save_path:str=None, log_path:str=None, background:bool=True, verbose:int=0):
+        """
+        Callback to evaluate the policy every eval_freq calls on a fixed bank of seeded layouts, replacing EvalCallback on a single random environment
+        Every layout of the bank is played in lockstep with one batched forward pass per step, in a background process by default.
+        Only one evaluation runs at a time, evaluations due while the previous one is running are skipped
+
+        Args:
+            eval_freq (int, optional): number of callback calls between evaluations. Defaults to 10000.
+            num_episodes (int, optional): number of layouts in the bank, split evenly between Road and Walkway. Defaults to 32.
+            seed (int, optional): seed of the layout bank. Defaults to 0.
+            best_model_save_path (str, optional): folder to save the best evaluated policy to as best_model.zip. Defaults to None (not saved).
+            log_path (str, optional): folder to save evaluations.npz to, in the EvalCallback format. Defaults to None (not saved).
+            background (bool, optional): evaluate in a background process instead of the training loop. Defaults to True.
+            verbose (int, optional): 1 to print every evaluation. Defaults to 0.
+        """
+        super().__init__(verbose)
+        self.eval_freq = eval_freq
+        self.num_episodes = num_episodes
+        self.seed = seed
+        self.best_model_save_path = best_model_save_path
+        self.log_path = log_path
+        self.background = background
+
+        self.executor = None
+        # (timestep, future) of the running evaluation
+        self.pending = None
+        self.skipped_evaluations = 0
+        self.best_mean_reward = -np.inf
+        self.evaluations_timesteps, self.evaluations_results, self.evaluations_length = [], [], []
+
+    def _init_callback(self):
+        best_model_path = None
+        if self.best_model_save_path is not None:
+            os.makedirs(self.best_model_save_path, exist_ok=True)
+            best_model_path = os.path.join(self.best_model_save_path, "best_model")
+        if self.log_path is not None:
+            os.makedirs(self.log_path, exist_ok=True)
+
+        if not self.background:
+            self.eval_envs = layout_bank(self.num_episodes, self.seed)
+            self.best_model_path = best_model_path
+            return
+
+        # The evaluation process rebuilds the model from a copy of it, later only the policy weights are sent
+        self.architecture_folder = tempfile.TemporaryDirectory()
+        architecture_path = os.path.join(self.architecture_folder.name, "architecture")
+        self.model.save(architecture_path)
+        self.executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=get_context("spawn"),
+            initializer=initialise_bank_worker,
+            initargs=(architecture_path, self.num_episodes, self.seed, best_model_path, self.best_mean_reward),
+        )
+
+    def _policy_snapshot(self):
+        """
+        Function to copy the policy weights, so training can keep updating the policy while the copy is evaluated
+        """
+        return {key: value.detach().cpu().numpy().copy() for key, value in self.model.policy.state_dict().items()}
+
+    def _record(self, timestep:int, evaluation:dict):
+        """
+        Function to log a finished evaluation
+        """
+        mean_reward = float(np.mean(evaluation["total_rewards"]))
+        self.evaluations_timesteps.append(timestep)
+        self.evaluations_results.append(evaluation["total_rewards"])
+        self.evaluations_length.append(evaluation["steps"])
+        if self.log_path is not None:
+            np.savez(
+                os.path.join(self.log_path, "evaluations"),
+                timesteps=self.evaluations_timesteps,
+                results=self.evaluations_results,
+                ep_lengths=self.evaluations_length,
+            )
+
+        self.logger.record("eval/mean_reward", mean_reward)
+        self.logger.record("eval/std_reward", float(np.std(evaluation["total_rewards"])))
+        self.logger.record("eval/mean_ep_length", float(np.mean(evaluation["steps"])))
+        self.logger.record("eval/evaluated_timesteps", timestep)
+        self.logger.record("eval/skipped_evaluations", self.skipped_evaluations)
+        self.best_mean_reward = max(self.best_mean_reward, mean_reward)
+        if self.verbose >= 1:
+            print(f"Eval num_timesteps={timestep}, mean reward {mean_reward:.2f} on {len(evaluation['total_rewards'])} layouts{', new best' if evaluation['saved_best'] else ''}")
+
+    def _collect(self, wait:bool=False):
+        """
+        Function to log the running evaluation if it has finished
+
+        Args:
+            wait (bool, optional): wait for the running evaluation to finish. Defaults to False.
+        """
+        if self.pending is None or not (wait or self.pending[1].done()):
+            return
+        timestep, future = self.pending
+        self.pending = None
+        self._record(timestep, future.result())
+
+    def _on_step(self):
+        self._collect()
+        if self.eval_freq <= 0 or self.n_calls % self.eval_freq != 0:
+            return True
+
+        if not self.background:
+            total_rewards, steps = run_episodes_batched(self.model, self.eval_envs, deterministic=True)
+            saved_best = float(np.mean(total_rewards)) > self.best_mean_reward and self.best_model_path is not None
+            if saved_best:
+                self.model.save(self.best_model_path)
+            self._record(self.num_timesteps, {"total_rewards": total_rewards, "steps": steps, "saved_best": saved_best})
+            return True
+
+        if self.pending is not None:
+            self.skipped_evaluations += 1
+            return True
+        self.pending = (self.num_timesteps, self.executor.submit(evaluate_policy_snapshot, self._policy_snapshot()))
+        return True
+
+    def _on_training_end(self):
+        # Log the last evaluation before the process is stopped
+        self._collect(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.architecture_folder.cleanup()
+
+
+if __name__ == "__main__":
+    pass
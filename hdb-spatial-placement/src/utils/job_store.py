@@ -0,0 +1,227 @@
+# SQLite backed store for asynchronous composition jobs
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+class jobCancelledError(Exception):
+    """
+    Raised inside a worker when the job it is working on has been cancelled
+    """
+    pass
+
+
+class compositionJobStore():
+    def __init__(self, db_path:str):
+        """
+        Job store shared by the API process and the composition workers
+        Jobs, their per composition stage and their results are kept in a SQLite file so results can be fetched later without recomputing
+
+        Job status: queued -> running -> completed / failed / cancelled
+        Composition stage: queued -> rl_allocation -> hatching -> mirroring (Manicured only) -> serialization -> completed
+
+        Args:
+            db_path (str): path to the SQLite file, created if it does not exist
+        """
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    composition_count INTEGER NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS job_stages (
+                    job_id TEXT NOT NULL,
+                    composition INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    PRIMARY KEY (job_id, composition)
+                )
+            """)
+
+    def create_job(self, request:dict, composition_count:int):
+        """
+        Function to create a queued job
+
+        Args:
+            request (dict): composition request
+            composition_count (int): number of compositions the job generates
+
+        Returns:
+            job_id (str): id of the new job
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (job_id, status, request, composition_count, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(request), composition_count, now, now)
+            )
+            connection.executemany(
+                "INSERT INTO job_stages (job_id, composition, stage) VALUES (?, ?, 'queued')",
+                [(job_id, composition) for composition in range(composition_count)]
+            )
+        return job_id
+
+    def get_job(self, job_id:str):
+        """
+        Function to retrieve the status and progress of a job, without the result
+
+        Args:
+            job_id (str): job id
+
+        Returns:
+            job (dict | None): job status and progress, None if the job does not exist
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT status, composition_count, error, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            stages = dict(connection.execute(
+                "SELECT composition, stage FROM job_stages WHERE job_id = ? ORDER BY composition", (job_id,)
+            ).fetchall())
+
+        status, composition_count, error, created_at, updated_at = row
+        completed = sum(stage == "completed" for stage in stages.values())
+        return {
+            "job_id": job_id,
+            "status": status,
+            "progress": completed / composition_count,
+            "stages": stages,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def get_result(self, job_id:str):
+        """
+        Function to retrieve the stored result of a job
+
+        Args:
+            job_id (str): job id
+
+        Returns:
+            result (dict | None): composition response, None if the job has no result
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT result FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def get_status(self, job_id:str):
+        """
+        Function to retrieve the status of a job
+
+        Args:
+            job_id (str): job id
+
+        Returns:
+            status (str | None): job status, None if the job does not exist
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_status(self, job_id:str, status:str, error:str=None):
+        """
+        Function to update the job status, finished jobs (completed, failed, cancelled) are never updated again
+
+        Args:
+            job_id (str): job id
+            status (str): new status
+            error (str, optional): error message for failed jobs. Defaults to None.
+
+        Returns:
+            updated (bool): True if the job status was updated
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ? AND status IN ('queued', 'running')",
+                (status, error, time.time(), job_id)
+            )
+            updated = cursor.rowcount > 0
+        return updated
+
+    def set_result(self, job_id:str, result:dict):
+        """
+        Function to store the result and complete the job
+
+        Args:
+            job_id (str): job id
+            result (dict): composition response
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'completed', result = ?, updated_at = ? WHERE job_id = ? AND status IN ('queued', 'running')",
+                (json.dumps(result), time.time(), job_id)
+            )
+
+    def update_stage(self, job_id:str, composition:int, stage:str):
+        """
+        Function to record the stage a composition of the job is in
+        Called from the workers, raises jobCancelledError so the worker stops working on a cancelled job
+
+        Args:
+            job_id (str): job id
+            composition (int): index of the composition in the job
+            stage (str): current stage
+        """
+        if self.get_status(job_id) == "cancelled":
+            raise jobCancelledError(f"Job {job_id} has been cancelled.")
+
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE job_stages SET stage = ? WHERE job_id = ? AND composition = ?", (stage, job_id, composition)
+            )
+            connection.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def fail_unfinished_jobs(self):
+        """
+        Function to fail jobs that were queued or running when the service stopped
+
+        Returns:
+            count (int): number of jobs failed
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Service restarted before the job finished.', updated_at = ? WHERE status IN ('queued', 'running')",
+                (time.time(),)
+            )
+            count = cursor.rowcount
+        return count
+
+    @contextmanager
+    def _connect(self):
+        """
+        Function to open a connection, a new connection is used for every operation so the store can be used from any thread or process
+        The transaction is committed when the block exits without errors
+
+        Yields:
+            connection (sqlite3.Connection): SQLite connection
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,85 @@
+# Pool of pre-generated RL layouts, refilled in the background by the composition worker pool
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import Executor
+
+from src.utils.composition_worker import generate_layout
+from src.utils.metrics import metrics_registry, run_with_metrics
+
+class layoutPool():
+    def __init__(self, executor:Executor, pool_size:int=6, refill_rate:float=2.0, contexts:tuple=(0, 1)):
+        """
+        Bounded per context pool of ready-made (planting_grid, coordinates) layouts
+        RL type allocation only depends on the context, so layouts are produced ahead of time and
+        requests only need to run the palette dependent hatching
+
+        Args:
+            executor (Executor): worker pool used to generate the layouts
+            pool_size (int, optional): maximum number of layouts kept for each context, 0 disables the pool. Defaults to 6.
+            refill_rate (float, optional): maximum number of layouts produced per second. Defaults to 2.0.
+            contexts (tuple, optional): contexts to keep layouts for, 0 for road while 1 for walkway. Defaults to (0, 1).
+        """
+        self.executor = executor
+        self.pool_size = pool_size
+        self.refill_rate = refill_rate
+        self.layouts = {context: deque(maxlen=max(pool_size, 1)) for context in contexts}
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def pop(self, context:int):
+        """
+        Function to retrieve a layout for the context
+
+        Args:
+            context (int): 0 for road while 1 for walkway
+
+        Returns:
+            layout (tuple | None): (planting_grid, coordinates) layout, None if the pool for the context is empty
+        """
+        if self.layouts.get(context):
+            self.hits += 1
+            return self.layouts[context].popleft()
+        self.misses += 1
+        return None
+
+    def sizes(self):
+        """
+        Returns:
+            sizes (dict): number of layouts currently available for each context
+        """
+        return {context: len(layouts) for context, layouts in self.layouts.items()}
+
+    async def run_producer(self):
+        """
+        Background task that keeps every context topped up to self.pool_size
+        Only one layout is produced at a time so the producer never occupies more than one worker
+        """
+        if self.pool_size <= 0:
+            return
+
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.refill_rate if self.refill_rate > 0 else 0
+        while True:
+            # Refill the emptiest context first
+            context = min(self.layouts, key=lambda c: len(self.layouts[c]))
+            if len(self.layouts[context]) >= self.pool_size:
+                await asyncio.sleep(max(interval, 0.1))
+                continue
+
+            try:
+                layout, worker_metrics = await loop.run_in_executor(self.executor, run_with_metrics, generate_layout, context)
+                metrics_registry.merge(worker_metrics)
+                self.layouts[context].append(layout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f"Failed to generate layout for context {context}")
+
+            await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    pass
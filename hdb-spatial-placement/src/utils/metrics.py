@@ -0,0 +1,190 @@
+# Lightweight latency histograms and counters exported in the Prometheus text format
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_DESCRIPTIONS = {
+    "spatial_stage_latency_seconds": "Latency of the composition pipeline stages.",
+    "spatial_composition_attempts": "Number of layouts tried before a valid composition was produced.",
+    "spatial_composition_rejected_candidates_total": "Hatched compositions rejected for having too few coordinates.",
+    "spatial_coalesced_requests_total": "Composition requests that waited on an identical request already running instead of running the pipeline.",
+    "spatial_in_flight_compositions": "Distinct composition requests currently running on the worker pool.",
+    "spatial_admission_wait_seconds": "Seconds composition requests waited in the admission queue before they started.",
+    "spatial_admission_rejected_total": "Composition requests rejected by admission control (queue_full: 429, queue_timeout: 503).",
+    "spatial_admission_running": "Composition requests currently holding a running slot.",
+    "spatial_admission_queue_depth": "Composition requests currently waiting for a running slot.",
+    "spatial_admission_max_concurrent": "Maximum number of running composition requests (SPATIAL_MAX_CONCURRENT_REQUESTS), 0 when admission control is disabled.",
+    "spatial_admission_max_queued": "Maximum number of waiting composition requests (SPATIAL_MAX_QUEUED_REQUESTS).",
+}
+
+class metricsRegistry():
+    def __init__(self):
+        """
+        Process local registry of histograms and counters
+        Recording only updates a few numbers, the Prometheus text is only built when /metrics is scraped
+        Worker processes drain their registry after every task and the API process merges the snapshots
+        """
+        # (name, labels) -> [bucket counts, sum, count], buckets are not cumulative until rendered
+        self.histograms = {}
+        # (name, labels) -> value
+        self.counters = {}
+
+    def observe(self, name:str, value:float, buckets:tuple=LATENCY_BUCKETS, **labels):
+        """
+        Function to record a value in a histogram
+
+        Args:
+            name (str): histogram name
+            value (float): observed value
+            buckets (tuple, optional): bucket upper bounds. Defaults to LATENCY_BUCKETS.
+            **labels: histogram labels
+        """
+        key = (name, tuple(sorted(labels.items())), buckets)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+    def increment(self, name:str, value:float=1, **labels):
+        """
+        Function to increment a counter
+
+        Args:
+            name (str): counter name
+            value (float, optional): increment. Defaults to 1.
+            **labels: counter labels
+        """
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def drain(self):
+        """
+        Function to return everything recorded since the last drain and reset the registry
+
+        Returns:
+            snapshot (dict): {"histograms": ..., "counters": ...}
+        """
+        snapshot = {"histograms": self.histograms, "counters": self.counters}
+        self.histograms = {}
+        self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot:dict):
+        """
+        Function to add a snapshot from drain into this registry
+
+        Args:
+            snapshot (dict): snapshot from drain
+        """
+        for key, (bucket_counts, total, count) in snapshot["histograms"].items():
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                self.histograms[key] = [list(bucket_counts), total, count]
+            else:
+                histogram[0] = [a + b for a, b in zip(histogram[0], bucket_counts)]
+                histogram[1] += total
+                histogram[2] += count
+        for key, value in snapshot["counters"].items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self, gauges:dict=None):
+        """
+        Function to build the Prometheus text exposition
+
+        Args:
+            gauges (dict, optional): {(name, labels tuple): value} gauges read at scrape time (eg. cache sizes). Defaults to None.
+
+        Returns:
+            text (str): metrics in the Prometheus text format
+        """
+        lines = []
+        described = set()
+
+        def describe(name:str, metric_type:str):
+            if name not in described:
+                described.add(name)
+                if name in METRIC_DESCRIPTIONS:
+                    lines.append(f"# HELP {name} {METRIC_DESCRIPTIONS[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels, buckets), (bucket_counts, total, count) in sorted(self.histograms.items()):
+            describe(name, "histogram")
+            cumulative = 0
+            for upper_bound, bucket_count in zip(list(buckets) + ["+Inf"], bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', upper_bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted((gauges or {}).items()):
+            describe(name, "gauge")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels:tuple):
+    """
+    Function to format labels as {key="value",...}
+
+    Args:
+        labels (tuple): ((key, value), ...) pairs
+
+    Returns:
+        formatted_labels (str): Prometheus label string, empty if there are no labels
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+# Registry of the current process
+metrics_registry = metricsRegistry()
+
+
+def record_latency(stage:str):
+    """
+    Decorator recording the latency of a function into the spatial_stage_latency_seconds histogram
+
+    Args:
+        stage (str): stage label
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics_registry.observe("spatial_stage_latency_seconds", time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorator
+
+
+def run_with_metrics(function, *args):
+    """
+    Function run inside a worker process, runs the function and returns the metrics it recorded
+
+    Args:
+        function (callable): function to run
+        *args: function arguments
+
+    Returns:
+        result: return value of the function
+        snapshot (dict): metrics recorded by the worker since the last task
+    """
+    result = function(*args)
+    return result, metrics_registry.drain()
+
+
+if __name__ == "__main__":
+    pass
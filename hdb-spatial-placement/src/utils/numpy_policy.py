@@ -0,0 +1,111 @@
+# Numpy implementation of the actor of the PPO model, loaded from the weights exported by src.export_policy
+# Serving with it does not import torch or stable-baselines3, and only the actor network is kept in memory
+import numpy as np
+
+# Storage dtypes of the exported weights
+WEIGHT_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+def quantize_weight(weight:np.ndarray, dtype:str):
+    """
+    Function to store a layer weight in a smaller dtype
+
+    Args:
+        weight (np.ndarray): float32 layer weight
+        dtype (str): float32, float16 or int8, int8 weights are symmetric with one scale for the layer
+
+    Returns:
+        quantized_weight (np.ndarray): weight in the storage dtype
+        scale (float): multiplier restoring the weight, 1 for float weights
+    """
+    if dtype != "int8":
+        return weight.astype(WEIGHT_DTYPES[dtype]), 1.0
+    scale = float(np.abs(weight).max()) / 127 or 1.0
+    return np.clip(np.round(weight / scale), -127, 127).astype(np.int8), scale
+
+
+class numpyPolicy():
+    def __init__(self, weights:list, biases:list, action_dimensions:list, observation_shape:tuple):
+        """
+        Actor network of the PPO MlpPolicy (tanh hidden layers followed by the action logits of every MultiDiscrete dimension)
+        Weights are restored to float32 when loaded, so a forward pass is a few float32 matrix products
+
+        Args:
+            weights (list): (out features, in features) float32 weight of every layer, the last layer outputs the action logits
+            biases (list): float32 bias of every layer
+            action_dimensions (list): size of every action dimension, (maximum planting spots, 3)
+            observation_shape (tuple): shape of one observation
+        """
+        self.weights = weights
+        self.biases = biases
+        self.action_dimensions = list(action_dimensions)
+        self.observation_shape = tuple(observation_shape)
+
+    @classmethod
+    def load(cls, path:str):
+        """
+        Function to load an actor exported by src.export_policy
+
+        Args:
+            path (str): npz file of the exported actor
+
+        Returns:
+            policy (numpyPolicy): loaded actor
+        """
+        with np.load(path) as exported:
+            layers = int(exported["layers"])
+            weights = [exported[f"weight_{layer}"].astype(np.float32) * np.float32(exported[f"scale_{layer}"]) for layer in range(layers)]
+            biases = [exported[f"bias_{layer}"].astype(np.float32) for layer in range(layers)]
+            return cls(weights, biases, exported["action_dimensions"].tolist(), tuple(exported["observation_shape"].tolist()))
+
+    def probabilities(self, observations:np.ndarray):
+        """
+        Function to compute the categorical probabilities of every action dimension
+
+        Args:
+            observations (np.ndarray): (batch, *observation shape) environment observations
+
+        Returns:
+            probabilities (list): (batch, dimension size) probabilities of every action dimension
+        """
+        hidden = np.asarray(observations, dtype=np.float32).reshape(len(observations), -1)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            hidden = np.tanh(hidden @ weight.T + bias)
+        logits = hidden @ self.weights[-1].T + self.biases[-1]
+
+        probabilities = []
+        for dimension_logits in np.split(logits, np.cumsum(self.action_dimensions)[:-1], axis=1):
+            exponents = np.exp(dimension_logits - dimension_logits.max(axis=1, keepdims=True))
+            probabilities.append(exponents / exponents.sum(axis=1, keepdims=True))
+        return probabilities
+
+    def predict(self, observation:np.ndarray, deterministic:bool=False):
+        """
+        Function matching PPO.predict, sampling from the global numpy random state unless deterministic
+
+        Args:
+            observation (np.ndarray): one observation or a batch of observations
+            deterministic (bool, optional): take the most likely action of every dimension. Defaults to False.
+
+        Returns:
+            actions (np.ndarray): action (or batch of actions)
+            state (None): no recurrent state
+        """
+        observations = np.asarray(observation)
+        single = observations.shape == self.observation_shape
+        if single:
+            observations = observations[None]
+
+        actions = []
+        for probabilities in self.probabilities(observations):
+            if deterministic:
+                actions.append(np.argmax(probabilities, axis=1))
+            else:
+                cumulative = np.cumsum(probabilities, axis=1, dtype=np.float64)
+                draws = np.random.random(len(cumulative))[:, None] * cumulative[:, -1:]
+                actions.append(np.minimum((cumulative <= draws).sum(axis=1), cumulative.shape[1] - 1))
+        actions = np.stack(actions, axis=1)
+        return (actions[0] if single else actions), None
+
+
+if __name__ == "__main__":
+    pass
@@ -1,17 +1,16 @@
 # Imports
 import numpy as np
-import random
 import cv2
 import copy
 import re
 from typing import Union
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-
 from scipy.spatial.distance import cdist
 from scipy.ndimage import label
 
+from src.utils.metrics import record_latency
+from src.utils.dtype_policy import LABEL_DTYPE, REGION_DTYPE, HEATMAP_DTYPE
+
 class plantHatchingAndAssignment():
     def __init__(self, 
                  starting_grid:np.ndarray, 
@@ -20,7 +19,9 @@ class plantHatchingAndAssignment():
                  theme: str, 
                  randomised_seed: int = None, 
                  dominance_threshold: float = 0.1, 
-                 binary_scale: bool= False):
+                 binary_scale: bool= False,
+                 rng: np.random.Generator = None,
+                 mirror: bool = True):
         """
         Plant assignment class
         After taking in the planting grid and the planting coordinates with their assigned plant types
@@ -35,11 +36,15 @@ class plantHatchingAndAssignment():
             randomised_seed (int, optional): Randomised seed, defaults to None.
             dominance_threshold (float, optional): Minimum DIFFERENCE threshold between the heatmap scores of each plant species to determine if they are dominant.
             binary_scale (bool, optional): Boolean to determine if the impact of the distance from point of interest (boundary/centre) is on a gradient or binary scale. Defaults to False for gradient, if True binary scale will be used.
+            rng (np.random.Generator, optional): Random number generator used for every random choice, so the same generator state always gives the same composition. Defaults to None (generator created from randomised_seed).
+            mirror (bool, optional): Mirror manicured compositions, disabled for tiles of a large site as mirroring moves the trees across the tile. Defaults to True.
         """
         # Initilisation of variables
         self.randomized_seed = randomised_seed
+        self.rng = rng if rng is not None else np.random.default_rng(randomised_seed)
         self.threshold = dominance_threshold
         self.binary_scale = binary_scale
+        self.mirror = mirror
 
         # Grid variables
         self.unplantable_int = 0
@@ -59,6 +64,15 @@ class plantHatchingAndAssignment():
         self.starting_shrub_seed_list = None
         self.tree_radii_dict = None
         self.tree_id_dict = None
+        self.assigned_trees = None
+
+        # Noise grid of every species and generator state before the hatching assignment of the last hatching,
+        # kept so a species can be replaced without generating new noise and with the same tie-breaks
+        self.noise_grids = None
+        self.assignment_rng_state = None
+
+        # Layers that only depend on the starting grid and the tree assignment (plantable grid, shade and border layers), reused across hatchings
+        self.layer_cache = {}
 
         # Random initialisation of tree planting
         self._assign_trees()
@@ -67,20 +81,43 @@ class plantHatchingAndAssignment():
         self.seed_mapping, self.shrub_int_list = self._create_seed_labels() 
 
 
-    def hatch_allocate_plants(self, visualise=False):      
+    def hatch_allocate_plants(self, visualise=False, progress_callback=None, variant=False):      
         """
         Function to allocate trees and shrubs into every coordinate
 
+        Args:
+            visualise (bool, optional): Visualise the final planting area. Defaults to False.
+            progress_callback (callable, optional): Called with the stage name ("hatching", "mirroring", "serialization") when each stage starts. Defaults to None.
+            variant (bool, optional): Shuffle the starter slots and always draw new Worley noise to produce an alternative hatching. Defaults to False.
+
         Returns:
             output_json (dictionary): Data to be returned to the UI
         """  
         # Generate Hatching
-        hatching_grid = self._generate_hatching()
+        if progress_callback is not None:
+            progress_callback("hatching")
+        hatching_grid = self._generate_hatching(variant)
+
+        return self._allocate_and_format(hatching_grid, visualise, progress_callback)
 
+    def _allocate_and_format(self, hatching_grid:np.ndarray, visualise=False, progress_callback=None):
+        """
+        Function to allocate the shrubs to a hatching grid and format the output, shared by hatch_allocate_plants and recompose
+
+        Args:
+            hatching_grid (np.ndarray): raw hatching grid from _generate_hatching or _apply_influence_grids_with_border
+            visualise (bool, optional): Visualise the final planting area. Defaults to False.
+            progress_callback (callable, optional): Called with the stage name ("mirroring", "serialization") when each stage starts. Defaults to None.
+
+        Returns:
+            output_json (dictionary): Data to be returned to the UI
+        """
         # Allocate shrubs and remove hatching segments without any coordinates
-        final_grid, assigned_seed_dict, grid_seed_mapping = self._allocate_plants(hatching_grid)
+        final_grid, assigned_seed_dict, grid_seed_mapping = self._allocate_plants(hatching_grid, progress_callback)
 
         # Format output for backend
+        if progress_callback is not None:
+            progress_callback("serialization")
         output_json = self._create_json(final_grid, assigned_seed_dict, grid_seed_mapping)
 
         # Visualise plantingg area is needed
@@ -88,6 +125,114 @@ class plantHatchingAndAssignment():
             self._visualize_grid_with_outlines(final_grid, assigned_seed_dict, grid_seed_mapping, self.tree_radii_dict)
         
         return output_json
+
+    def hatch_variants(self, variant_count:int, visualise=False, progress_callback=None):
+        """
+        Function to create alternative compositions for the same grid and palette
+        The tree assignment, plantable grid, shade and border layers (including their distance transforms) are computed once and reused,
+        only the Worley noise, starter slot order and tie-breaks are randomised again for every variant
+
+        Args:
+            variant_count (int): number of compositions to create
+            visualise (bool, optional): Visualise each final planting area. Defaults to False.
+            progress_callback (callable, optional): Called with the stage name for every variant, see hatch_allocate_plants. Defaults to None.
+
+        Returns:
+            variants (list): output_json of every composition, the first one is the same as hatch_allocate_plants would return
+        """
+        # Mirroring replaces the tree dictionaries and the layer cache, every variant starts from the original tree assignment and its layers
+        tree_radii_dict, tree_id_dict, layer_cache = self.tree_radii_dict, self.tree_id_dict, self.layer_cache
+
+        variants = []
+        for variant in range(variant_count):
+            self.tree_radii_dict, self.tree_id_dict, self.layer_cache = dict(tree_radii_dict), dict(tree_id_dict), layer_cache
+            variants.append(self.hatch_allocate_plants(visualise, progress_callback, variant=variant > 0))
+        return variants
+
+    def replace_species(self, previous_species_id:int, new_plant:dict):
+        """
+        Function to replace one species of the palette, the tree and shrub coordinates are kept
+        A replacement tree takes over every coordinate of the previous tree, a replacement shrub takes over its starter slots and noise grid
+        Shrubs of another border/shade category receive a hatching index of their new category, so only their heatmap changes,
+        while trees with another canopy radius change the shade layers of every shrub
+        Call recompose afterwards to create the new composition
+
+        Args:
+            previous_species_id (int): Species ID of the plant to replace
+            new_plant (dict): replacement plant, must be the same plant type (tree or shrub) as the previous plant
+
+        Raises:
+            ValueError: If the previous plant is not in the palette or the plant types do not match.
+        """
+        previous_plant = next((plant for plant in self.selected_plants_dict if plant.get("Species ID") == previous_species_id), None)
+        if previous_plant is None:
+            raise ValueError(f"Species {previous_species_id} is not in the plant palette.")
+        self.selected_plants_dict = [new_plant if plant is previous_plant else plant for plant in self.selected_plants_dict]
+
+        if any(plant is previous_plant for plant in self.tree_info_list):
+            if not (self._contains_palm(new_plant["Plant Type"]) or self._contains_tree(new_plant["Plant Type"])):
+                raise ValueError(f"{new_plant['Scientific Name']} is not a tree, it cannot replace {previous_plant['Scientific Name']}.")
+            self.tree_info_list = [new_plant if plant is previous_plant else plant for plant in self.tree_info_list]
+
+            # Replace the species of every coordinate the previous tree was allocated to
+            radius = new_plant.get("Canopy Radius", "None")
+            radius = float(radius) if radius != "None" else 0
+            tree_radii_dict, tree_id_dict = dict(self.assigned_trees[0]), dict(self.assigned_trees[1])
+            for position, species_id in tree_id_dict.items():
+                if species_id == previous_species_id:
+                    tree_radii_dict[position] = radius
+                    tree_id_dict[position] = new_plant.get("Species ID")
+            if tree_radii_dict != self.assigned_trees[0]:
+                self.layer_cache = {}
+            self.assigned_trees = (tree_radii_dict, tree_id_dict)
+            return
+
+        if not self._contains_shrub(new_plant["Plant Type"]) or self._contains_palm(new_plant["Plant Type"]) or self._contains_tree(new_plant["Plant Type"]):
+            raise ValueError(f"{new_plant['Scientific Name']} is not a shrub, it cannot replace {previous_plant['Scientific Name']}.")
+        self.shrub_info_list = [new_plant if plant is previous_plant else plant for plant in self.shrub_info_list]
+
+        # Hatching index (seed number) of the previous shrub, 2 divides it for shade loving shrubs and 3 divides it for border shrubs
+        seed = next(seed for seed in self.seed_mapping if seed["Shrub Name"] == previous_plant["Scientific Name"])
+        previous_seed_number = seed["Seed Number"]
+        shade_loving = self._contains_semi_shade(new_plant["Light Preference"]) or self._contains_full_shade(new_plant["Light Preference"])
+        border = new_plant["Hazard"] == "-"
+        new_seed_number = previous_seed_number
+        if (previous_seed_number % 2 == 0) != shade_loving or (previous_seed_number % 3 == 0) != border:
+            new_seed_number = 3
+            while new_seed_number in self.shrub_int_list or (new_seed_number % 2 == 0) != shade_loving or (new_seed_number % 3 == 0) != border:
+                new_seed_number += 1
+
+        seed["Seed Number"], seed["Shrub Name"] = new_seed_number, new_plant["Scientific Name"]
+        self.shrub_int_list = [new_seed_number if seed_number == previous_seed_number else seed_number for seed_number in self.shrub_int_list]
+        if self.noise_grids is not None:
+            self.noise_grids[new_seed_number] = self.noise_grids.pop(previous_seed_number)
+
+    @record_latency("recompose")
+    def recompose(self, visualise=False, progress_callback=None):
+        """
+        Function to create the composition again after replace_species, reusing the noise grids of the last hatching
+        Only the heatmaps and the steps after the hatching assignment are computed again
+
+        Args:
+            visualise (bool, optional): Visualise the final planting area. Defaults to False.
+            progress_callback (callable, optional): Called with the stage name ("hatching", "mirroring", "serialization") when each stage starts. Defaults to None.
+
+        Returns:
+            output_json (dictionary): Data to be returned to the UI
+        """
+        if self.noise_grids is None:
+            raise ValueError("recompose requires a previous hatching, call hatch_allocate_plants first.")
+
+        # Start from the tree assignment before mirroring and the tie-breaks of the last hatching
+        self.tree_radii_dict, self.tree_id_dict = dict(self.assigned_trees[0]), dict(self.assigned_trees[1])
+        self.rng.bit_generator.state = self.assignment_rng_state
+
+        if progress_callback is not None:
+            progress_callback("hatching")
+        heatmaps = self._create_heatmaps(self.noise_grids)
+        hatching_grid = self._apply_influence_grids_with_border(heatmaps)
+
+        return self._allocate_and_format(hatching_grid, visualise, progress_callback)
     
     ## Initialiser functions
     def _assign_trees(self):
@@ -112,6 +257,7 @@ class plantHatchingAndAssignment():
         new_trees = self._allocate_trees_to_coordinates(trees_list)
         self.tree_radii_dict = {pos: data[1] for pos, data in new_trees.items()}
         self.tree_id_dict = {pos: data[2] for pos, data in new_trees.items()}    
+        self.assigned_trees = (self.tree_radii_dict, self.tree_id_dict)
 
     def _create_seed_labels(self):
             """
@@ -187,29 +333,35 @@ class plantHatchingAndAssignment():
             return seed_mapping, seeds_list
 
     ## High level functions used in hatch_allocate_plants
-    def _generate_hatching(self):
+    @record_latency("_generate_hatching")
+    def _generate_hatching(self, variant:bool=False):
         """
         Generate the raw hatching map before applying cleaning or post-processing steps.
 
         This function generates a raw heatmap that segments the grid 
         into different regions assigned to different plants based on their influence and logical suitability.
 
+        Args:
+            variant (bool, optional): Shuffle the starter slots and always draw new Worley noise. Defaults to False.
+
         Returns:
             np.ndarray: The output grid where each region is labeled with a unique integer representing a plant type.
         """
         # Choose starting shrub coordinates for segmentation
-        seed_to_int_dict = self._choose_starter_slots() 
+        seed_to_int_dict = self._choose_starter_slots(shuffle=variant) 
         # Randomly generate worley noise map
-        noise_map = self._generate_worley_heatmap()
+        noise_map = self._generate_worley_heatmap(rng=self.rng if variant else None)
         # Uses the noise map generated and the seed of each species to generate a random heatmap of each species' influence on the grid
         noise_grids = self._combined_noisemap(noise_map, seed_to_int_dict) 
+        self.noise_grids = noise_grids
+        self.assignment_rng_state = self.rng.bit_generator.state
         # Creates a heatmap for each species, combining both the random influence from the noise_grid as well as logical influence based on the suitability of each species for each region of the map
         heatmaps = self._create_heatmaps(noise_grids) 
         # Allocates the grid to each species based on the heatmaps generates above 
         output_grid = self._apply_influence_grids_with_border(heatmaps)
         return output_grid
     
-    def _allocate_plants(self, uncleaned_hatch_grid:np.ndarray):
+    def _allocate_plants(self, uncleaned_hatch_grid:np.ndarray, progress_callback=None):
         """
         Allocate plants to regions based on the hatching grid and theme, performing cleaning, adjustments, and optional mirroring.
 
@@ -218,6 +370,7 @@ class plantHatchingAndAssignment():
 
         Args:
             uncleaned_hatch_grid (np.ndarray): A numpy array representing the raw hatching grid with regions labeled for different plants.
+            progress_callback (callable, optional): Called with "mirroring" before the grid is mirrored. Defaults to None.
 
         Returns:
             tuple:
@@ -236,15 +389,20 @@ class plantHatchingAndAssignment():
         cleaned_grid = self._remove_empty_regions(cleaned_grid, shifted_seeds_dict)
 
         # For manicured theming, we mirror the hatching to provide a design
-        if self.theme.lower() == "manicured":
+        if self.mirror and self.theme.lower() == "manicured":
+            if progress_callback is not None:
+                progress_callback("mirroring")
             cleaned_grid, shifted_seeds_dict, mirrored_trees, mirrored_tree_id_dict, _ = self._mirror_grid(cleaned_grid, shifted_seeds_dict)
             self.tree_radii_dict = mirrored_trees
             self.tree_id_dict = mirrored_tree_id_dict
+            # Shade layers were computed from the trees before mirroring
+            self.layer_cache = {}
 
         seed_mapping = {seed["Seed Number"]: seed["Shrub Name"] for seed in self.seed_mapping}
 
         return cleaned_grid, shifted_seeds_dict, seed_mapping
 
+    @record_latency("_create_json")
     def _create_json(self, output_grid: np.ndarray, output_seed_dict: dict, seed_mapping: list):
         """
         Generate a JSON output by transforming the output grid and coordinates mapped to species IDs.
@@ -303,7 +461,7 @@ class plantHatchingAndAssignment():
             coordinates[str((y, x))] = species_id
 
         # Initialize the final grid with 0 (unplantable areas)
-        final_grid = np.zeros_like(output_grid)
+        final_grid = np.zeros_like(output_grid, dtype=LABEL_DTYPE)
 
         # Mark plantable areas (1): Convert all non-zero, non-tree, and non-shrub values to 1
         plantable_positions = np.argwhere(output_grid > 0)
@@ -340,6 +498,10 @@ class plantHatchingAndAssignment():
             seed_name_mapping (dict): Dictionary mapping seed numbers to shrub names.
             tree_radii (dict): Dictionary mapping (y, x) positions to radii.
         """
+        # Plotting is only used for debugging, import lazily to keep service startup fast
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as mpatches
+
         # Define a colormap for visualization
         unique_values = np.unique(grid)
         colors = plt.cm.Accent(np.linspace(0, 1, len(unique_values)))  # Use a colormap for distinct colors
@@ -486,7 +648,7 @@ class plantHatchingAndAssignment():
         # Assign each coordinate a tree species and radius
         for pos in tree_positions:
             # Randomly select a tree species
-            selected_tree = random.choice(self.tree_info_list)
+            selected_tree = self.tree_info_list[self.rng.integers(len(self.tree_info_list))]
             name = selected_tree["Scientific Name"]
             radius = selected_tree.get("Canopy Radius", "None")
             id = selected_tree.get("Species ID")
@@ -534,7 +696,7 @@ class plantHatchingAndAssignment():
 
         return result
 
-    def _choose_starter_slots(self, percentage_of_starters:float=0.8):
+    def _choose_starter_slots(self, percentage_of_starters:float=0.8, shuffle:bool=False):
         """
         Selects a percentage of shrub positions to be assigned as starter slots and groups them by starter types.
 
@@ -545,6 +707,7 @@ class plantHatchingAndAssignment():
         Args:
             percentage_of_starters (float): The fraction of shrub positions to allocate as starter slots. 
                                             Defaults to 0.8 (80%).
+            shuffle (bool): Shuffle the shrub positions with self.rng before selecting them, used for hatching variants. Defaults to False.
 
         Returns:
             dict: A dictionary where keys are seed numbers (starter types) from the `seed_mapping` and values 
@@ -556,6 +719,8 @@ class plantHatchingAndAssignment():
             - Shrub positions are selected sequentially from `starting_shrub_seed_list` and are not reused.
         """
         shrub_slots = copy.deepcopy(self.starting_shrub_seed_list)
+        if shuffle:
+            shrub_slots = [shrub_slots[i] for i in self.rng.permutation(len(shrub_slots))]
         
         # Use only the "Seed Number" from seed_mapping for seed_locations keys
         seed_locations = {t["Seed Number"]: [] for t in self.seed_mapping}
@@ -575,7 +740,7 @@ class plantHatchingAndAssignment():
 
         return seed_locations
 
-    def _generate_worley_heatmap(self, grid_size:tuple=(100, 100), value_range:tuple=(40, 50), feature_points:int=20, invert:bool=False): 
+    def _generate_worley_heatmap(self, grid_size:tuple=None, value_range:tuple=(40, 50), feature_points:int=20, invert:bool=False, rng:np.random.Generator=None): 
         """
         Generate a random heatmap using Worley noise.
 
@@ -584,11 +749,12 @@ class plantHatchingAndAssignment():
         and then scaled to the specified value range.
 
         Args:
-            grid_size (tuple): Dimensions of the heatmap (width, height). Defaults to (100, 100).
+            grid_size (tuple): Dimensions of the heatmap (width, height). Defaults to None (size of the starting grid).
             value_range (tuple): The range of values for the heatmap (min, max). Defaults to (40, 50).
             feature_points (int): Number of random feature points to generate within the grid. Defaults to 20.
             invert (bool): Whether to invert the values such that the centres of the feature points 
                            are high-value areas. Defaults to False.
+            rng (np.random.Generator): Generator for the feature points, overrides `self.randomized_seed`. Defaults to None.
 
         Returns:
             np.ndarray: A 2D array of shape `grid_size` representing the Worley noise heatmap.
@@ -601,14 +767,14 @@ class plantHatchingAndAssignment():
               deterministically for reproducibility.
         """
 
-        width, height = grid_size
+        width, height = grid_size if grid_size is not None else (self.grid_shape[1], self.grid_shape[0])
 
-        # Set random seed for reproducibility
-        if self.randomized_seed is not None:
-            random.seed(self.randomized_seed)
+        # Use a generator seeded with the fixed seed for reproducibility, without touching the global random state
+        if rng is None:
+            rng = np.random.default_rng(self.randomized_seed) if self.randomized_seed is not None else self.rng
 
         # Generate random feature points
-        feature_points = [(random.uniform(0, width), random.uniform(0, height)) for _ in range(feature_points)]
+        feature_points = [(rng.uniform(0, width), rng.uniform(0, height)) for _ in range(feature_points)]
 
         def closest_distance(x, y):
             # Compute the closest distance to a feature point
@@ -683,7 +849,7 @@ class plantHatchingAndAssignment():
         height, width = self.grid_shape
 
         # Initialize the influence grid with zeros
-        influence_grid = np.zeros((height, width), dtype=np.float32)
+        influence_grid = np.zeros((height, width), dtype=HEATMAP_DTYPE)
 
         # Iterate over each seed
         for y, x in seed_locations:
@@ -764,28 +930,45 @@ class plantHatchingAndAssignment():
                         and noise influences for the given seed type.
         """
         # We first clean the grid to remove the other values, leaving only 0 as unplantable and the fill_value (128) as plantable
-        plantable_grid = self._shade_inside_border()
+        plantable_grid = self._cached_layer("plantable", self._shade_inside_border)
 
         # We then create the shade_grid for the species, if the plants seed int is a multiple of 2, it likes the shade,
         # so we call the normal version of label_heatmap_based_on_trees, if not we invert the function
+        # Species with the same preferences share the same layers, so they are only computed once
         shade_grid = None
         if seed_value%2 == 0:
-            shade_grid = self._label_heatmap_based_on_trees(plantable_grid)
+            shade_grid = self._cached_layer("shade", self._label_heatmap_based_on_trees, plantable_grid)
         else:
-            shade_grid = self._label_heatmap_based_on_trees(plantable_grid, invert=True)
+            shade_grid = self._cached_layer("no_shade", self._label_heatmap_based_on_trees, plantable_grid, True)
 
         # We then create the border_grid for the species, if the plants seed int is a multiple of 3, it is a plant that has been deemed to be suitable to be near the border,
         # so we call calculate_border_proximity, if not we call calculate_distance_to_border
         border_grid = None
         if seed_value%3 ==0:
-            border_grid = self._calculate_border_proximity(plantable_grid)
+            border_grid = self._cached_layer("border", self._calculate_border_proximity, plantable_grid)
         else:
-            border_grid = self._calculate_distance_to_border(plantable_grid)
+            border_grid = self._cached_layer("no_border", self._calculate_distance_to_border, plantable_grid)
         # We then place the tree influence grids generated, the shade, border and noise grid into a list to be combined into a singular heatmap, before returning it
         influences = [shade_grid,border_grid, noise_grid]
         influence = self._combine_heatmaps(influences)
         return influence
 
+    def _cached_layer(self, name:str, function, *args):
+        """
+        Function to compute a layer once and reuse it for the following species and hatchings
+
+        Args:
+            name (str): layer name
+            function (callable): function computing the layer
+            *args: function arguments
+
+        Returns:
+            np.ndarray: the layer, it must not be modified
+        """
+        if name not in self.layer_cache:
+            self.layer_cache[name] = function(*args)
+        return self.layer_cache[name]
+
     def _shade_inside_border(self, fill_value:int=128):
         """
         Shade points inside the grid by filling non-zero regions with a specified fill color,
@@ -824,7 +1007,7 @@ class plantHatchingAndAssignment():
             np.ndarray: A new grid where desired squares are labeled as 100, others as 0.
         """
         # Initialize the new grid with zeros
-        labeled_grid = np.zeros_like(grid, dtype=np.float32)
+        labeled_grid = np.zeros_like(grid, dtype=HEATMAP_DTYPE)
 
         # Identify positions with a value of 128 in the grid
         target_positions = np.argwhere(grid == 128)
@@ -968,7 +1151,7 @@ class plantHatchingAndAssignment():
 
     def _combine_heatmaps(self, heatmaps:list[np.ndarray]):
         """
-        Combine multiple heatmaps into a single heatmap by summing them element-wise.
+        Combine multiple heatmaps into a single HEATMAP_DTYPE heatmap by summing them element-wise into one buffer.
 
         This function takes a list of 2D heatmaps and combines them by summing the corresponding 
         values across all heatmaps. It ensures that all heatmaps have the same shape before combining.
@@ -996,8 +1179,10 @@ class plantHatchingAndAssignment():
                 print(f"Heatmap at index {idx} has shape {h.shape}, expected {shape}")
                 raise ValueError("All heatmaps must have the same shape.")
         
-        # Sum the heatmaps element-wise
-        combined = sum(heatmaps)
+        # Sum the heatmaps element-wise, accumulating in place instead of allocating a new array for every addition
+        combined = np.array(heatmaps[0], dtype=HEATMAP_DTYPE)
+        for heatmap in heatmaps[1:]:
+            np.add(combined, heatmap, out=combined, casting="unsafe")
         
         return combined
 
@@ -1025,7 +1210,7 @@ class plantHatchingAndAssignment():
             ValueError: If the influence grids or starting grid are improperly formatted or mismatched.
         """
         # Identify workable spots using shade_inside_border
-        workable_grid = self._shade_inside_border()
+        workable_grid = self._cached_layer("plantable", self._shade_inside_border)
         
         # Flip grids vertically to address the issue
         flipped_influence_grids = {
@@ -1036,7 +1221,7 @@ class plantHatchingAndAssignment():
         grid_shape = workable_grid.shape
 
         # Initialize the assigned grid with zeros
-        assigned_grid = np.zeros(grid_shape, dtype=int)
+        assigned_grid = np.zeros(grid_shape, dtype=REGION_DTYPE)
 
         # Iterate through each cell in the grid
         for i in range(grid_shape[0]):
@@ -1054,7 +1239,7 @@ class plantHatchingAndAssignment():
                     # Decide based on the absolute threshold
                     if len(influences) > 1 and abs(influences[0][0] - influences[1][0]) <= self.threshold:
                         # Randomly select between the top two types
-                        assigned_type = random.choice([influences[0][1], influences[1][1]])
+                        assigned_type = (influences[0][1], influences[1][1])[self.rng.integers(2)]
                     else:
                         # Select the type with the highest influence
                         assigned_type = influences[0][1]
@@ -1067,6 +1252,7 @@ class plantHatchingAndAssignment():
 
         return assigned_grid
 
+    @record_latency("_fill_small_regions")
     def _fill_small_regions(self, grid:np.ndarray, min_size:int=50):
         """
         Replace small regions or regions missing required points in the grid with surrounding tile values.
@@ -1172,6 +1358,7 @@ class plantHatchingAndAssignment():
         sorted_seeds = dict(sorted(sorted_seeds.items()))
         return sorted_seeds
 
+    @record_latency("_jitter_coordinate")
     def _jitter_coordinate(self, input_grid:np.ndarray, seed_dict_x:dict, min_distance_from_boundary:int=5, spacing_distance:int=7, max_iterations:int=100):
         """
         Optimized version to shift seeds inward and ensure they are spaced out within regions.
@@ -1275,6 +1462,7 @@ class plantHatchingAndAssignment():
 
         return seed_dict_x
     
+    @record_latency("_remove_empty_regions")
     def _remove_empty_regions(self, input_grid:np.ndarray, seed_dict_x:dict, visualise:bool=False):
             """
             Remove empty regions from the grid by merging them into neighboring regions.
@@ -1320,6 +1508,8 @@ class plantHatchingAndAssignment():
                     current_label += 1
 
             if visualise == True:
+                import matplotlib.pyplot as plt
+
                 # Visualization after Step 1: Display labeled regions
                 plt.figure(figsize=(8, 8))
                 plt.imshow(labeled_grid, cmap="tab20", origin="upper")
@@ -1373,6 +1563,7 @@ class plantHatchingAndAssignment():
 
             return merged_grid
     
+    @record_latency("_mirror_grid")
     def _mirror_grid(self, grid: np.ndarray, shrubs_dict: dict):
         """
         Mirrors the grid and updates associated shrubs and tree positions based on an optimal split axis.
@@ -1643,6 +1834,8 @@ class plantHatchingAndAssignment():
         )
 
         if visualise:
+            import matplotlib.pyplot as plt
+
             # Debugging visuals
             print(f"Split Type: {split_type}")
             print(f"Plantable Diff (Raw): {plantable_diff}, Normalized: {normalized_plantable_diff:.4f}")
@@ -1,12 +1,18 @@
 # Imports
 import numpy as np
-import random
 import cv2
+import threading
 from perlin_noise import PerlinNoise
 from scipy.spatial.distance import cdist
 
+from src.utils.metrics import record_latency
+from src.utils.dtype_policy import LABEL_DTYPE
+
+# perlin_noise reseeds and restores the global random module for every gradient vector, so noise grids can only be built by one thread at a time
+PERLIN_LOCK = threading.Lock()
+
 class proceduralGeneratedEnv():
-    def __init__(self, octave:float, seed:int, grid_size:tuple, minimum_distance:int, padded_boundary:int):
+    def __init__(self, octave:float, seed:int, grid_size:tuple, minimum_distance:int, padded_boundary:int, rng:np.random.Generator=None, origin:tuple=(0, 0), site_size:tuple=None):
         """
         Class to randomly generate an environment using perlin noise and dithering
 
@@ -16,13 +22,30 @@ class proceduralGeneratedEnv():
             grid_size (tuple, optional): (w,h) of environment grid. Defaults to (100,100).
             minimum_distance (int): minimum distance between 2 planting coordinate
             padded_boundary (int): padded distance around the corners that will have no planting coordinate
+            rng (np.random.Generator, optional): generator used to pick the perlin seed when seed is None. Defaults to None (new unseeded generator).
+            origin (tuple, optional): (y,x) of the grid within a larger site, for tiles of a large site. Defaults to (0, 0).
+            site_size (tuple, optional): (w,h) of the site the grid is a tile of, only the site edges are padded. Defaults to None (the grid is the whole site).
         """
         self.octave = octave
         self.seed = seed
         self.grid_size = grid_size
         self.minimum_distance = minimum_distance
         self.padded_boundary = padded_boundary
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.origin = origin
+        self.site_size = site_size if site_size is not None else grid_size
 
+        # Padded sides (top, bottom, left, right), tiles are only padded on the edges of the site
+        site_width, site_height = self.site_size
+        width, height = self.grid_size
+        self.padded_sides = (
+            origin[0] == 0,
+            origin[0] + height >= site_height,
+            origin[1] == 0,
+            origin[1] + width >= site_width
+        )
+
+    @record_latency("proceduralGeneratedEnv.create_environment")
     def create_environment(self):
         """
         Function to create an environment
@@ -37,16 +60,23 @@ class proceduralGeneratedEnv():
             planting_coord (np.ndarray): (1, num_planting_coord) numpy array of all planting coordinates in (y,x) 
         """ 
         while True:
-            noise = PerlinNoise(octaves=self.octave, seed= self.seed if self.seed is not None else random.randint(0,50))
+            noise = PerlinNoise(octaves=self.octave, seed= self.seed if self.seed is not None else int(self.rng.integers(1, 51)))
             width, height = self.grid_size
 
-            # Create environment and dither 
-            perlin_env = np.array([[noise([i/height, j/width]) for j in range(width)] for i in range(height)])
+            # Create environment and dither, tiles sample the noise at their position in the site so neighbouring tiles agree on their overlap
+            origin_y, origin_x = self.origin
+            with PERLIN_LOCK:
+                perlin_env = np.array([[noise([(i + origin_y)/height, (j + origin_x)/width]) for j in range(width)] for i in range(height)])
             # Adding boundary to ensure that the values are 1 for the boundary removal
-            perlin_env[:self.padded_boundary, :] = 1 # Top boundary
-            perlin_env[-self.padded_boundary:, :] = 1 # Bottom boundary
-            perlin_env[:, :self.padded_boundary] = 1 # Left boundary
-            perlin_env[:, -self.padded_boundary:] = 1 # Right boundary
+            pad_top, pad_bottom, pad_left, pad_right = self.padded_sides
+            if pad_top:
+                perlin_env[:self.padded_boundary, :] = 1 # Top boundary
+            if pad_bottom:
+                perlin_env[-self.padded_boundary:, :] = 1 # Bottom boundary
+            if pad_left:
+                perlin_env[:, :self.padded_boundary] = 1 # Left boundary
+            if pad_right:
+                perlin_env[:, -self.padded_boundary:] = 1 # Right boundary
 
             # Dither environment
             dithered_perlin_env = self._dither_environment(perlin_env)
@@ -61,7 +91,7 @@ class proceduralGeneratedEnv():
         boundary_grid, filled_boundary_grid = self._extract_boundary(perlin_env)
         planting_grid, planting_coords  = self._filter_planting_coords(planting_positions)
 
-        return boundary_grid.astype(np.int64), filled_boundary_grid.astype(np.int64), planting_grid.astype(np.int64), planting_coords
+        return boundary_grid, filled_boundary_grid, planting_grid, planting_coords
     
     def _dither_environment(self, perlin_env:np.ndarray):
         """
@@ -83,21 +113,24 @@ class proceduralGeneratedEnv():
 
         # Dither with Bayer Matrix
         bayer_tile_size = bayer_matrix.shape[0]  # Size of the Bayer matrix (4x4)
-        dithered_grid = np.zeros_like(perlin_env)
+        dithered_grid = np.zeros(perlin_env.shape, dtype=LABEL_DTYPE)
         width, height = self.grid_size
+        pad_top, pad_bottom, pad_left, pad_right = self.padded_sides
+        origin_y, origin_x = self.origin
 
         # Apply Bayer matrix
         for y in range(height):
             for x in range(width):
                 # Ensure that padded boundary is actually 0 instead of 1
-                if y <= self.padded_boundary or y >= height - self.padded_boundary:
+                if (pad_top and y <= self.padded_boundary) or (pad_bottom and y >= height - self.padded_boundary):
                     dithered_grid[y, x] = 0
                 
-                elif x <= self.padded_boundary or x >= width - self.padded_boundary:
+                elif (pad_left and x <= self.padded_boundary) or (pad_right and x >= width - self.padded_boundary):
                     dithered_grid[y, x] = 0
 
                 else:
-                    bayer_value = bayer_matrix[y % bayer_tile_size, x % bayer_tile_size]
+                    # Bayer matrix is aligned to the site so tiles dither their overlap identically
+                    bayer_value = bayer_matrix[(y + origin_y) % bayer_tile_size, (x + origin_x) % bayer_tile_size]
                     dithered_grid[y, x] = 1 if perlin_env[y, x] > bayer_value else 0
             
         return dithered_grid
@@ -127,8 +160,8 @@ class proceduralGeneratedEnv():
         # Find contours on flood filled image for outline
         contours, _ = cv2.findContours(dilate_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
                 
-        boundary_grid = np.zeros(self.grid_size)
-        filled_boundary_grid = np.zeros(self.grid_size)
+        boundary_grid = np.zeros(self.grid_size, dtype=LABEL_DTYPE)
+        filled_boundary_grid = np.zeros(self.grid_size, dtype=LABEL_DTYPE)
 
         # Draw contours
         cv2.drawContours(boundary_grid, contours, -1, (1), thickness=1)
@@ -148,29 +181,20 @@ class proceduralGeneratedEnv():
             final_grid (np.ndarray): self.grid_size grid of 0 for unplantable and 1 for plantable
             final_planting_coordinates (np.ndarray): (1, num_planting_coord) numpy array        
         """
-        filtered_planting_positions = planting_positions.copy()
-        
-        # Calculate elucidean distance between coordinates
-        distances = cdist(filtered_planting_positions, filtered_planting_positions)
-
-        # Keep a numpy array of all filtered position and assume is true
-        # numpy mask
-        keep_array = np.ones(len(filtered_planting_positions), dtype=bool)
-
-        # Check for points that are too close
-        for i in range(len(filtered_planting_positions)):
-            # Only consider points that haven't been removed
-            if keep_array[i]:  
-                for j in range(i + 1, len(filtered_planting_positions)):
-                    if distances[i, j] < self.minimum_distance:
-                        # Remove the second point if it's too close
-                        keep_array[j] = False
+        # Greedy filter in order, a position is kept if no kept position is closer than self.minimum_distance
+        # Only distances to the kept positions are computed instead of the full pairwise distance matrix
+        keep_array = np.zeros(len(planting_positions), dtype=bool)
+        kept_positions = np.empty((0, 2))
+        for i, position in enumerate(planting_positions):
+            if len(kept_positions) == 0 or cdist(position[None], kept_positions).min() >= self.minimum_distance:
+                keep_array[i] = True
+                kept_positions = np.vstack((kept_positions, position))
 
         # Apply mask to remove coordinates that are too close
-        final_planting_coordinates = filtered_planting_positions[keep_array]
+        final_planting_coordinates = planting_positions[keep_array]
         
         # Final grid (All 0s)
-        final_grid = np.zeros(self.grid_size)
+        final_grid = np.zeros(self.grid_size, dtype=LABEL_DTYPE)
         
         # Update grid with planting position
         for coordinates in final_planting_coordinates:
@@ -0,0 +1,51 @@
+# Helpers for recomposing a composition after a palette species is replaced
+# Kept free of the pipeline dependencies so the API process can relabel compositions without a worker
+import re
+
+def hatching_category(plant:dict):
+    """
+    Function to retrieve the hatching category of a plant, plants of the same category are interchangeable in a composition
+    Follows plantHatchingAndAssignment: trees (and palms) are categorised by canopy radius as it sets their shade,
+    shrubs by border suitability (no hazard) and shade preference as they decide the hatching index
+
+    Args:
+        plant (dict): plant from the UI plant palette
+
+    Returns:
+        category (tuple | None): ("Tree", canopy radius) or ("Shrub", border, shade loving), None for other plant types
+    """
+    plant_type = ", ".join(plant.get("Plant Type", [])) if isinstance(plant.get("Plant Type"), list) else str(plant.get("Plant Type"))
+    if re.search(r'\bPalm\b', plant_type, re.IGNORECASE) or re.search(r'\bTree\b', plant_type, re.IGNORECASE):
+        radius = plant.get("Canopy Radius", "None")
+        return ("Tree", float(radius) if radius != "None" else 0)
+
+    if re.search(r'\bShrub\b', plant_type, re.IGNORECASE):
+        light_preference = ", ".join(plant.get("Light Preference", [])) if isinstance(plant.get("Light Preference"), list) else str(plant.get("Light Preference"))
+        shade_loving = bool(re.search(r'\bSemi Shade\b', light_preference, re.IGNORECASE) or re.search(r'\bFull Shade\b', light_preference, re.IGNORECASE))
+        return ("Shrub", plant.get("Hazard") == "-", shade_loving)
+
+    return None
+
+
+def relabel_composition(composition:dict, previous_species_id:int, new_species_id:int):
+    """
+    Function to replace a species in a composition without generating it again, used when the replacement has the same hatching category
+
+    Args:
+        composition (dict): composition from /generate_composition
+        previous_species_id (int): Species ID to replace
+        new_species_id (int): Species ID of the replacement
+
+    Returns:
+        relabeled_composition (dict): copy of the composition with the coordinates of the previous species assigned to the replacement
+    """
+    relabeled_composition = dict(composition)
+    relabeled_composition["coordinates"] = {
+        coordinate: new_species_id if species_id == previous_species_id else species_id
+        for coordinate, species_id in composition["coordinates"].items()
+    }
+    return relabeled_composition
+
+
+if __name__ == "__main__":
+    pass
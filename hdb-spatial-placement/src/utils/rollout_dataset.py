@@ -0,0 +1,132 @@
+# Chunked memory-mapped dataset of plantTypeAllocationEnv rollouts
+# Only depends on numpy, so recorded rollouts can be read without loading a model
+import os
+import json
+
+import numpy as np
+
+# Fields of every recorded step: (dtype, shape after the step dimension), observations take the observation shape
+ROLLOUT_FIELDS = {
+    "actions": ("int16", (2,)),
+    "rewards": ("float32", ()),
+    "dones": ("bool", ()),
+    "episodes": ("int32", ()),
+    "behaviour_probabilities": ("float32", ()),
+}
+
+class rolloutDatasetWriter():
+    def __init__(self, path:str, observation_shape:tuple, chunk_size:int=4096, metadata:dict=None):
+        """
+        Writer of (observation, action, reward, done) steps into chunks of memory-mapped .npy files
+        Every chunk holds chunk_size steps, so recording never holds more than the open chunk in memory and
+        a dataset can be read one chunk at a time without loading it
+
+        Args:
+            path (str): dataset folder, created if it does not exist
+            observation_shape (tuple): shape of one observation
+            chunk_size (int, optional): number of steps of every chunk. Defaults to 4096.
+            metadata (dict, optional): information saved with the dataset (eg. behaviour policy and seeds). Defaults to None.
+        """
+        self.path = path
+        self.observation_shape = tuple(observation_shape)
+        self.chunk_size = chunk_size
+        self.metadata = metadata or {}
+        # Number of steps of every closed chunk
+        self.chunk_lengths = []
+        self.chunk = None
+        self.position = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _open_chunk(self):
+        """
+        Function to preallocate the memory-mapped arrays of a new chunk
+        """
+        chunk_path = os.path.join(self.path, f"chunk_{len(self.chunk_lengths):05d}")
+        os.makedirs(chunk_path, exist_ok=True)
+        self.chunk = {"observations": np.lib.format.open_memmap(os.path.join(chunk_path, "observations.npy"), mode="w+", dtype=np.float32, shape=(self.chunk_size, *self.observation_shape))}
+        for field, (dtype, shape) in ROLLOUT_FIELDS.items():
+            self.chunk[field] = np.lib.format.open_memmap(os.path.join(chunk_path, f"{field}.npy"), mode="w+", dtype=dtype, shape=(self.chunk_size, *shape))
+        self.position = 0
+
+    def _close_chunk(self):
+        """
+        Function to flush the open chunk to disk
+        """
+        for array in self.chunk.values():
+            array.flush()
+        self.chunk_lengths.append(self.position)
+        self.chunk = None
+
+    def append(self, observation:np.ndarray, action:np.ndarray, reward:float, done:bool, episode:int, behaviour_probability:float=1.0):
+        """
+        Function to record one step
+
+        Args:
+            observation (np.ndarray): observation the action was taken on
+            action (np.ndarray): (spot, class) action
+            reward (float): reward of the action
+            done (bool): True if the episode ended with the action
+            episode (int): episode id of the step
+            behaviour_probability (float, optional): probability of the action under the recording policy, used for importance sampling. Defaults to 1.0.
+        """
+        if self.chunk is None:
+            self._open_chunk()
+        index = self.position
+        self.chunk["observations"][index] = observation
+        self.chunk["actions"][index] = action
+        self.chunk["rewards"][index] = reward
+        self.chunk["dones"][index] = done
+        self.chunk["episodes"][index] = episode
+        self.chunk["behaviour_probabilities"][index] = behaviour_probability
+        self.position += 1
+        if self.position == self.chunk_size:
+            self._close_chunk()
+
+    def close(self):
+        """
+        Function to flush the last chunk and save the dataset metadata
+        """
+        if self.chunk is not None:
+            self._close_chunk()
+        with open(os.path.join(self.path, "metadata.json"), 'w') as file:
+            json.dump({
+                "observation_shape": list(self.observation_shape),
+                "chunk_size": self.chunk_size,
+                "chunk_lengths": self.chunk_lengths,
+                "steps": int(sum(self.chunk_lengths)),
+                **self.metadata,
+            }, file, indent=4)
+
+
+class rolloutDataset():
+    def __init__(self, path:str):
+        """
+        Reader of a dataset saved by rolloutDatasetWriter, chunks are memory-mapped read only
+
+        Args:
+            path (str): dataset folder
+        """
+        self.path = path
+        with open(os.path.join(path, "metadata.json"), 'r') as file:
+            self.metadata = json.load(file)
+
+    def __len__(self):
+        return self.metadata["steps"]
+
+    def chunks(self):
+        """
+        Function to iterate over the chunks of the dataset
+
+        Yields:
+            chunk (dict): memory-mapped observations, actions, rewards, dones, episodes and behaviour_probabilities of the recorded steps of a chunk
+        """
+        for index, length in enumerate(self.metadata["chunk_lengths"]):
+            chunk_path = os.path.join(self.path, f"chunk_{index:05d}")
+            yield {
+                field: np.load(os.path.join(chunk_path, f"{field}.npy"), mmap_mode="r")[:length]
+                for field in ("observations", *ROLLOUT_FIELDS)
+            }
+
+
+if __name__ == "__main__":
+    pass
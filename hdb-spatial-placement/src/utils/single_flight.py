@@ -0,0 +1,54 @@
+# Single-flight coalescing of identical in-flight requests
+import asyncio
+
+from src.utils.metrics import metrics_registry
+
+class singleFlight():
+    def __init__(self):
+        """
+        Runs at most one computation per key at a time, requests made with the key of a running computation wait for it and share its result
+        Keys are only held while their computation runs, finished results are left to the composition cache
+        """
+        # key: asyncio task of the running computation
+        self.in_flight = {}
+
+        # Statistics
+        self.coalesced = 0
+
+    async def run(self, key:str, function, *args, **labels):
+        """
+        Function to run a coroutine function once for every concurrent set of requests with the same key
+
+        Args:
+            key (str): canonical request key (eg. composition_key)
+            function (callable): coroutine function computing the result
+            *args: function arguments
+            **labels: labels of the coalesced requests counter (eg. endpoint)
+
+        Returns:
+            result: return value of the function, shared by every coalesced request
+        """
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            metrics_registry.increment("spatial_coalesced_requests_total", **labels)
+        else:
+            task = asyncio.ensure_future(function(*args))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shielded so a request that goes away does not cancel the computation the other requests wait on
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """
+        Returns:
+            stats (dict): number of running computations and of coalesced requests
+        """
+        return {
+            "in_flight": len(self.in_flight),
+            "coalesced": self.coalesced
+        }
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,173 @@
+# Helpers to split a large site into overlapping tiles and stitch the tiles back together
+# Only depends on numpy so the API process can reconcile and stitch tiles without a worker
+import numpy as np
+
+from src.utils.dtype_policy import LABEL_DTYPE
+
+# Tile size is fixed by the observation size of the RL policy (maximum planting spots of a 100x100 grid)
+SITE_TILE_SIZE = 100
+
+def _axis_tiles(length:int, tile_size:int, overlap:int):
+    """
+    Function to split one axis of the site into overlapping tiles
+
+    Args:
+        length (int): length of the site along the axis
+        tile_size (int): length of a tile
+        overlap (int): number of cells shared by neighbouring tiles
+
+    Returns:
+        axis_tiles (list): (tile start, core start, core end) of every tile, cores split the overlaps in half and cover the axis exactly once
+    """
+    stride = max(tile_size - overlap, 1)
+    starts = list(range(0, max(length - tile_size, 0) + 1, stride))
+    # Last tile is aligned to the end of the site
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+
+    axis_tiles = []
+    for index, start in enumerate(starts):
+        core_start = 0 if index == 0 else (start + starts[index - 1] + tile_size) // 2
+        core_end = length if index == len(starts) - 1 else (starts[index + 1] + start + tile_size) // 2
+        axis_tiles.append((start, core_start, core_end))
+    return axis_tiles
+
+
+def site_tiles(site_size:tuple, tile_size:int=SITE_TILE_SIZE, overlap:int=20):
+    """
+    Function to split a site into overlapping tiles
+    Each tile owns its core, the cells closer to it than to its neighbours, so every cell of the site is owned by exactly one tile
+
+    Args:
+        site_size (tuple): (w,h) of the site, both at least tile_size
+        tile_size (int, optional): (w,h) of a tile. Defaults to SITE_TILE_SIZE.
+        overlap (int, optional): number of cells shared by neighbouring tiles. Defaults to 20.
+
+    Returns:
+        tiles (list): {"origin": (y,x), "core": (y start, y end, x start, x end)} of every tile in row-major order, in site coordinates
+    """
+    width, height = site_size
+    return [
+        {"origin": (y_start, x_start), "core": (core_y_start, core_y_end, core_x_start, core_x_end)}
+        for y_start, core_y_start, core_y_end in _axis_tiles(height, tile_size, overlap)
+        for x_start, core_x_start, core_x_end in _axis_tiles(width, tile_size, overlap)
+    ]
+
+
+def _in_core(tile:dict, y:int, x:int):
+    """
+    Function to check if a site coordinate is owned by the tile
+    """
+    y_start, y_end, x_start, x_end = tile["core"]
+    return y_start <= y < y_end and x_start <= x < x_end
+
+
+def reconcile_site_layouts(tiles:list, layouts:list, minimum_distance:int=10, tree_distance:int=50):
+    """
+    Function to merge the RL layouts of every tile into one site layout, reconciling the tree and planting spacing across tile seams
+    Every tile only keeps the coordinates in its core, coordinates of neighbouring tiles can still be too close across the seam:
+    trees closer than tree_distance to a kept tree become shrubs and coordinates closer than minimum_distance to a kept coordinate are dropped
+
+    Args:
+        tiles (list): tiles from site_tiles
+        layouts (list): (planting_grid, coordinates) RL layout of every tile, with Tree in (y,x) and Shrubs in (x,y) tile coordinates
+        minimum_distance (int, optional): minimum distance between 2 planting coordinates. Defaults to 10.
+        tree_distance (int, optional): minimum distance between 2 trees. Defaults to 50.
+
+    Returns:
+        site_coordinates (dict): {Tree: [], Shrubs: []} site coordinates in (y,x)
+        adjustments (dict): number of dropped coordinates and demoted trees
+    """
+    trees, shrubs = [], []
+    for tile, (_, coordinates) in zip(tiles, layouts):
+        origin_y, origin_x = tile["origin"]
+        trees.extend((int(y) + origin_y, int(x) + origin_x) for y, x in coordinates["Tree"] if _in_core(tile, int(y) + origin_y, int(x) + origin_x))
+        shrubs.extend((int(y) + origin_y, int(x) + origin_x) for x, y in coordinates["Shrubs"] if _in_core(tile, int(y) + origin_y, int(x) + origin_x))
+
+    # Kept coordinates bucketed by tree_distance cells, conflicts can only be in the neighbouring buckets
+    buckets = {}
+    def nearby(y, x):
+        bucket_y, bucket_x = y // tree_distance, x // tree_distance
+        for neighbour_y in (bucket_y - 1, bucket_y, bucket_y + 1):
+            for neighbour_x in (bucket_x - 1, bucket_x, bucket_x + 1):
+                yield from buckets.get((neighbour_y, neighbour_x), [])
+
+    site_coordinates = {"Tree": [], "Shrubs": []}
+    adjustments = {"dropped_coordinates": 0, "demoted_trees": 0}
+    # Trees are placed first as they have the stricter spacing
+    for plant_type, (y, x) in [("Tree", coordinate) for coordinate in trees] + [("Shrubs", coordinate) for coordinate in shrubs]:
+        distances = [(np.hypot(y - kept_y, x - kept_x), kept_type) for kept_y, kept_x, kept_type in nearby(y, x)]
+        if any(distance < minimum_distance for distance, _ in distances):
+            adjustments["dropped_coordinates"] += 1
+            continue
+        if plant_type == "Tree" and any(distance < tree_distance for distance, kept_type in distances if kept_type == "Tree"):
+            plant_type = "Shrubs"
+            adjustments["demoted_trees"] += 1
+        site_coordinates[plant_type].append((y, x))
+        buckets.setdefault((y // tree_distance, x // tree_distance), []).append((y, x, plant_type))
+
+    return site_coordinates, adjustments
+
+
+def tile_layouts(tiles:list, layouts:list, site_coordinates:dict, tile_size:int=SITE_TILE_SIZE):
+    """
+    Function to rebuild the layout of every tile from the reconciled site coordinates
+    Tiles also receive the coordinates of their neighbours in their overlap, so shade and spacing are consistent across the seams
+
+    Args:
+        tiles (list): tiles from site_tiles
+        layouts (list): (planting_grid, coordinates) RL layout of every tile
+        site_coordinates (dict): {Tree: [], Shrubs: []} site coordinates in (y,x) from reconcile_site_layouts
+        tile_size (int, optional): (w,h) of a tile. Defaults to SITE_TILE_SIZE.
+
+    Returns:
+        layouts (list): (planting_grid, coordinates) of every tile in the generate_layout format, Tree in (y,x) and Shrubs in (x,y)
+    """
+    reconciled_layouts = []
+    for tile, (planting_grid, _) in zip(tiles, layouts):
+        origin_y, origin_x = tile["origin"]
+        tile_grid = np.where(planting_grid >= 2, 1, planting_grid)
+        tile_coordinates = {"Tree": [], "Shrubs": []}
+        for plant_type, grid_value in (("Tree", 2), ("Shrubs", 3)):
+            for y, x in site_coordinates[plant_type]:
+                tile_y, tile_x = y - origin_y, x - origin_x
+                if 0 <= tile_y < tile_size and 0 <= tile_x < tile_size:
+                    tile_grid[tile_y, tile_x] = grid_value
+                    tile_coordinates[plant_type].append((tile_y, tile_x) if plant_type == "Tree" else (tile_x, tile_y))
+        reconciled_layouts.append((tile_grid, tile_coordinates))
+    return reconciled_layouts
+
+
+def stitch_site_composition(site_size:tuple, tiles:list, layouts:list, compositions:list):
+    """
+    Function to stitch the hatched tiles into one site composition, every tile contributes its core
+
+    Args:
+        site_size (tuple): (w,h) of the site
+        tiles (list): tiles from site_tiles
+        layouts (list): (planting_grid, coordinates) layout of every tile from tile_layouts
+        compositions (list): hatched composition of every tile, None for tiles without planting coordinates (the layout grid is used)
+
+    Returns:
+        site_composition (dict): {"grid": site grid, "coordinates": {"(y, x)": Species ID}} in site coordinates
+    """
+    width, height = site_size
+    site_grid = np.zeros((height, width), dtype=LABEL_DTYPE)
+    site_species = {}
+    for tile, (planting_grid, _), composition in zip(tiles, layouts, compositions):
+        origin_y, origin_x = tile["origin"]
+        y_start, y_end, x_start, x_end = tile["core"]
+        tile_grid = planting_grid if composition is None else np.array(composition["grid"])
+        site_grid[y_start:y_end, x_start:x_end] = tile_grid[y_start - origin_y:y_end - origin_y, x_start - origin_x:x_end - origin_x]
+        if composition is None:
+            continue
+        for coordinate, species_id in composition["coordinates"].items():
+            tile_y, tile_x = (int(value) for value in coordinate.strip("()").split(","))
+            if _in_core(tile, tile_y + origin_y, tile_x + origin_x):
+                site_species[str((tile_y + origin_y, tile_x + origin_x))] = species_id
+
+    return {"grid": site_grid.tolist(), "coordinates": site_species}
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,184 @@
+# SQLite backed results table of the hyperparameter sweeps
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+class sweepStore():
+    def __init__(self, db_path:str):
+        """
+        Results table shared by the sweep runner and its trial processes
+        Every trial records its periodic evaluations, so running trials can be compared with each other for early stopping
+
+        Trial status: queued -> running -> completed / pruned / failed
+
+        Args:
+            db_path (str): path to the SQLite file, created if it does not exist
+        """
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS trials (
+                    sweep TEXT NOT NULL,
+                    trial_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    cpu INTEGER,
+                    timesteps INTEGER,
+                    best_mean_reward REAL,
+                    final_mean_reward REAL,
+                    seconds REAL,
+                    model_path TEXT,
+                    error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (sweep, trial_id)
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS evaluations (
+                    sweep TEXT NOT NULL,
+                    trial_id INTEGER NOT NULL,
+                    evaluation INTEGER NOT NULL,
+                    timesteps INTEGER NOT NULL,
+                    mean_reward REAL NOT NULL,
+                    PRIMARY KEY (sweep, trial_id, evaluation)
+                )
+            """)
+
+    def create_trials(self, sweep:str, trials:list):
+        """
+        Function to queue the trials of a sweep, trials already in the table are kept so an interrupted sweep can be run again
+
+        Args:
+            sweep (str): sweep name
+            trials (list): hyperparameters of every trial, the trial id is the index
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO trials (sweep, trial_id, status, params, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                [(sweep, trial_id, json.dumps(params, sort_keys=True), now) for trial_id, params in enumerate(trials)]
+            )
+
+    def pending_trials(self, sweep:str):
+        """
+        Function to list the trials that still have to run, trials that were running when the sweep stopped are run again
+
+        Returns:
+            trials (list): (trial_id, hyperparameters) of the queued, running and failed trials
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT trial_id, params FROM trials WHERE sweep = ? AND status IN ('queued', 'running', 'failed') ORDER BY trial_id",
+                (sweep,)
+            ).fetchall()
+        return [(trial_id, json.loads(params)) for trial_id, params in rows]
+
+    def start_trial(self, sweep:str, trial_id:int, cpu:int=None):
+        """
+        Function to mark a trial as running, previous evaluations of the trial are removed
+        """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM evaluations WHERE sweep = ? AND trial_id = ?", (sweep, trial_id))
+            connection.execute(
+                "UPDATE trials SET status = 'running', cpu = ?, error = NULL, updated_at = ? WHERE sweep = ? AND trial_id = ?",
+                (cpu, time.time(), sweep, trial_id)
+            )
+
+    def record_evaluation(self, sweep:str, trial_id:int, evaluation:int, timesteps:int, mean_reward:float):
+        """
+        Function to record a periodic evaluation of a trial
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO evaluations (sweep, trial_id, evaluation, timesteps, mean_reward) VALUES (?, ?, ?, ?, ?)",
+                (sweep, trial_id, evaluation, timesteps, mean_reward)
+            )
+
+    def should_prune(self, sweep:str, trial_id:int, evaluation:int, min_trials:int=3, warmup_evaluations:int=2):
+        """
+        Function to apply the median stopping rule: a trial is stopped when its best mean reward up to an evaluation
+        is below the median of the best mean rewards of the other trials up to the same evaluation
+
+        Args:
+            sweep (str): sweep name
+            trial_id (int): trial to check
+            evaluation (int): index of the latest evaluation of the trial
+            min_trials (int, optional): minimum number of other trials that reached the evaluation before any trial is stopped. Defaults to 3.
+            warmup_evaluations (int, optional): number of evaluations before a trial can be stopped. Defaults to 2.
+
+        Returns:
+            prune (bool): True if the trial should be stopped
+        """
+        if evaluation + 1 < warmup_evaluations:
+            return False
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT trial_id, MAX(mean_reward), MAX(evaluation) FROM evaluations WHERE sweep = ? AND evaluation <= ? GROUP BY trial_id",
+                (sweep, evaluation)
+            ).fetchall()
+        best_rewards = {row_trial: best for row_trial, best, reached in rows if reached == evaluation}
+        if trial_id not in best_rewards:
+            return False
+        others = [best for row_trial, best in best_rewards.items() if row_trial != trial_id]
+        return len(others) >= min_trials and best_rewards[trial_id] < float(np.median(others))
+
+    def finish_trial(self, sweep:str, trial_id:int, status:str, timesteps:int=None, best_mean_reward:float=None, final_mean_reward:float=None, seconds:float=None, model_path:str=None, error:str=None):
+        """
+        Function to store the outcome of a trial
+
+        Args:
+            status (str): completed, pruned or failed
+        """
+        with self._connect() as connection:
+            connection.execute(
+                """UPDATE trials SET status = ?, timesteps = ?, best_mean_reward = ?, final_mean_reward = ?, seconds = ?, model_path = ?, error = ?, updated_at = ?
+                WHERE sweep = ? AND trial_id = ?""",
+                (status, timesteps, best_mean_reward, final_mean_reward, seconds, model_path, error, time.time(), sweep, trial_id)
+            )
+
+    def results(self, sweep:str):
+        """
+        Function to retrieve the trials of a sweep, the best trials first
+
+        Returns:
+            trials (list): every trial with its hyperparameters, status, rewards and evaluations
+        """
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            trials = [dict(row) for row in connection.execute("SELECT * FROM trials WHERE sweep = ?", (sweep,))]
+            evaluations = connection.execute(
+                "SELECT trial_id, timesteps, mean_reward FROM evaluations WHERE sweep = ? ORDER BY trial_id, evaluation", (sweep,)
+            ).fetchall()
+
+        for trial in trials:
+            trial["params"] = json.loads(trial["params"])
+            trial["evaluations"] = [(row["timesteps"], row["mean_reward"]) for row in evaluations if row["trial_id"] == trial["trial_id"]]
+        return sorted(trials, key=lambda trial: -np.inf if trial["best_mean_reward"] is None else trial["best_mean_reward"], reverse=True)
+
+    @contextmanager
+    def _connect(self):
+        """
+        Function to open a connection, a new connection is used for every operation so the store can be used from any process
+        The transaction is committed when the block exits without errors
+
+        Yields:
+            connection (sqlite3.Connection): SQLite connection
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,137 @@
+# Training callback splitting the wall time of every policy update between the environments and the learner
+import os
+import json
+import time
+from functools import wraps
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+# Timed sections of every update
+PROFILE_SECTIONS = ("rollout", "env_step", "env_reset", "optimization")
+
+class trainingProfilerCallback(BaseCallback):
+    def __init__(self, summary_name:str="profile_summary.json", verbose:int=0):
+        """
+        Opt-in callback recording the wall time of every policy update:
+        rollout collection, environment step and reset (including procedural generation) during the rollout, and policy optimization.
+        Times are logged under profile/ to the tensorboard log directory of the model, and a summary is saved there when training ends
+
+        Args:
+            summary_name (str, optional): name of the summary JSON file saved in the log directory. Defaults to "profile_summary.json".
+            verbose (int, optional): 1 to print the summary. Defaults to 0.
+        """
+        super().__init__(verbose)
+        self.summary_name = summary_name
+        # Seconds of every section of every update
+        self.updates = []
+        self.current = dict.fromkeys(PROFILE_SECTIONS, 0.0)
+        self.counts = {"env_step": 0, "env_reset": 0}
+        self.rollout_start = None
+        self.optimization_start = None
+        self.patched_envs = []
+
+    def _timed(self, function, section:str):
+        """
+        Function to wrap an environment method so its wall time is added to the current update
+
+        Args:
+            function (callable): bound environment method
+            section (str): section the time is added to
+
+        Returns:
+            timed_function (callable): wrapped method
+        """
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.current[section] += time.perf_counter() - start
+                self.counts[section] += 1
+        return timed_function
+
+    def _on_training_start(self):
+        # DummyVecEnv steps and resets its environments in process, so their methods are timed directly
+        # Other vectorised environments only expose the combined step (including automatic resets)
+        envs = getattr(self.training_env, "envs", None)
+        if envs is None:
+            envs = [self.training_env]
+        for env in envs:
+            env.step = self._timed(env.step, "env_step")
+            if env is not self.training_env:
+                env.reset = self._timed(env.reset, "env_reset")
+            self.patched_envs.append(env)
+
+    def _finish_optimization(self):
+        """
+        Function to close the optimization of the previous update and store the update
+        """
+        if self.optimization_start is None:
+            return
+        self.current["optimization"] = time.perf_counter() - self.optimization_start
+        self.optimization_start = None
+        self.updates.append(dict(self.current))
+        self.logger.record("profile/optimization_seconds", self.current["optimization"])
+        self.current = dict.fromkeys(PROFILE_SECTIONS, 0.0)
+
+    def _on_rollout_start(self):
+        # The optimization time of an update is logged with the next update as SB3 dumps the logs before optimizing
+        self._finish_optimization()
+        self.rollout_start = time.perf_counter()
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        # Policy optimization runs between the end of this rollout and the start of the next one
+        self.current["rollout"] = time.perf_counter() - self.rollout_start
+        rollout_steps = self.model.n_steps * self.training_env.num_envs
+        self.logger.record("profile/rollout_seconds", self.current["rollout"])
+        self.logger.record("profile/env_step_seconds", self.current["env_step"])
+        self.logger.record("profile/env_reset_seconds", self.current["env_reset"])
+        self.logger.record("profile/policy_rollout_seconds", self.current["rollout"] - self.current["env_step"] - self.current["env_reset"])
+        self.logger.record("profile/rollout_steps_per_second", rollout_steps / max(self.current["rollout"], 1e-9))
+        self.optimization_start = time.perf_counter()
+
+    def summary(self):
+        """
+        Function to summarise the recorded updates
+
+        Returns:
+            summary (dict): number of updates, environment steps and resets, total and mean seconds of every section and its share of the training time
+        """
+        totals = {section: float(np.sum([update[section] for update in self.updates])) for section in PROFILE_SECTIONS}
+        totals["policy_rollout"] = totals["rollout"] - totals["env_step"] - totals["env_reset"]
+        training_seconds = totals["rollout"] + totals["optimization"]
+        return {
+            "updates": len(self.updates),
+            "env_steps": self.counts["env_step"],
+            "env_resets": self.counts["env_reset"],
+            "total_seconds": totals,
+            "mean_update_seconds": {section: value / max(len(self.updates), 1) for section, value in totals.items()},
+            "share_of_training": {section: value / max(training_seconds, 1e-9) for section, value in totals.items() if section != "rollout"},
+            "mean_env_step_seconds": totals["env_step"] / max(self.counts["env_step"], 1),
+            "mean_env_reset_seconds": totals["env_reset"] / max(self.counts["env_reset"], 1),
+        }
+
+    def _on_training_end(self):
+        self._finish_optimization()
+        self.logger.dump(self.num_timesteps)
+        for env in self.patched_envs:
+            vars(env).pop("step", None)
+            vars(env).pop("reset", None)
+        self.patched_envs = []
+
+        summary = self.summary()
+        log_dir = self.logger.get_dir()
+        if log_dir is not None:
+            with open(os.path.join(log_dir, self.summary_name), 'w') as file:
+                json.dump(summary, file, indent=4)
+        if self.verbose >= 1:
+            print(json.dumps(summary, indent=4))
+
+
+if __name__ == "__main__":
+    pass
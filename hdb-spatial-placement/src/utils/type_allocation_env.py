@@ -1,6 +1,6 @@
 # Imports
 import numpy as np
-import matplotlib.pyplot as plt
+from typing import NamedTuple
 
 from scipy.spatial.distance import cdist
 from scipy.ndimage import distance_transform_edt
@@ -10,9 +10,25 @@ import gymnasium as gym
 from gymnasium import spaces
 
 from src.utils.procedural_generation_env import proceduralGeneratedEnv
+from src.utils.metrics import record_latency
+from src.utils.dtype_policy import EMBEDDING_DTYPE
+
+class allocationEnvState(NamedTuple):
+    """
+    Snapshot of the mutable state of plantTypeAllocationEnv
+    The arrays are shared with the environment, which copies an array before its next write to it (copy-on-write)
+    """
+    current_step: int
+    grid: np.ndarray
+    result_grid: np.ndarray
+    embeded_planting_coords: np.ndarray
+    coordinates: tuple # (Tree, Shrubs) tuples of (y,x) coordinates
+    class_count: tuple
+    class_density: tuple
+
 
 class plantTypeAllocationEnv(gym.Env):
-    def __init__(self, octave:float, theme:int, seed:int=None, grid_size:tuple=(100,100)):
+    def __init__(self, octave:float, theme:int, seed:int=None, grid_size:tuple=(100,100), rng:np.random.Generator=None, origin:tuple=(0, 0), site_size:tuple=None):
         """
         Environment Class for Plant Type Allocation Model
         Assign each planting coordinate to be either a Tree, Shrub or do not plant
@@ -22,6 +38,9 @@ class plantTypeAllocationEnv(gym.Env):
             theme (int): either 0 or 1, 0 for road while 1 for walkway
             seed (int, optional): environment seed to recreate the same environment. Defaults to None.
             grid_size (tuple, optional): (w,h) of environment grid. Defaults to (100,100).
+            rng (np.random.Generator, optional): generator used for the environment randomness. Defaults to None (new unseeded generator).
+            origin (tuple, optional): (y,x) of the environment within a larger site when it is a tile of the site. Defaults to (0, 0).
+            site_size (tuple, optional): (w,h) of the site the environment is a tile of. Defaults to None (the environment is the whole site).
         """
         super(plantTypeAllocationEnv, self).__init__()
 
@@ -42,14 +61,16 @@ class plantTypeAllocationEnv(gym.Env):
 
         # Create environment grid
         self.maximum_planting_spots = ((self.grid_size[0] - 2*self.padded_boundary)//self.minimum_distance + 1)**2
-        self.env = proceduralGeneratedEnv(octave, seed, grid_size, self.minimum_distance, self.padded_boundary)
+        self.env = proceduralGeneratedEnv(octave, seed, grid_size, self.minimum_distance, self.padded_boundary, rng, origin, site_size)
         self.boundary, self.filled_boundary, self.grid, self.planting_coordinates = self.env.create_environment()
+        self.planting_coordinates = self._limit_planting_coordinates(self.planting_coordinates)
 
         # Class Data
         # In y,x coordinates, need to be modified
+        # Tuples so snapshots can share them, a coordinate is added by creating a new tuple
         self.coordinates = {
-            "Tree": [],
-            "Shrubs" : []
+            "Tree": (),
+            "Shrubs" : ()
         }
         self.class_count = {0:0, 1:0, 2:0}
         self.class_density = {0:0.0, 1:0.0, 2:0.0}
@@ -62,6 +83,71 @@ class plantTypeAllocationEnv(gym.Env):
         self.observation_space = spaces.Box(low=-1, high=100, shape=(self.maximum_planting_spots, 3), dtype=np.float32)
         self.action_space = spaces.MultiDiscrete([self.maximum_planting_spots, 3])
 
+        # Arrays shared with a snapshot, copied before they are written to
+        self.shared_arrays = set()
+        # Seeded environments always reset to this state instead of generating the environment again
+        self.initial_state = self.snapshot()
+
+    def snapshot(self):
+        """
+        Function to capture the mutable state of the environment without copying any array
+        The arrays are shared with the snapshot and copied by the environment before its next write to them
+
+        Returns:
+            state (allocationEnvState): state to return to with restore
+        """
+        self.shared_arrays = {"grid", "result_grid", "embeded_planting_coords"}
+        return allocationEnvState(
+            self.current_step, self.grid, self.result_grid, self.embeded_planting_coords,
+            (self.coordinates["Tree"], self.coordinates["Shrubs"]),
+            tuple(self.class_count.values()), tuple(self.class_density.values())
+        )
+
+    def restore(self, state:allocationEnvState):
+        """
+        Function to return the environment to a snapshot, the snapshot can be restored again afterwards
+
+        Args:
+            state (allocationEnvState): state from snapshot
+        """
+        self.current_step = state.current_step
+        self.grid, self.result_grid, self.embeded_planting_coords = state.grid, state.result_grid, state.embeded_planting_coords
+        self.coordinates = {"Tree": state.coordinates[0], "Shrubs": state.coordinates[1]}
+        self.class_count = dict(enumerate(state.class_count))
+        self.class_density = dict(enumerate(state.class_density))
+        self.shared_arrays = {"grid", "result_grid", "embeded_planting_coords"}
+
+    def _own_array(self, name:str):
+        """
+        Function to copy an array shared with a snapshot before it is written to
+
+        Args:
+            name (str): attribute name of the array
+        """
+        if name in self.shared_arrays:
+            setattr(self, name, getattr(self, name).copy())
+            self.shared_arrays.discard(name)
+
+    def _limit_planting_coordinates(self, planting_coordinates:np.ndarray):
+        """
+        Function to keep at most self.maximum_planting_spots planting coordinates, the observation size of the policy
+        Only tiles of a large site (not padded on every side) can exceed it, the coordinates furthest from the centre are dropped
+        as they lie in the overlap with the neighbouring tiles
+
+        Args:
+            planting_coordinates (np.ndarray): (num_planting_coord, 2) planting coordinates in (y,x)
+
+        Returns:
+            planting_coordinates (np.ndarray): at most self.maximum_planting_spots planting coordinates in (y,x), in their original order
+        """
+        if len(planting_coordinates) <= self.maximum_planting_spots:
+            return planting_coordinates
+        centre = (np.array(self.grid_size[::-1]) - 1) / 2
+        distance_from_centre = np.linalg.norm(planting_coordinates - centre, axis=1)
+        kept_indices = np.sort(np.argsort(distance_from_centre, kind="stable")[:self.maximum_planting_spots])
+        return planting_coordinates[kept_indices]
+
+    @record_latency("_embed_coordinates")
     def _embed_coordinates(self):
         """
         Function to convert planting coordinates into their respective embedding
@@ -140,7 +226,7 @@ class plantTypeAllocationEnv(gym.Env):
         
         self.result_grid = embed_planting_list[:, 6:]
 
-        return embed_planting_list.astype(np.int64)
+        return embed_planting_list.astype(EMBEDDING_DTYPE)
 
     def _distance_from_centre(self):
         """
@@ -196,7 +282,7 @@ class plantTypeAllocationEnv(gym.Env):
             ycoord (int): y coordinate
         """
         # Get all current tree coordinates
-        new_tree_coordinates = np.array(self.coordinates['Tree'] + [[ycoord, xcoord]])
+        new_tree_coordinates = np.array(self.coordinates['Tree'] + ((ycoord, xcoord),))
         # Calculate the distance of all planting coordinates from existing tree coordinates
         coordinate_distances = cdist(self.planting_coordinates, new_tree_coordinates, metric='euclidean')
         min_distances = np.min(coordinate_distances, axis=1)
@@ -211,14 +297,20 @@ class plantTypeAllocationEnv(gym.Env):
         """
         Reset environment
         """
+        # Seeded environments generate the same grid every time, return to the initial state instead
+        if self.seed is not None:
+            self.restore(self.initial_state)
+            return self._get_observation() , {}
+
         self.current_step = 0
         self.coordinates = {
-                    "Tree": [],
-                    "Shrubs" : []
+                    "Tree": (),
+                    "Shrubs" : ()
                 }        
         self.class_count = {0:0, 1:0, 2:0}
         self.class_density = {0:0.0, 1:0.0, 2:0.0}
         self.boundary, self.filled_boundary, self.grid, self.planting_coordinates = self.env.create_environment()
+        self.planting_coordinates = self._limit_planting_coordinates(self.planting_coordinates)
         self.result_grid = np.full(((self.maximum_planting_spots), 3), -1, dtype=np.float32)
         self.embeded_planting_coords = self._embed_coordinates()
         return self._get_observation() , {}
@@ -236,13 +328,15 @@ class plantTypeAllocationEnv(gym.Env):
         reward = self.result_grid[chosen_index, class_value]
 
         if reward >= 0:
+            self._own_array("grid")
+            self._own_array("result_grid")
             # Update coordinate values
             if class_value == 0:
-                self.coordinates['Tree'].append((chosen_value[1], chosen_value[0]))
+                self.coordinates['Tree'] += ((chosen_value[1], chosen_value[0]),)
                 self._update_tree_distance()   
 
             elif class_value == 1:
-                self.coordinates['Shrubs'].append((chosen_value[1], chosen_value[0]))
+                self.coordinates['Shrubs'] += ((chosen_value[1], chosen_value[0]),)
 
             # Update grid
             self.grid[chosen_value[1], chosen_value[0]] = class_value + 2
@@ -258,6 +352,7 @@ class plantTypeAllocationEnv(gym.Env):
         """
         Function to update which coordinates are now no longer plantable after planting a new tree coordinate
         """
+        self._own_array("embeded_planting_coords")
         tree_coordinates = np.array(self.coordinates['Tree'])
         # Get distance from all planting coordinates to all tree coordinates
         coordinate_distances = cdist(self.planting_coordinates, tree_coordinates, metric='euclidean')
@@ -311,8 +406,9 @@ class plantTypeAllocationEnv(gym.Env):
         """
         
         # Swap the (y, x) to (x, y) coordinates only for the output (not the grid mapping)
+        # Coordinates are python ints so they do not depend on the embedding dtype
         updated_coordinates = {
-            key: [(x, y) for y, x in value] if key == "Shrubs" else value  # Flip only Shrubs, keep Tree as it is
+            key: [(int(x), int(y)) for y, x in value] if key == "Shrubs" else [(int(y), int(x)) for y, x in value]  # Flip only Shrubs, keep Tree as it is
             for key, value in self.coordinates.items()
         }
 
@@ -335,6 +431,9 @@ class plantTypeAllocationEnv(gym.Env):
             only_plant (bool, optional): Show only planted spots, NA is not shown. Defaults to False.
             show_coord (bool, optional): Show reward values. Defaults to False.
         """
+        # Plotting is only used for debugging, import lazily to keep service startup fast
+        import matplotlib.pyplot as plt
+
         value_to_colour_all = {
             0: (169/255, 169/255, 169/255),
             1: (1, 0, 0),
@@ -1,5 +1,24 @@
 import requests
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def metric_value(name:str, labels:str=""):
+    """
+    Function to read a metric of the /metrics endpoint
+
+    Args:
+        name (str): metric name
+        labels (str, optional): label set of the metric (eg. {endpoint="generate_composition"}). Defaults to "".
+
+    Returns:
+        value (float): value of the metric, 0 if it has not been recorded yet
+    """
+    metrics = requests.get("http://localhost:8001/metrics").text
+    for line in metrics.splitlines():
+        if line.startswith(f"{name}{labels} "):
+            return float(line.split(" ")[-1])
+    return 0.0
 
 def test_valid():
     """
@@ -24,9 +43,242 @@ def test_invalid():
     r = requests.post(url, json=api_call)
     print(f"Invalid /generate_composition endpoint status: {r.status_code}, res: {r.json()}")
 
+def test_concurrent(num_requests:int=3):
+    """
+    Function to test that concurrent compositions do not block the health endpoint
+    """
+    url = "http://localhost:8001/generate_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+
+    with ThreadPoolExecutor(max_workers=num_requests) as executor:
+        start = time.time()
+        futures = [executor.submit(requests.post, url, json=api_call) for _ in range(num_requests)]
+        # Health check while the compositions are running
+        time.sleep(0.5)
+        health_start = time.time()
+        health = requests.get("http://localhost:8001/")
+        health_time = time.time() - health_start
+        status_codes = [future.result().status_code for future in futures]
+        total_time = time.time() - start
+
+    print(f"Concurrent /generate_composition status: {status_codes}, total time: {total_time:.2f}s, health status: {health.status_code} in {health_time*1000:.1f}ms")
+
+def test_seeded_cache():
+    """
+    Function to test that seeded compositions are deterministic and served from the cache
+    """
+    url = "http://localhost:8001/generate_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+    api_call["seed"] = 42
+
+    start = time.time()
+    first = requests.post(url, json=api_call)
+    first_time = time.time() - start
+    start = time.time()
+    second = requests.post(url, json=api_call)
+    second_time = time.time() - start
+    cache_stats = requests.get("http://localhost:8001/composition_cache").json()
+    print(f"Seeded /generate_composition identical: {first.json() == second.json()}, first: {first_time:.2f}s, cached: {second_time*1000:.1f}ms, cache: {cache_stats}")
+
+def test_coalescing(num_requests:int=3):
+    """
+    Function to test that concurrent identical requests are coalesced into one set of compositions on the worker pool
+    """
+    url = "http://localhost:8001/generate_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+    # New seed so the request is not answered from the cache
+    api_call["seed"] = int(time.time())
+
+    coalesced = metric_value("spatial_coalesced_requests_total", '{endpoint="generate_composition"}')
+    compositions = metric_value("spatial_composition_attempts_count")
+    with ThreadPoolExecutor(max_workers=num_requests) as executor:
+        responses = list(executor.map(lambda _: requests.post(url, json=api_call), range(num_requests)))
+    coalesced = metric_value("spatial_coalesced_requests_total", '{endpoint="generate_composition"}') - coalesced
+    compositions = metric_value("spatial_composition_attempts_count") - compositions
+
+    identical = all(r.json() == responses[0].json() for r in responses)
+    print(f"Coalesced /generate_composition status: {[r.status_code for r in responses]}, identical: {identical}, coalesced requests: {coalesced:.0f}, compositions generated: {compositions:.0f}")
+    assert identical and coalesced == num_requests - 1 and compositions == len(responses[0].json()["data"])
+
+def test_admission(extra_requests:int=3):
+    """
+    Function to test that a burst larger than the admission queue is rejected with a 429 or 503 and a Retry-After header
+    The burst has extra_requests more requests than the service can run and queue, read from its admission limits in /metrics
+    """
+    url = "http://localhost:8001/generate_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+    max_concurrent = int(metric_value("spatial_admission_max_concurrent"))
+    if max_concurrent <= 0:
+        print("Burst /generate_composition skipped, admission control is disabled")
+        return
+    num_requests = max_concurrent + int(metric_value("spatial_admission_max_queued")) + extra_requests
+    # Distinct seeds so the requests are neither coalesced nor cached
+    seed = int(time.time()) * num_requests
+
+    with ThreadPoolExecutor(max_workers=num_requests) as executor:
+        responses = list(executor.map(lambda counter: requests.post(url, json={**api_call, "seed": seed + counter}), range(num_requests)))
+    rejected = [r for r in responses if r.status_code in (429, 503)]
+
+    print(f"Burst /generate_composition of {num_requests} requests status: {[r.status_code for r in responses]}, Retry-After: {[r.headers.get('Retry-After') for r in rejected]}")
+    assert rejected and all(r.headers.get("Retry-After", "").isdigit() for r in rejected)
+    assert all(r.status_code in (200, 429, 503) for r in responses)
+
+def test_stream():
+    """
+    Function to test the streaming api, each composition should arrive as soon as it is generated
+    """
+    url = "http://localhost:8001/generate_composition_stream"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+
+    start = time.time()
+    with requests.post(url, json=api_call, stream=True) as r:
+        for line in r.iter_lines():
+            if line:
+                composition = json.loads(line)
+                print(f"Streamed composition {composition['data_value']} after {time.time() - start:.2f}s, status: {r.status_code}")
+
+def test_batch():
+    """
+    Function to test the batch api, the invalid job should be reported without failing the batch
+    """
+    url = "http://localhost:8001/generate_composition_batch"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+
+    jobs = [
+        {**api_call, "job_id": "site_a", "count": 1},
+        {**api_call, "job_id": "site_b", "style": "Naturalistic", "surrounding": "Road", "count": 2, "seed": 7},
+        {"job_id": "invalid_site", "style": None, "surrounding": None, "plant_palette": []}
+    ]
+    r = requests.post(url, json={"jobs": jobs})
+    response = r.json()
+    composition_counts = {job_id: len(result["data"]) for job_id, result in response["results"].items()}
+    print(f"Batch /generate_composition_batch status: {r.status_code}, compositions: {composition_counts}, errors: {response['errors']}")
+
+def test_jobs():
+    """
+    Function to test the asynchronous job api, a job is polled until completion and a second job is cancelled
+    """
+    url = "http://localhost:8001/composition_jobs"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+
+    job_id = requests.post(url, json={**api_call, "count": 2}).json()["job_id"]
+    cancelled_job_id = requests.post(url, json=api_call).json()["job_id"]
+    cancelled_job = requests.delete(f"{url}/{cancelled_job_id}").json()
+
+    while True:
+        job = requests.get(f"{url}/{job_id}").json()
+        print(f"Job {job_id} status: {job['status']}, progress: {job['progress']}, stages: {job['stages']}")
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(1)
+
+    r = requests.get(f"{url}/{job_id}/result")
+    print(f"Job result status: {r.status_code}, compositions: {len(r.json()['data'])}, cancelled job status: {cancelled_job['status']}")
+
+def test_recompose():
+    """
+    Function to test the recompose api, a same category swap is relabelled while a shrub that changes border suitability is recomposed by a worker
+    """
+    url = "http://localhost:8001/recompose_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+    api_call["seed"] = 11
+    # The hatching state is only kept when requested
+    api_call["recomposable"] = True
+
+    generated = requests.post("http://localhost:8001/generate_composition", json=api_call)
+    cache_key = generated.headers["X-Composition-Cache-Key"]
+    palette = api_call["plant_palette"]
+    # Shrubs used in the first composition
+    placed_species = set(generated.json()["data"][0]["coordinates"].values())
+    shrubs = [plant for plant in palette if "Shrub" in plant["Plant Type"] and plant["Species ID"] in placed_species]
+
+    # Same hatching category, only the species changes
+    renamed_plant = {**shrubs[0], "Species ID": 9001}
+    start = time.time()
+    r = requests.post(url, json={"cache_key": cache_key, "data_value": 0, "plant_palette": palette, "previous_species_id": shrubs[0]["Species ID"], "new_plant": renamed_plant})
+    relabel_time = time.time() - start
+    relabelled = r.json()
+    print(f"Relabel /recompose_composition status: {r.status_code} in {relabel_time*1000:.1f}ms, species: {sorted(set(relabelled['coordinates'].values()))}")
+
+    # Shrub with the opposite border suitability, the hatching assignment is recomputed
+    palette = [renamed_plant if plant is shrubs[0] else plant for plant in palette]
+    previous_plant = renamed_plant if shrubs[-1] is shrubs[0] else shrubs[-1]
+    border_plant = {**previous_plant, "Species ID": 9002, "Hazard": "-" if previous_plant["Hazard"] != "-" else "Irritant"}
+    start = time.time()
+    r = requests.post(url, json={"composition": relabelled, "plant_palette": palette, "previous_species_id": previous_plant["Species ID"], "new_plant": border_plant})
+    recompose_time = time.time() - start
+    recomposed = r.json()
+    print(f"Recompose /recompose_composition status: {r.status_code} in {recompose_time:.2f}s, species: {sorted(set(recomposed['coordinates'].values()))}")
+
+def test_site_composition():
+    """
+    Function to test the large site api, trees should be at least 50 cells apart across the tile seams
+    """
+    url = "http://localhost:8001/generate_site_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+    api_call["site_size"] = [260, 180]
+    api_call["seed"] = 3
+
+    start = time.time()
+    r = requests.post(url, json=api_call)
+    site_time = time.time() - start
+    response = r.json()
+    grid = response["grid"]
+    trees = [(y, x) for y, row in enumerate(grid) for x, value in enumerate(row) if value == 2]
+    tree_spacing = min([((y1 - y2)**2 + (x1 - x2)**2)**0.5 for i, (y1, x1) in enumerate(trees) for y2, x2 in trees[i + 1:]], default=None)
+    print(f"Site /generate_site_composition status: {r.status_code} in {site_time:.2f}s, grid: {len(grid)}x{len(grid[0])}, tiles: {response['tiles']}, coordinates: {len(response['coordinates'])}, minimum tree spacing: {tree_spacing}, seam adjustments: {response['seam_adjustments']}")
+
+def test_render():
+    """
+    Function to test the render api, the second render of the same composition should come from the render cache
+    """
+    url = "http://localhost:8001/render_composition"
+    with open('./tests/mock_input.json', 'r') as file:
+        api_call = json.load(file)
+    api_call["seed"] = 13
+
+    generated = requests.post("http://localhost:8001/generate_composition", json=api_call)
+    cache_key = generated.headers["X-Composition-Cache-Key"]
+    for layer in ["tree", "shrub"]:
+        for attempt in range(2):
+            start = time.time()
+            r = requests.post(url, json={"cache_key": cache_key, "data_value": 0, "plant_palette": api_call["plant_palette"], "layer": layer})
+            render_time = time.time() - start
+            print(f"Render /render_composition {layer} status: {r.status_code} in {render_time*1000:.1f}ms, {r.headers['content-type']}, {len(r.content)} bytes, cache: {r.headers.get('X-Render-Cache')}")
+
+    # Malformed compositions given directly are rejected with a 422
+    invalid_compositions = {
+        "coordinate key": {"grid": [[1, 2], [1, 1]], "coordinates": {"0,1": 1}},
+        "ragged grid": {"grid": [[1, 2], [1]], "coordinates": {}},
+        "oversized grid": {"grid": [[1] * 1000] * 1000, "coordinates": {}}
+    }
+    for name, composition in invalid_compositions.items():
+        r = requests.post(url, json={"composition": composition, "plant_palette": []})
+        print(f"Invalid {name} /render_composition status: {r.status_code}, res: {r.json()}")
+
+
 
 if __name__ == "__main__":
     test_valid()
     test_invalid()
+    test_concurrent()
+    test_seeded_cache()
+    test_coalescing()
+    test_admission()
+    test_stream()
+    test_batch()
+    test_jobs()
+    test_recompose()
+    test_site_composition()
+    test_render()
 
 
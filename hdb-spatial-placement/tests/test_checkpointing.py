@@ -0,0 +1,108 @@
+# Regression test for preempted training runs, runs in process (the service does not need to be running)
+import os
+import sys
+import signal
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback, CallbackList
+from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.logger import configure
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.train import make_env, build_model, train_model
+from src.utils.type_allocation_env import plantTypeAllocationEnv
+from src.utils.checkpointing import trainingCheckpointCallback, list_checkpoints, load_checkpoint
+from src.utils.training_profiler import trainingProfilerCallback
+
+SERVED_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "models", "plantTypeAllocationModel.zip")
+
+class sigtermCallback(BaseCallback):
+    def __init__(self, after_steps:int):
+        """
+        Callback sending SIGTERM to the training process after a number of steps, like a preempted node
+
+        Args:
+            after_steps (int): number of steps before SIGTERM is sent
+        """
+        super().__init__()
+        self.after_steps = after_steps
+
+    def _on_step(self):
+        if self.n_calls == self.after_steps:
+            os.kill(os.getpid(), signal.SIGTERM)
+        return True
+
+
+def file_hash(path:str):
+    """
+    Returns:
+        digest (str): sha256 of the file
+    """
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def test_sigterm_keeps_served_model():
+    """
+    Function to test that a training run stopped by SIGTERM saves a checkpoint without overwriting the served model
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        # Copy of the served model, training writes to it like src.train writes to ./src/models/<model_name>
+        model_path = os.path.join(folder, "plantTypeAllocationModel.zip")
+        shutil.copy(SERVED_MODEL_PATH, model_path)
+        served_hash = file_hash(model_path)
+
+        n_steps, n_env = 4, 2
+        envs = DummyVecEnv([make_env(plantTypeAllocationEnv(1.5, 0, 10, rng=np.random.default_rng(env))) for env in range(n_env)])
+        model = build_model(envs, n_steps, n_env, None, seed=0)
+        checkpoint_dir = os.path.join(folder, "checkpoints")
+        checkpoint_callback = trainingCheckpointCallback(checkpoint_dir, save_freq=100)
+
+        saved = train_model(model, 100, n_steps * n_env, model_path, CallbackList([sigtermCallback(6), checkpoint_callback]),
+                            progress_bar=False, checkpoint_callback=checkpoint_callback)
+
+        checkpoints = list_checkpoints(checkpoint_dir)
+        unchanged = file_hash(model_path) == served_hash
+        print(f"SIGTERM training run: preempted {checkpoint_callback.preempted}, saved {saved}, served model unchanged {unchanged}, checkpoints {[os.path.basename(path) for path in checkpoints]}")
+        assert checkpoint_callback.preempted and not saved
+        assert unchanged, "A preempted training run overwrote the served model"
+        assert checkpoints, "A preempted training run did not save a checkpoint"
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def test_checkpoint_while_profiling():
+    """
+    Function to test that checkpoints are saved and resumed while trainingProfilerCallback times the environment methods
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        n_steps, n_env = 4, 2
+        envs = DummyVecEnv([make_env(plantTypeAllocationEnv(1.5, 0, 10, rng=np.random.default_rng(env))) for env in range(n_env)])
+        model = build_model(envs, n_steps, n_env, None, seed=0)
+        model.set_logger(configure(folder, []))
+        checkpoint_dir = os.path.join(folder, "checkpoints")
+        profiler_callback = trainingProfilerCallback()
+        checkpoint_callback = trainingCheckpointCallback(checkpoint_dir, save_freq=1)
+
+        model.learn(total_timesteps=3 * n_steps * n_env, callback=CallbackList([profiler_callback, checkpoint_callback]))
+
+        checkpoints = list_checkpoints(checkpoint_dir)
+        resumed = load_checkpoint(checkpoints[-1])
+        timed_methods = [name for env in resumed.get_env().envs for name in ("step", "reset") if name in vars(env)]
+        print(f"Profiled training run: checkpoints {[os.path.basename(path) for path in checkpoints]}, env steps timed {profiler_callback.counts['env_step']}, timed methods in the checkpoint {timed_methods}")
+        assert checkpoints, "No checkpoint was saved while profiling"
+        assert not timed_methods, "The profiler timers were saved with the checkpoint"
+        resumed.learn(total_timesteps=n_steps * n_env, reset_num_timesteps=False)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_sigterm_keeps_served_model()
+    test_checkpoint_while_profiling()
@@ -0,0 +1,315 @@
+# Microbenchmark and golden output regression tests for plantHatchingAndAssignment
+# Runs in process (the service does not need to be running)
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.procedural_generation_env import proceduralGeneratedEnv
+from src.utils.plant_hatching_assignment import plantHatchingAndAssignment
+
+MOCK_INPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_input.json")
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "hatching_golden.npz")
+
+# Benchmark grid: palette sizes x themes x grid sizes
+PALETTE_SIZES = (3, 6, 10, 20)
+THEMES = ("Naturalistic", "Manicured")
+GRID_SIZES = ((60, 60), (100, 100), (150, 150))
+
+# (palette size, theme, grid size, seed) cases stored in the golden file
+GOLDEN_CASES = [
+    (3, "Naturalistic", (100, 100), 0),
+    (6, "Naturalistic", (100, 100), 1),
+    (6, "Manicured", (100, 100), 2),
+    (20, "Naturalistic", (100, 100), 3),
+    (20, "Manicured", (100, 100), 4),
+    (10, "Naturalistic", (150, 150), 5),
+]
+
+def make_palette(size:int):
+    """
+    Function to create a plant palette of the given size from tests/mock_input.json
+    Shrubs and trees are alternated so every palette has both, plants are cycled through and renamed so every species in the palette is unique
+
+    Args:
+        size (int): number of species in the palette
+
+    Returns:
+        palette (list): plant palette in the UI format
+    """
+    with open(MOCK_INPUT_PATH, 'r') as file:
+        mock_palette = json.load(file)["plant_palette"]
+    trees = [plant for plant in mock_palette if "Tree" in plant["Plant Type"]]
+    shrubs = [plant for plant in mock_palette if "Tree" not in plant["Plant Type"]]
+    mock_palette = [plant for pair in zip(shrubs, trees) for plant in pair] + shrubs[len(trees):] + trees[len(shrubs):]
+
+    palette = []
+    for i in range(size):
+        plant = copy.deepcopy(mock_palette[i % len(mock_palette)])
+        if i >= len(mock_palette):
+            plant["Scientific Name"] = f"{plant['Scientific Name']} {i // len(mock_palette)}"
+            plant["Species ID"] = plant["Species ID"] * 100 + i
+        palette.append(plant)
+    return palette
+
+
+def make_layout(grid_size:tuple, seed:int):
+    """
+    Function to create a seeded layout in the same format as the RL type allocation output
+    The environment comes from procedural generation and planting coordinates are split into trees, shrubs and empty spots with the seeded generator,
+    so layouts of any grid size can be created without the RL model
+
+    Args:
+        grid_size (tuple): (w,h) of the layout
+        seed (int): layout seed
+
+    Returns:
+        grid (np.ndarray): grid of 0 for surrounding, 1 for planting area, 2 for trees and 3 for shrubs
+        coordinates (dict): {Tree: [(y,x)], Shrubs: [(x,y)]} like plantTypeAllocationEnv.retrieve_results
+    """
+    rng = np.random.default_rng(seed)
+    environment = proceduralGeneratedEnv(rng.uniform(1, 2), int(rng.integers(1, 51)), grid_size, 10, 5, rng)
+    _, filled_boundary, _, planting_coordinates = environment.create_environment()
+
+    grid = filled_boundary.copy()
+    coordinates = {"Tree": [], "Shrubs": []}
+    for y, x in planting_coordinates:
+        plant_type = rng.choice(3, p=[0.15, 0.6, 0.25])
+        if plant_type == 0:
+            coordinates["Tree"].append((int(y), int(x)))
+            grid[y, x] = 2
+        elif plant_type == 1:
+            coordinates["Shrubs"].append((int(x), int(y)))
+            grid[y, x] = 3
+    return grid, coordinates
+
+
+def _canonical(value):
+    """
+    Function to convert a stage output into a comparable value, numpy arrays are kept while everything else is converted to sorted JSON
+
+    Args:
+        value: stage output
+
+    Returns:
+        canonical_value (np.ndarray | str): array or JSON string
+    """
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, dict):
+        value = {str(key): value[key] for key in value}
+    return json.dumps(value, sort_keys=True, default=lambda item: item.tolist() if hasattr(item, "tolist") else str(item))
+
+
+def run_stages(layout:tuple, palette:list, theme:str, seed:int):
+    """
+    Function to run the private stages of hatch_allocate_plants one at a time, recording the output and latency of each stage
+
+    Args:
+        layout (tuple): (grid, coordinates) from make_layout
+        palette (list): plant palette
+        theme (str): composition style
+        seed (int): hatching seed
+
+    Returns:
+        outputs (dict): canonical output of every stage
+        timings (dict): latency of every stage in seconds
+    """
+    grid, coordinates = layout
+    outputs, timings = {}, {}
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    hatching = timed("__init__", plantHatchingAndAssignment, grid.copy(), palette, copy.deepcopy(coordinates), theme, None, 0.1, False, np.random.default_rng(seed))
+    outputs["tree_ids"] = _canonical(hatching.tree_id_dict)
+
+    # _generate_hatching
+    seed_to_int_dict = timed("_choose_starter_slots", hatching._choose_starter_slots)
+    outputs["_choose_starter_slots"] = _canonical(seed_to_int_dict)
+    noise_map = timed("_generate_worley_heatmap", hatching._generate_worley_heatmap)
+    noise_grids = timed("_combined_noisemap", hatching._combined_noisemap, noise_map, seed_to_int_dict)
+    heatmaps = timed("_create_heatmaps", hatching._create_heatmaps, noise_grids)
+    hatching_grid = timed("_apply_influence_grids_with_border", hatching._apply_influence_grids_with_border, heatmaps)
+    outputs["_generate_hatching"] = _canonical(hatching_grid)
+
+    # _allocate_plants
+    cleaned_grid = timed("_fill_small_regions", hatching._fill_small_regions, hatching_grid)
+    outputs["_fill_small_regions"] = _canonical(cleaned_grid)
+    seed_dict = timed("_assign_shrubs", hatching._assign_shrubs, cleaned_grid)
+    outputs["_assign_shrubs"] = _canonical(seed_dict)
+    shifted_seeds_dict = timed("_jitter_coordinate", hatching._jitter_coordinate, cleaned_grid, seed_dict)
+    outputs["_jitter_coordinate"] = _canonical(shifted_seeds_dict)
+    cleaned_grid = timed("_remove_empty_regions", hatching._remove_empty_regions, cleaned_grid, shifted_seeds_dict)
+    outputs["_remove_empty_regions"] = _canonical(cleaned_grid)
+    if theme.lower() == "manicured":
+        cleaned_grid, shifted_seeds_dict, mirrored_trees, mirrored_tree_id_dict, _ = timed("_mirror_grid", hatching._mirror_grid, cleaned_grid, shifted_seeds_dict)
+        hatching.tree_radii_dict = mirrored_trees
+        hatching.tree_id_dict = mirrored_tree_id_dict
+        outputs["_mirror_grid"] = _canonical(cleaned_grid)
+        outputs["_mirror_grid.shrubs"] = _canonical(shifted_seeds_dict)
+    seed_mapping = {seed["Seed Number"]: seed["Shrub Name"] for seed in hatching.seed_mapping}
+
+    output_json = timed("_create_json", hatching._create_json, cleaned_grid, shifted_seeds_dict, seed_mapping)
+    outputs["_create_json"] = _canonical(output_json)
+
+    timings["total"] = sum(timings.values())
+    return outputs, timings
+
+
+def _case_name(palette_size:int, theme:str, grid_size:tuple, seed:int):
+    return f"palette{palette_size}_{theme.lower()}_{grid_size[0]}x{grid_size[1]}_seed{seed}"
+
+
+def update_golden_outputs():
+    """
+    Function to regenerate the golden file, only run this when a change is expected to alter the compositions
+    The layouts are stored with the outputs so the golden outputs do not depend on procedural generation
+    """
+    golden = {}
+    for palette_size, theme, grid_size, seed in GOLDEN_CASES:
+        case = _case_name(palette_size, theme, grid_size, seed)
+        grid, coordinates = make_layout(grid_size, seed)
+        outputs, _ = run_stages((grid, coordinates), make_palette(palette_size), theme, seed)
+        golden[f"{case}/layout_grid"] = grid
+        golden[f"{case}/layout_coordinates"] = np.array(json.dumps(coordinates))
+        for stage, output in outputs.items():
+            golden[f"{case}/{stage}"] = np.array(output)
+
+    os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+    np.savez_compressed(GOLDEN_PATH, **golden)
+    print(f"Saved {len(GOLDEN_CASES)} golden cases to {GOLDEN_PATH}")
+
+
+def test_golden_outputs():
+    """
+    Function to check every hatching stage against the stored golden outputs
+    Any optimisation of plantHatchingAndAssignment must keep these identical
+    """
+    golden = np.load(GOLDEN_PATH)
+    mismatches = []
+    for palette_size, theme, grid_size, seed in GOLDEN_CASES:
+        case = _case_name(palette_size, theme, grid_size, seed)
+        grid = golden[f"{case}/layout_grid"]
+        coordinates = {key: [tuple(coordinate) for coordinate in value] for key, value in json.loads(str(golden[f"{case}/layout_coordinates"])).items()}
+        outputs, timings = run_stages((grid, coordinates), make_palette(palette_size), theme, seed)
+
+        stored_stages = sorted(key.split("/", 1)[1] for key in golden.files if key.startswith(f"{case}/") and not key.startswith(f"{case}/layout"))
+        if stored_stages != sorted(outputs):
+            mismatches.append(f"{case}: stages {sorted(outputs)} do not match golden stages {stored_stages}")
+            continue
+        for stage, output in outputs.items():
+            expected = golden[f"{case}/{stage}"]
+            if not np.array_equal(np.array(output), expected):
+                mismatches.append(f"{case}: {stage}")
+        print(f"Golden {case}: {timings['total']:.2f}s")
+
+    print(f"Golden hatching outputs mismatched stages: {mismatches}")
+    assert not mismatches, mismatches
+
+
+def test_stages_match_hatch_allocate_plants():
+    """
+    Function to check that running the stages one at a time gives the same composition as hatch_allocate_plants
+    """
+    palette_size, theme, grid_size, seed = GOLDEN_CASES[2]
+    grid, coordinates = make_layout(grid_size, seed)
+    outputs, _ = run_stages((grid, coordinates), make_palette(palette_size), theme, seed)
+    hatching = plantHatchingAndAssignment(grid.copy(), make_palette(palette_size), copy.deepcopy(coordinates), theme, rng=np.random.default_rng(seed))
+    identical = _canonical(hatching.hatch_allocate_plants()) == outputs["_create_json"]
+    print(f"Stages match hatch_allocate_plants: {identical}")
+    assert identical
+
+
+def test_hatch_variants(variant_count:int=3):
+    """
+    Function to check that hatch_variants returns distinct compositions, the first being the hatch_allocate_plants composition,
+    and to compare its latency against creating every composition from scratch
+    """
+    palette_size, theme, grid_size, seed = GOLDEN_CASES[2]
+    grid, coordinates = make_layout(grid_size, seed)
+    palette = make_palette(palette_size)
+
+    start = time.perf_counter()
+    hatching = plantHatchingAndAssignment(grid.copy(), palette, copy.deepcopy(coordinates), theme, rng=np.random.default_rng(seed))
+    variants = [_canonical(variant) for variant in hatching.hatch_variants(variant_count)]
+    variants_latency = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(variant_count):
+        single = plantHatchingAndAssignment(grid.copy(), palette, copy.deepcopy(coordinates), theme, rng=np.random.default_rng(seed + i))
+        composition = _canonical(single.hatch_allocate_plants())
+        if i == 0:
+            first_composition = composition
+    single_latency = time.perf_counter() - start
+
+    print(f"hatch_variants: {variant_count} variants in {variants_latency:.2f}s, {variant_count} full hatchings in {single_latency:.2f}s, distinct variants: {len(set(variants))}")
+    assert variants[0] == first_composition
+    assert len(set(variants)) == variant_count
+
+
+def benchmark_hatching(repeats:int=3, output_path:str=None):
+    """
+    Function to time every hatching stage across palette sizes, themes and grid sizes
+    The median latency of each stage is printed, slowest stages first
+
+    Args:
+        repeats (int, optional): number of seeded layouts timed for every case. Defaults to 3.
+        output_path (str, optional): JSON file to save the median timings to. Defaults to None.
+
+    Returns:
+        results (dict): {case: {stage: median latency (s)}}
+    """
+    results = {}
+    for grid_size in GRID_SIZES:
+        layouts = [make_layout(grid_size, seed) for seed in range(repeats)]
+        for palette_size in PALETTE_SIZES:
+            palette = make_palette(palette_size)
+            for theme in THEMES:
+                case = f"palette{palette_size}_{theme.lower()}_{grid_size[0]}x{grid_size[1]}"
+                case_timings = [run_stages(layout, palette, theme, seed)[1] for seed, layout in enumerate(layouts)]
+                stages = {stage for timings in case_timings for stage in timings}
+                results[case] = {stage: float(np.median([timings[stage] for timings in case_timings if stage in timings])) for stage in stages}
+
+                slowest = sorted(((stage, latency) for stage, latency in results[case].items() if stage != "total"), key=lambda item: item[1], reverse=True)[:3]
+                print(f"{case}: total {results[case]['total']:.3f}s, slowest " + ", ".join(f"{stage} {latency:.3f}s" for stage, latency in slowest))
+
+    if output_path is not None:
+        with open(output_path, 'w') as file:
+            json.dump(results, file, indent=4)
+    return results
+
+
+def parse_arguments():
+    """
+    Function defining all arguments for the data
+    """
+    parser = argparse.ArgumentParser(description="Hatching microbenchmark and golden output regression tests.")
+
+    # Define the arguments
+    parser.add_argument('--benchmark', action='store_true', help='Run the microbenchmark after the regression tests.')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of seeded layouts timed for every benchmark case, defaults to 3.')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the benchmark timings to, defaults to None (print only).')
+    parser.add_argument('--update_golden', action='store_true', help='Regenerate the golden outputs instead of checking them.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.update_golden:
+        update_golden_outputs()
+    else:
+        test_golden_outputs()
+        test_stages_match_hatch_allocate_plants()
+        test_hatch_variants()
+    if args.benchmark:
+        benchmark_hatching(args.repeats, args.output)